@@ -0,0 +1,111 @@
+import time
+import asyncio
+import argparse
+import functools
+
+import torch
+
+from benchmarks.inference import make_state
+from benchmarks.recorded import load_battles
+from meloetta.actors.base import Actor, ExecutorActor, resolve
+from meloetta.frameworks.nash_ketchum.modelv2 import NAshKetchumModel
+from meloetta.player import Player
+from meloetta.room import BattleRoomPool
+
+
+class ForwardActor(Actor):
+    """Encodes the recorded battle, then pays for a real forward pass on a
+    stand-in state, since the recorded battles are not the model's gen"""
+
+    def __init__(self, forward_fn, state):
+        self.forward_fn = forward_fn
+        self.state = state
+        self.states = []
+
+    @torch.no_grad()
+    def choose_action(self, state, room, choices):
+        self.states.append(state)
+        self.forward_fn(self.state)
+        return print, (), {}
+
+
+async def play(actor, messages, room, lags):
+    player = Player.from_client(None, room)
+    decisions = 0
+    for message in messages:
+        # a websocket read, which is where a blocked loop is felt
+        start = time.perf_counter()
+        await asyncio.sleep(0)
+        lags.append(time.perf_counter() - start)
+
+        action_required = player._recieve(message)
+        if not action_required or player.room.status["ended"]:
+            continue
+        if player.room.status["waiting"]:
+            continue
+        battle = await resolve(actor.get_battle(player.room))
+        vstate = await resolve(actor.get_vectorized_state(player.room, battle))
+        await resolve(actor(vstate, player.room, None))
+        decisions += 1
+    return decisions
+
+
+async def run(actors, battles):
+    pool = BattleRoomPool()
+    lags = []
+    try:
+        start = time.perf_counter()
+        decisions = await asyncio.gather(
+            *[
+                play(actor, messages, pool.room(f"room{i}"), lags)
+                for i, (actor, messages) in enumerate(zip(actors, battles))
+            ]
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.close()
+    return sum(decisions), elapsed, sorted(lags)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sync actors vs ExecutorActor on one event loop"
+    )
+    parser.add_argument("--battles", type=str, default=None, help="glob of battles")
+    parser.add_argument("--concurrent", type=int, default=8)
+    parser.add_argument("--gen", type=int, default=6)
+    args = parser.parse_args()
+
+    recorded = load_battles(args.battles)
+    battles = [recorded[i % len(recorded)] for i in range(args.concurrent)]
+
+    model = NAshKetchumModel(gen=args.gen).eval()
+    forward_fn = functools.partial(
+        model.forward, compute_log_policy=False, compute_value=False
+    )
+    state = make_state(model, args.gen, 0)
+
+    results = {}
+    for name, wrap in (("sync Actor", None), ("ExecutorActor", ExecutorActor)):
+        actors = [ForwardActor(forward_fn, state) for _ in battles]
+        wrapped = actors if wrap is None else [wrap(actor) for actor in actors]
+        decisions, elapsed, lags = asyncio.run(run(wrapped, battles))
+        results[name] = [actor.states for actor in actors]
+        print(
+            f"{name}: {decisions / elapsed:.1f} decisions/s, "
+            f"read stall p50 {1000 * lags[len(lags) // 2]:.2f}ms "
+            f"p99 {1000 * lags[int(len(lags) * 0.99)]:.2f}ms "
+            f"max {1000 * lags[-1]:.1f}ms"
+        )
+
+    for sync_states, async_states in zip(*results.values()):
+        assert len(sync_states) == len(async_states)
+        for expected, actual in zip(sync_states, async_states):
+            assert expected.keys() == actual.keys()
+            for key, value in expected.items():
+                assert torch.equal(value, actual[key]), key
+    print("every battle encoded the same states either way")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import time
+import argparse
+
+import torch
+
+from benchmarks.recorded import load_battles, replay
+from meloetta.vector import VectorizedState
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="engine.exportState vs JSON.decycle + deserialize"
+    )
+    parser.add_argument("--battles", type=str, default=None, help="glob of battles")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    full_time = 0
+    export_time = 0
+    decisions = 0
+
+    for messages in load_battles(args.battles):
+        for player, _, action_required in replay(messages):
+            if not action_required or player.room.get_js_attr("battle?.ended"):
+                continue
+
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                full = player.room.get_full_battle()
+            full_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                battle = player.room.get_battle()
+            export_time += time.perf_counter() - start
+
+            # both paths have to vectorize to the same state
+            expected = VectorizedState.from_battle(player.room, full).to_dict()
+            actual = VectorizedState.from_battle(player.room, battle).to_dict()
+            for key, value in expected.items():
+                assert torch.equal(value, actual[key]), key
+
+            decisions += 1
+
+    calls = decisions * args.repeats
+    print(f"{decisions} decisions")
+    print(f"serializeBattle + deserialize: {1000 * full_time / calls:.2f}ms")
+    print(f"exportState + decode_state: {1000 * export_time / calls:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import time
+import argparse
+
+from benchmarks.recorded import load_battles
+from meloetta.room import BattleRoom
+
+
+def per_attribute(room: BattleRoom, data: str):
+    """The calls the worker loop used to make for every message"""
+    room.recieve(data)
+    action_required = None
+    if any(prefix in data for prefix in {"|turn", "|teampreview"}):
+        action_required = True
+    elif "|request" not in data:
+        action_required = room.get_js_attr("request?.forceSwitch")
+    if action_required:
+        room.get_battle()
+        room.get_js_attr("battle.tier")
+        room.get_js_attr("battle.gameType")
+        room.get_js_attr("choice")
+    room.get_js_attr("battle?.ended")
+    room.get_js_attr("controls.controls")
+    room.get_js_attr("outgoing_message")
+
+
+def stepped(room: BattleRoom, data: str):
+    room.step(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="engine.step vs per attribute calls")
+    parser.add_argument("--battles", type=str, default=None, help="glob of battles")
+    args = parser.parse_args()
+
+    battles = [
+        [message[message.index("\n") + 1 :] for message in messages]
+        for messages in load_battles(args.battles)
+    ]
+    room = BattleRoom()
+    for name, fn in [("per attribute", per_attribute), ("engine.step", stepped)]:
+        count = 0
+        start = time.perf_counter()
+        for messages in battles:
+            room.reset()
+            for data in messages:
+                fn(room, data)
+                count += 1
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {1000 * elapsed / count:.3f}ms per message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import time
+import random
+import argparse
+
+from collections import Counter
+
+import torch
+
+from benchmarks.recorded import load_battles, replay
+from meloetta.player import ChoiceBuilder, Choices
+
+
+def _equal(a, b) -> bool:
+    if isinstance(a, torch.Tensor) or isinstance(b, torch.Tensor):
+        return (
+            isinstance(a, torch.Tensor)
+            and isinstance(b, torch.Tensor)
+            and a.shape == b.shape
+            and torch.equal(a, b)
+        )
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def assert_equivalent(expected: Choices, actual: Choices):
+    assert _equal(expected.targeting, actual.targeting)
+    assert _equal(expected.prev_choices, actual.prev_choices)
+    assert _equal(expected.action_masks, actual.action_masks)
+    assert expected.choices.keys() == actual.choices.keys()
+    for key, options in expected.choices.items():
+        assert options.keys() == actual.choices[key].keys(), key
+        for index, (func, args, kwargs) in options.items():
+            other_func, other_args, other_kwargs = actual.choices[key][index]
+            assert func == other_func and args == other_args, (key, index)
+            assert kwargs == other_kwargs, (key, index)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Choices from the client's options vs from the controls html"
+    )
+    parser.add_argument("--battles", type=str, default=None, help="glob of battles")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    html_time = 0
+    options_time = 0
+    decisions = 0
+    kinds = Counter()
+
+    for messages in load_battles(args.battles):
+        for player, _, action_required in replay(messages):
+            room = player.room
+            while (
+                action_required
+                and not room.status["waiting"]
+                and not room.status["ended"]
+            ):
+                start = time.perf_counter()
+                expected = ChoiceBuilder(room, from_html=True).get_choices()
+                html_time += time.perf_counter() - start
+
+                start = time.perf_counter()
+                actual = ChoiceBuilder(room).get_choices()
+                options_time += time.perf_counter() - start
+
+                assert_equivalent(expected, actual)
+                decisions += 1
+                kinds.update(key for key, options in actual.choices.items() if options)
+
+                # walk every step of multi-pokemon decisions too
+                options = [
+                    option
+                    for key in sorted(actual.choices)
+                    for option in actual.choices[key].values()
+                ]
+                func, func_args, func_kwargs = random.choice(options)
+                func(*func_args, **func_kwargs)
+            room.pop_outgoing()
+
+    print(f"{decisions} choice states, all equivalent")
+    print(", ".join(f"{count} with {kind}" for kind, count in sorted(kinds.items())))
+    print(f"from html: {1000 * html_time / decisions:.2f}ms")
+    print(f"from options: {1000 * options_time / decisions:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+import torch
+
+from meloetta.embeddings import get_pretrained_path, load_embeddings
+
+DEXES = ["pokedex", "abilitydex", "movedex", "itemdex"]
+
+CHILD = """
+import sys
+import torch
+from meloetta.embeddings import get_pretrained_path, load_embeddings
+tables = []
+for dex in {dexes!r}:
+    if {mmap!r} is None:
+        continue
+    if {mmap!r}:
+        tables.append(load_embeddings({gen}, dex))
+    else:
+        tables.append(torch.load(get_pretrained_path({gen}, dex))[1].float())
+print("ready", flush=True)
+sys.stdin.read()
+"""
+
+
+def _pss(pid: int) -> float:
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure_processes(gen: int, dexes, processes: int, mmap: bool = None) -> float:
+    """Total proportional set size of `processes` actors holding the tables,
+    or none of them if `mmap` is None"""
+    code = CHILD.format(dexes=dexes, gen=gen, mmap=mmap)
+    children = [
+        subprocess.Popen(
+            [sys.executable, "-c", code],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        for _ in range(processes)
+    ]
+    for child in children:
+        child.stdout.readline()
+    total = sum(_pss(child.pid) for child in children)
+    for child in children:
+        child.stdin.close()
+        child.wait()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Shared memory-mapped embeddings vs torch.load per process"
+    )
+    parser.add_argument("--gen", type=int, default=9)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    dexes = [dex for dex in DEXES if os.path.exists(get_pretrained_path(args.gen, dex))]
+    for dex in dexes:
+        names, expected = torch.load(get_pretrained_path(args.gen, dex))
+        actual_names, actual = load_embeddings(args.gen, dex, torch.float64)
+        assert names == actual_names and torch.equal(expected, actual), dex
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        for dex in dexes:
+            torch.load(get_pretrained_path(args.gen, dex))[1].float()
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        for dex in dexes:
+            load_embeddings(args.gen, dex)
+    registry_time = time.perf_counter() - start
+
+    print(f"gen{args.gen} {', '.join(dexes)}")
+    print(f"torch.load per model: {1000 * load_time / args.repeats:.2f}ms")
+    print(f"registry per model: {1000 * registry_time / args.repeats:.3f}ms")
+
+    baseline = measure_processes(args.gen, dexes, args.processes)
+    for mmap in (False, True):
+        name = "memory mapped" if mmap else "torch.load"
+        pss = measure_processes(args.gen, dexes, args.processes, mmap) - baseline
+        print(f"{args.processes} processes, {name}: tables add {pss:.1f}MiB pss")
+
+
+if __name__ == "__main__":
+    main()
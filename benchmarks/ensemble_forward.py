@@ -0,0 +1,99 @@
+import time
+import argparse
+
+import torch
+
+from benchmarks.inference import make_state
+from meloetta.frameworks.nash_ketchum.modelv2 import NAshKetchumModel
+
+
+def make_batch(model: NAshKetchumModel, gen: int, rows: int):
+    """`rows` states as `_learning_forward` sees them, flattened to `[TB, 1]`,
+    with the actions taken so the heads condition on those instead of sampling"""
+    states = [make_state(model, gen, seed) for seed in range(rows)]
+    batch = {key: torch.cat([state[key] for state in states]) for key in states[0]}
+    for field in ("action_type", "flag", "move", "switch"):
+        batch[f"{field}_index"] = torch.zeros(rows, 1, dtype=torch.long)
+    return batch
+
+
+def learning_forward(models, batch, shared: bool):
+    """The four no-grad forwards of `_learning_forward` on one chunk"""
+    learner, target, prev, prev_ = models
+    features = learner.preprocess(batch) if shared else None
+    return [
+        learner(batch, compute_value=False, features=features),
+        target(batch, compute_log_policy=False, features=features),
+        prev(batch, compute_value=False, features=features),
+        prev_(batch, compute_value=False, features=features),
+    ]
+
+
+def timed(fn, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Four learner forwards sharing input-only encodings"
+    )
+    parser.add_argument("--gen", type=int, default=6)
+    # the chunk size `_learning_forward` and `_update_params` split batches into
+    parser.add_argument("--rows", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=3)
+    # the default config's trajectory_length * batch_size
+    parser.add_argument("--batch-rows", type=int, default=1024 * 8)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    models = [NAshKetchumModel(gen=args.gen).eval() for _ in range(4)]
+    batch = make_batch(models[0], args.gen, args.rows)
+
+    with torch.no_grad():
+        expected = learning_forward(models, batch, shared=False)
+        actual = learning_forward(models, batch, shared=True)
+        for separate, shared in zip(expected, actual):
+            assert separate.keys() == shared.keys()
+            for key, value in separate.items():
+                if value is not None:
+                    assert torch.equal(value, shared[key]), key
+
+        preprocess = timed(lambda: models[0].preprocess(batch), args.repeats)
+        separate = timed(
+            lambda: learning_forward(models, batch, shared=False), args.repeats
+        )
+        shared = timed(
+            lambda: learning_forward(models, batch, shared=True), args.repeats
+        )
+
+    def train():
+        # the forward and backward `_step` takes on each chunk
+        output = models[0](batch, compute_log_policy=False)
+        sum(
+            v.float().sum() for k, v in output.items() if k.endswith("_value")
+        ).backward()
+
+    train = timed(train, args.repeats)
+
+    print(
+        f"gen{args.gen}, {args.rows} rows: preprocess {1000 * preprocess:.0f}ms, "
+        f"four forwards {1000 * separate:.0f}ms separately, "
+        f"{1000 * shared:.0f}ms sharing it ({separate / shared:.2f}x), "
+        f"outputs identical"
+    )
+    chunks = -(-args.batch_rows // args.rows)
+    before = chunks * (separate + train)
+    after = chunks * (shared + train)
+    print(
+        f"{args.batch_rows} rows per learner step, forwards and backward: "
+        f"{before:.1f}s -> {after:.1f}s ({before / after:.2f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
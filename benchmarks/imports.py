@@ -0,0 +1,64 @@
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+SNIPPETS = {
+    "import meloetta.data": "import meloetta.data as data",
+    "+ TOKENIZED_SCHEMA (cached)": (
+        "import meloetta.data as data\ndata.TOKENIZED_SCHEMA"
+    ),
+    "+ TOKENIZED_SCHEMA (cold)": (
+        "import meloetta.data as data\ndata.load_tokenized_schema({tmp_path!r})"
+    ),
+    "+ every table": (
+        "import meloetta.data as data\n"
+        "for name in dir(data):\n"
+        "    getattr(data, name)\n"
+    ),
+}
+
+RUNNER = """
+import time
+import resource
+start = time.perf_counter()
+{snippet}
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(__import__("json").dumps([elapsed, rss]))
+"""
+
+
+def measure(snippet: str):
+    # numpy is imported up front so it is not counted against meloetta
+    code = "import numpy\n" + RUNNER.format(snippet=snippet)
+    output = subprocess.check_output([sys.executable, "-c", code])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="meloetta.data import time and rss")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    # make sure the tokenized schema cache exists before timing the warm path
+    measure(SNIPPETS["+ TOKENIZED_SCHEMA (cached)"])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, snippet in SNIPPETS.items():
+            times = []
+            rss = []
+            for i in range(args.repeats):
+                tmp_path = f"{tmp_dir}/tokenized_schema{i}.pkl"
+                elapsed, max_rss = measure(snippet.format(tmp_path=tmp_path))
+                times.append(elapsed)
+                rss.append(max_rss)
+            print(
+                f"{name}: {1000 * sum(times) / len(times):.1f}ms, "
+                f"max rss {max(rss) / 1024:.1f}MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import time
+import argparse
+
+from types import SimpleNamespace
+
+import torch
+
+from benchmarks.recorded import load_battles, replay
+from meloetta.vector import VectorizedState, IncrementalVectorizedState
+from meloetta.frameworks.nash_ketchum.actor import NAshKetchumActor
+
+
+def assert_identical(expected, actual):
+    assert expected.keys() == actual.keys()
+    for key, value in expected.items():
+        assert value.dtype == actual[key].dtype, key
+        assert value.shape == actual[key].shape, key
+        assert torch.equal(value, actual[key]), key
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Incremental vs full rebuild of the vectorized state"
+    )
+    parser.add_argument("--battles", type=str, default=None, help="glob of battles")
+    args = parser.parse_args()
+
+    times = {"full": 0, "incremental": 0, "nash full": 0, "nash incremental": 0}
+    decisions = 0
+
+    for messages in load_battles(args.battles):
+        vectorizer = None
+        nash = None
+        for player, _, action_required in replay(messages):
+            room = player.room
+            if not action_required or room.status["ended"]:
+                continue
+
+            battle = room.status["battle"] or room.get_battle()
+            if vectorizer is None:
+                vectorizer = IncrementalVectorizedState(room)
+                nash = NAshKetchumActor(SimpleNamespace(gen=battle["dex"]["gen"]))
+
+            start = time.perf_counter()
+            expected = VectorizedState.from_battle(room, battle).to_dict()
+            times["full"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = vectorizer.vectorize_battle(battle).to_dict()
+            times["incremental"] += time.perf_counter() - start
+
+            assert_identical(expected, actual)
+
+            # a fresh actor has nothing cached, so it rebuilds everything
+            fresh = NAshKetchumActor(SimpleNamespace(gen=nash.gen))
+            start = time.perf_counter()
+            expected = fresh.get_vectorized_state(room, battle)
+            times["nash full"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = nash.get_vectorized_state(room, battle)
+            times["nash incremental"] += time.perf_counter() - start
+
+            assert_identical(expected, actual)
+            decisions += 1
+
+    print(f"{decisions} decisions, all identical")
+    for name, elapsed in times.items():
+        print(f"{name}: {1000 * elapsed / decisions:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import time
+import asyncio
+import argparse
+import contextlib
+import threading
+import functools
+
+import torch
+
+from benchmarks.recorded import load_battles
+from meloetta.actors.inference import InferenceServer
+from meloetta.frameworks.nash_ketchum.actor import NAshKetchumActor
+from meloetta.frameworks.nash_ketchum.modelv2 import NAshKetchumModel, policy
+from meloetta.frameworks.nash_ketchum.utils import get_buffer_specs
+from meloetta.player import Player
+from meloetta.room import BattleRoomPool
+from meloetta.workers.selfplay import SelfPlayWorker
+
+
+def make_state(model: NAshKetchumModel, gen: int, seed: int):
+    """A `(1, 1, ...)` state shaped like the buffer's, with every option legal"""
+    generator = torch.Generator().manual_seed(seed)
+    specs = get_buffer_specs(1, gen, "singles", 0)
+    state = {}
+    for key in model._STATE_FIELDS:
+        if key == "hist":
+            state[key] = -torch.ones(1, 1, 10, 4, 4, dtype=torch.long)
+        elif key == "choices_done":
+            state[key] = torch.zeros(1, 1, 1, dtype=torch.long)
+        elif specs[key]["dtype"] == torch.bool:
+            state[key] = torch.ones(1, 1, *specs[key]["size"][1:], dtype=torch.bool)
+        elif specs[key]["dtype"] == torch.float32:
+            size = (1, 1, *specs[key]["size"][1:])
+            state[key] = torch.rand(size, generator=generator)
+        else:
+            size = (1, 1, *specs[key]["size"][1:])
+            state[key] = torch.zeros(size, dtype=specs[key]["dtype"])
+    return state
+
+
+@contextlib.contextmanager
+def greedy_actions():
+    """Take the most likely action instead of sampling, so that the heads
+    conditioned on the action are comparable between runs"""
+    sample = policy._multinomial
+    policy._multinomial = lambda dist: dist.argmax(-1)
+    try:
+        yield
+    finally:
+        policy._multinomial = sample
+
+
+def check_equivalence(forward_fn, states):
+    with greedy_actions(), torch.no_grad():
+        expected = [forward_fn(state) for state in states]
+        with InferenceServer(forward_fn, len(states), max_wait=1) as server:
+            futures = [server.submit(state) for state in states]
+            actual = [future.result() for future in futures]
+
+    for single, batched in zip(expected, actual):
+        for key, value in single.items():
+            if isinstance(value, torch.Tensor):
+                assert value.shape == batched[key].shape, key
+                assert torch.allclose(value, batched[key], atol=1e-5), key
+
+
+def run_clients(forward, states, clients: int, requests: int):
+    """`clients` threads each calling `forward` `requests` times back to back"""
+    latencies = [[] for _ in range(clients)]
+
+    def client(index: int):
+        state = states[index % len(states)]
+        for _ in range(requests):
+            start = time.perf_counter()
+            forward(state)
+            latencies[index].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for client in latencies for latency in client)
+    return clients * requests / elapsed, latencies
+
+
+class BlockingActor(NAshKetchumActor):
+    """The server's blocking `forward` called from a synchronous actor, which
+    holds up the event loop and so every other battle of the worker"""
+
+    @torch.no_grad()
+    def choose_action(self, state, room, choices):
+        return self._act(state, room, choices, self.inference.forward(state))
+
+
+async def play_recorded(actor, messages, room, state, decisions):
+    """A recorded battle through the worker's own battle loop. The actor's
+    encoding is swapped for `state`, the recorded battles not being the
+    model's gen, so only the forward pass differs from a real worker."""
+    worker = SelfPlayWorker(0, 2, None, None, None)
+    player = Player.from_client(None, room)
+    messages = iter(messages)
+
+    async def receive():
+        # a websocket read, where the other battles get to run
+        await asyncio.sleep(0)
+        return next(messages)
+
+    async def send(message: str):
+        decisions.append(message)
+
+    actor.get_vectorized_state = lambda room, battle: state
+    await worker.play_battle(player, actor, "player0", receive, send)
+
+
+def run_worker(actor_fn, battles, state, concurrent: int):
+    """Decisions per second of `concurrent` battles on one event loop"""
+
+    async def run():
+        pool = BattleRoomPool()
+        decisions = []
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(
+                *[
+                    play_recorded(
+                        actor_fn(),
+                        battles[i % len(battles)],
+                        pool.room(f"room{i}"),
+                        state,
+                        decisions,
+                    )
+                    for i in range(concurrent)
+                ]
+            )
+            elapsed = time.perf_counter() - start
+        finally:
+            pool.close()
+        return len(decisions) / elapsed
+
+    return asyncio.run(run())
+
+
+def report(name: str, throughput: float, latencies, server=None):
+    p50 = 1000 * latencies[len(latencies) // 2]
+    p99 = 1000 * latencies[int(len(latencies) * 0.99)]
+    line = f"{name}: {throughput:.0f} states/s, p50 {p50:.2f}ms, p99 {p99:.2f}ms"
+    if server is not None and server.batches:
+        line += f", mean batch {server.states / server.batches:.1f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Batched InferenceServer vs one forward per battle"
+    )
+    parser.add_argument("--gen", type=int, default=6)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument(
+        "--battles",
+        type=str,
+        default="benchmarks/battles/gen9randombattle-*.json",
+        help="glob of battles of one format, for the worker loop",
+    )
+    parser.add_argument("--concurrent", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    model = NAshKetchumModel(gen=args.gen).eval()
+    forward_fn = functools.partial(
+        model.forward, compute_log_policy=False, compute_value=False
+    )
+    states = [make_state(model, args.gen, seed) for seed in range(8)]
+    check_equivalence(forward_fn, states)
+    print(f"gen{args.gen}, batched outputs == single outputs")
+
+    lock = threading.Lock()
+
+    def unbatched(state):
+        # one forward at a time, as every actor calling its model directly
+        with lock, torch.no_grad():
+            return forward_fn(state)
+
+    throughput, latencies = run_clients(unbatched, states, args.clients, args.requests)
+    report("model.forward per battle", throughput, latencies)
+
+    for max_batch_size in (4, 16, 64):
+        for max_wait in (0.0005, 0.002, 0.01):
+            server = InferenceServer(forward_fn, max_batch_size, max_wait)
+            with server:
+                throughput, latencies = run_clients(
+                    server.forward, states, args.clients, args.requests
+                )
+            report(
+                f"batch {max_batch_size:>2} wait {1000 * max_wait:>4.1f}ms",
+                throughput,
+                latencies,
+                server,
+            )
+
+    # the same, through the battle loop of a self-play worker
+    battles = load_battles(args.battles)
+    state = states[0]
+    throughput = run_worker(
+        lambda: NAshKetchumActor(model, pid=0), battles, state, args.concurrent
+    )
+    print(f"worker loop, model.forward per battle: {throughput:.0f} decisions/s")
+    for name, actor_fn in (
+        ("blocking forward", BlockingActor),
+        ("awaited infer", NAshKetchumActor),
+    ):
+        server = InferenceServer(forward_fn, 64, 0.002)
+        with server:
+            throughput = run_worker(
+                lambda: actor_fn(model, pid=0, inference=server),
+                battles,
+                state,
+                args.concurrent,
+            )
+        print(
+            f"worker loop, {name}: {throughput:.0f} decisions/s, "
+            f"mean batch {server.states / server.batches:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
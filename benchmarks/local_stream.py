@@ -0,0 +1,91 @@
+import time
+import asyncio
+import argparse
+
+from meloetta.frameworks.random.actor import RandomActor
+from meloetta.player import Player
+from meloetta.simulator import SIDES, LocalBattleStream, simulator_command
+from meloetta.workers.selfplay import SelfPlayWorker
+
+
+class Actor(RandomActor):
+    def __init__(self, pid: int = None):
+        super().__init__()
+
+
+async def run(worker: SelfPlayWorker, command, battles: int):
+    usernames = ["player0", "player1"]
+    players = [Player.from_client(None) for _ in usernames]
+    decisions = [0]
+
+    def counted(actor):
+        choose_action = actor.choose_action
+
+        def choose(*args):
+            decisions[0] += 1
+            return choose_action(*args)
+
+        actor.choose_action = choose
+        return actor
+
+    spare = await LocalBattleStream(worker.battle_format, command).spawn()
+    start = time.perf_counter()
+    for _ in range(battles):
+        stream = spare
+        spare = await LocalBattleStream(worker.battle_format, command).spawn()
+        await stream.start(usernames, worker.team)
+        try:
+            await asyncio.gather(
+                *[
+                    worker.play_battle(
+                        player,
+                        counted(Actor()),
+                        username,
+                        lambda side=side: stream.receive(side),
+                        lambda message, side=side: stream.send(side, message),
+                    )
+                    for player, username, side in zip(players, usernames, SIDES)
+                ]
+            )
+        finally:
+            stream.close()
+            await stream.wait_closed()
+        for player in players:
+            assert player.room.status["ended"]
+            player.reset()
+    elapsed = time.perf_counter() - start
+    spare.close()
+    await spare.wait_closed()
+    for player in players:
+        player.room.close()
+    return decisions[0], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Random self-play against a local simulate-battle process"
+    )
+    parser.add_argument("--format", type=str, default="gen9randombattle")
+    parser.add_argument("--showdown", type=str, default=None)
+    parser.add_argument("--battles", type=int, default=20)
+    parser.add_argument("--command", nargs="+", default=None)
+    args = parser.parse_args()
+
+    if args.command is not None:
+        command = args.command
+    elif args.showdown is not None:
+        command = simulator_command(args.showdown)
+    else:
+        command = simulator_command()
+
+    worker = SelfPlayWorker(0, 2, args.format, None, Actor, local_simulator=True)
+    decisions, elapsed = asyncio.run(run(worker, command, args.battles))
+    print(f"{args.battles} battles, {decisions} decisions, no server or logins")
+    print(
+        f"{args.battles / elapsed:.2f} battles/s, "
+        f"{1000 * elapsed / decisions:.2f}ms per decision"
+    )
+
+
+if __name__ == "__main__":
+    main()
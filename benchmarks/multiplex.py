@@ -0,0 +1,63 @@
+import os
+import json
+import time
+import argparse
+
+from meloetta.room import BattleRoom, BattleRoomPool, create_context
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), "battles", "gen9randombattle-sample.json"
+)
+
+
+def _heap(ctx) -> float:
+    return ctx.heap_stats()["used_heap_size"] / 2**20
+
+
+def replay(rooms, messages):
+    for message in messages:
+        if message.startswith(">"):
+            message = message[message.index("\n") + 1 :]
+        for room in rooms:
+            room.recieve(message)
+            room.get_js_attr("controls.controls")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Many battles in one js context vs one context per battle"
+    )
+    parser.add_argument("--battles", type=int, default=64)
+    args = parser.parse_args()
+
+    with open(FIXTURE, "r") as f:
+        messages = json.load(f)
+
+    start = time.perf_counter()
+    rooms = [BattleRoom(create_context()) for _ in range(args.battles)]
+    setup = time.perf_counter() - start
+    start = time.perf_counter()
+    replay(rooms, messages)
+    elapsed = time.perf_counter() - start
+    heap = sum(_heap(room._ctx) for room in rooms)
+    print(
+        f"{args.battles} contexts: setup {setup:.2f}s, "
+        f"replay {elapsed:.2f}s, heap {heap:.1f}MiB"
+    )
+    del rooms
+
+    start = time.perf_counter()
+    pool = BattleRoomPool(create_context())
+    rooms = [pool.room() for _ in range(args.battles)]
+    setup = time.perf_counter() - start
+    start = time.perf_counter()
+    replay(rooms, messages)
+    elapsed = time.perf_counter() - start
+    print(
+        f"1 context, {args.battles} rooms: setup {setup:.2f}s, "
+        f"replay {elapsed:.2f}s, heap {_heap(pool._ctx):.1f}MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
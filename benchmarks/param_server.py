@@ -0,0 +1,159 @@
+import time
+import argparse
+import functools
+import multiprocessing as mp
+
+import torch
+
+from benchmarks.inference import make_state
+from meloetta.actors.inference import InferenceServer
+from meloetta.actors.parameters import ParameterServer
+from meloetta.frameworks.nash_ketchum.modelv2 import NAshKetchumModel
+
+
+def fill(model: NAshKetchumModel, value: float):
+    """Every weight of `model` set to `value`, so any mix of two versions
+    shows up as weights that disagree"""
+    with torch.no_grad():
+        for tensor in model.state_dict().values():
+            tensor.fill_(value)
+
+
+def held(model: NAshKetchumModel) -> list:
+    """The versions `model`'s weights come from"""
+    weights = torch.cat([tensor.flatten() for tensor in model.state_dict().values()])
+    return weights.unique().tolist()
+
+
+def load_state_dict_writer(shared, stop, versions: int):
+    # what the learner did: load into the model the actors forward with
+    source = NAshKetchumModel(gen=shared.gen)
+    for version in range(1, versions + 1):
+        fill(source, version)
+        shared.load_state_dict(source.state_dict())
+    stop.set()
+
+
+def publish_writer(params: ParameterServer, gen: int, stop, versions: int):
+    source = NAshKetchumModel(gen=gen)
+    for version in range(1, versions + 1):
+        fill(source, version)
+        params.publish(source, version)
+    stop.set()
+
+
+def shared_reads(gen: int, versions: int):
+    """Reads of a shared model, while another process loads each version
+    into it, that saw two versions at once"""
+    ctx = mp.get_context("spawn")
+    shared = NAshKetchumModel(gen=gen)
+    fill(shared, 0)
+    shared.share_memory()
+    stop = ctx.Event()
+    writer = ctx.Process(target=load_state_dict_writer, args=(shared, stop, versions))
+    writer.start()
+    reads = bad = 0
+    while not stop.is_set():
+        reads += 1
+        bad += len(held(shared)) > 1
+    writer.join()
+    return bad, reads
+
+
+def synced_reads(gen: int, versions: int):
+    """The same with the reader syncing a copy of its own between reads"""
+    ctx = mp.get_context("spawn")
+    model = NAshKetchumModel(gen=gen)
+    fill(model, 0)
+    params = ParameterServer(model)
+    params.publish(model, 0)
+    stop = ctx.Event()
+    writer = ctx.Process(target=publish_writer, args=(params, gen, stop, versions))
+    writer.start()
+    reads = bad = 0
+    seen = set()
+    while not stop.is_set():
+        version = params.sync(model)
+        reads += 1
+        bad += held(model) != [version]
+        seen.add(version)
+    writer.join()
+    assert params.sync(model) == versions
+    assert held(model) == [versions]
+    return bad, reads, len(seen)
+
+
+def served_versions(gen: int, versions: int):
+    """An inference server's results, each with the version it was computed
+    with, while the learner publishes between requests"""
+    learner = NAshKetchumModel(gen=gen)
+    served = NAshKetchumModel(gen=gen).eval()
+    state = make_state(served, gen, 0)
+    params = ParameterServer(learner)
+    params.publish(learner, 0)
+    forward_fn = functools.partial(
+        served.forward, compute_log_policy=False, compute_value=False
+    )
+    with InferenceServer(forward_fn, params=params, model=served) as server:
+        for version in range(1, versions + 1):
+            with torch.no_grad():
+                for parameter in learner.parameters():
+                    parameter.add_(torch.randn_like(parameter), alpha=1e-3)
+            params.publish(learner, version)
+            output = server.forward(state)
+            assert output["policy_version"] == version
+            for name, tensor in served.state_dict().items():
+                assert torch.equal(tensor, learner.state_dict()[name]), name
+
+
+def timed(fn, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Versioned weight publication vs load_state_dict into a shared model"
+    )
+    parser.add_argument("--gen", type=int, default=6)
+    parser.add_argument("--versions", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    bad, reads = shared_reads(args.gen, args.versions)
+    print(f"load_state_dict into a shared model: {bad} of {reads} reads torn")
+
+    bad, reads, seen = synced_reads(args.gen, args.versions)
+    assert bad == 0, f"{bad} of {reads} synced reads torn"
+    print(f"parameter server: 0 of {reads} reads torn, {seen} versions seen")
+
+    served_versions(args.gen, 5)
+    print("inference server: every result computed with the version it reports")
+
+    learner = NAshKetchumModel(gen=args.gen)
+    actor = NAshKetchumModel(gen=args.gen)
+    params = ParameterServer(learner)
+    version = 0
+
+    def publish():
+        nonlocal version
+        version += 1
+        params.publish(learner, version)
+
+    load = timed(lambda: actor.load_state_dict(learner.state_dict()), args.repeats)
+    published = timed(publish, args.repeats)
+    synced = timed(lambda: (publish(), params.sync(actor)), args.repeats) - published
+    current = timed(lambda: params.sync(actor), args.repeats)
+    print(
+        f"load_state_dict {1000 * load:.1f}ms, publish {1000 * published:.1f}ms, "
+        f"sync {1000 * synced:.1f}ms with a new version, "
+        f"{1000 * current:.3f}ms without"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import time
+import argparse
+
+import numpy as np
+import torch
+
+from benchmarks.recorded import load_battles, replay
+from meloetta import vector
+from meloetta.vector import VectorizedState
+
+
+def list_vector(value):
+    """The original encoder: a list built field by field, then `torch.tensor`"""
+    arr = []
+    schema = {}
+    for field in value._fields:
+        field_value = getattr(value, field)
+        start = len(arr)
+        if isinstance(field_value, int) or isinstance(field_value, float):
+            arr.append(field_value)
+        elif isinstance(field_value, list):
+            arr += field_value
+        schema[field] = (start, len(arr))
+    return torch.tensor(arr)
+
+
+def capture_writes(room, battle):
+    """Every (pokemon tuple, row, layout) the encoder writes for one state"""
+    writes = []
+    write_fields = vector.write_fields
+
+    def capture(value, out, layout):
+        write_fields(value, out, layout)
+        writes.append((value, out, layout))
+
+    vector.write_fields = capture
+    try:
+        VectorizedState.from_battle(room, battle)
+    finally:
+        vector.write_fields = write_fields
+    return writes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compiled field layouts vs per-field python lists"
+    )
+    parser.add_argument("--battles", type=str, default=None, help="glob of battles")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    writes = []
+    for messages in load_battles(args.battles):
+        for player, _, action_required in replay(messages):
+            room = player.room
+            if not action_required or room.status["ended"]:
+                continue
+            battle = room.status["battle"] or room.get_battle()
+            writes += capture_writes(room, battle)
+
+    for value, out, _ in writes:
+        expected = list_vector(value)
+        actual = torch.from_numpy(out)
+        assert expected.dtype == actual.dtype, type(value)
+        assert torch.equal(expected, actual), type(value)
+        # the public vector() still works without a gen, as it did before
+        assert torch.equal(value.vector("torch", True).vector, actual), type(value)
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        for value, _, _ in writes:
+            list_vector(value)
+    list_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        for value, _, layout in writes:
+            vector.write_fields(
+                value, np.empty(layout.size, dtype=layout.dtype), layout
+            )
+    layout_time = time.perf_counter() - start
+
+    calls = len(writes) * args.repeats
+    print(f"{len(writes)} pokemon, all identical")
+    print(f"python list + torch.tensor: {1e6 * list_time / calls:.1f}us")
+    print(f"compiled layout write: {1e6 * layout_time / calls:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import os
+import glob
+import json
+
+from typing import Iterator, List, Tuple
+
+from meloetta.player import Player
+from meloetta.room import BattleRoom
+
+BATTLES_DIR = os.path.join(os.path.dirname(__file__), "battles")
+
+
+def load_battles(pattern: str = None) -> List[List[str]]:
+    """Recorded battles, each a list of raw messages from one player's websocket"""
+    if pattern is None:
+        pattern = os.path.join(BATTLES_DIR, "*.json")
+    battles = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "r") as f:
+            battles.append(json.load(f))
+    return battles
+
+
+def replay(
+    messages: List[str], room: BattleRoom = None
+) -> Iterator[Tuple[Player, str, bool]]:
+    """Feeds a recorded battle through a `Player`, yielding at every message"""
+    player = Player()
+    player.room = room if room is not None else BattleRoom()
+    player.started = False
+    for message in messages:
+        action_required = player._recieve(message)
+        yield player, message, action_required
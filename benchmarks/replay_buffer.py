@@ -0,0 +1,214 @@
+import os
+import queue
+import time
+import argparse
+import threading
+
+import torch
+
+from meloetta.frameworks.nash_ketchum.buffer import BatchPrefetcher, ReplayBuffer
+from meloetta.frameworks.nash_ketchum.utils import _has_played, _player_others
+
+
+def open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+def fill(replay_buffer: ReplayBuffer, seed: int = 0):
+    """Random trajectories of random lengths in every slot, interleaved by
+    `utc` the way the actors store them"""
+    generator = torch.Generator().manual_seed(seed)
+    trajectory_length = replay_buffer.trajectory_length
+    for key, value in replay_buffer.buffers.items():
+        if value.dtype == torch.bool:
+            value[...] = torch.rand(value.shape, generator=generator) < 0.5
+        elif value.is_floating_point():
+            value[...] = torch.rand(value.shape, generator=generator)
+        else:
+            value[...] = torch.randint(0, 8, value.shape, generator=generator)
+
+    lengths = torch.randint(
+        1, trajectory_length + 1, (replay_buffer.num_buffers, 2), generator=generator
+    )
+    steps = torch.arange(trajectory_length)
+    valid = steps < lengths.unsqueeze(-1)
+    replay_buffer.buffers["valid"][...] = valid
+    utc = steps.double() + torch.tensor([0, 0.5]).view(1, 2, 1).double()
+    replay_buffer.buffers["utc"][...] = torch.where(valid, utc, float("inf"))
+    return lengths
+
+
+def reference_batch(replay_buffer: ReplayBuffer, indices):
+    """`get_batch` as it was written against one tensor per slot and player"""
+    buffers = replay_buffer.buffers
+    batch_size = len(indices)
+    trajectory_length = replay_buffer.trajectory_length
+
+    order1 = torch.stack(
+        [torch.cat([buffers["utc"][index, k] for k in range(2)]) for index in indices],
+        dim=1,
+    ).argsort(0)
+    orders1 = [order.squeeze(-1) for order in torch.chunk(order1, batch_size, 1)]
+    max_len = (
+        torch.stack(
+            [
+                torch.cat([buffers["valid"][index, k] for k in range(2)])
+                for index in indices
+            ],
+            dim=1,
+        )
+        .sum(0)
+        .max()
+        .item()
+    )
+    batch = {
+        key: torch.stack(
+            [
+                torch.cat([buffers[key][batch_index, k] for k in range(2)])[
+                    orders1[order_index]
+                ][:max_len]
+                for order_index, batch_index in enumerate(indices)
+            ],
+            dim=1,
+        )
+        for key in buffers
+        if key != "rewards"
+    }
+    batch.pop("utc")
+
+    rewards = torch.zeros(max_len, batch_size, 2)
+    final_reward = torch.stack(
+        [
+            torch.stack([buffers["rewards"][index, k] for k in range(2)], dim=-1)
+            for index in indices
+        ],
+        dim=1,
+    ).sum(0)
+    final_idx = batch["valid"].sum(0) - 1
+    rewards[final_idx, torch.arange(batch_size)] = final_reward
+    batch["rewards"] = rewards
+
+    player_id = torch.zeros(2 * trajectory_length, batch_size, dtype=torch.long)
+    player_id[trajectory_length:] = 1
+    player_id = torch.stack(
+        [
+            ids.squeeze(-1)[orders1[index]][:max_len]
+            for index, ids in enumerate(player_id.chunk(batch_size, 1))
+        ],
+        dim=1,
+    )
+    batch["player_id"] = player_id
+    batch["has_played"] = torch.stack(
+        [_has_played(batch["valid"], player_id, k).bool() for k in range(2)], dim=-1
+    )
+    batch["player_others"] = torch.cat(
+        [_player_others(player_id, batch["valid"], k) for k in range(2)], dim=-1
+    )
+    return batch
+
+
+def sample(replay_buffer: ReplayBuffer, indices):
+    for index in indices:
+        replay_buffer.full_queue.put(index)
+    start = time.perf_counter()
+    _, _, batch = replay_buffer.get_batch(len(indices))
+    return batch, time.perf_counter() - start
+
+
+def learner_waits(replay_buffer: ReplayBuffer, args, prefetch: int) -> float:
+    """Mean time a learner whose step takes `--step` seconds, say on a GPU,
+    spends waiting for each batch, with actors always keeping slots full"""
+    stop = threading.Event()
+
+    def actors():
+        while not stop.is_set():
+            try:
+                index = replay_buffer.free_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            replay_buffer.full_queue.put(index)
+
+    while not replay_buffer.free_queue.empty():
+        replay_buffer.full_queue.put(replay_buffer.free_queue.get())
+    thread = threading.Thread(target=actors, daemon=True)
+    thread.start()
+
+    prefetcher = None
+    if prefetch:
+        prefetcher = BatchPrefetcher(replay_buffer, args.batch_size, prefetch).start()
+    waits = []
+    for _ in range(args.steps):
+        start = time.perf_counter()
+        if prefetcher is None:
+            replay_buffer.get_batch(args.batch_size)
+        else:
+            prefetcher.get()
+        waits.append(time.perf_counter() - start)
+        time.sleep(args.step)
+    stop.set()
+    if prefetcher is not None:
+        prefetcher.stop()
+    # the first batch can never have been prefetched
+    return sum(waits[1:]) / (len(waits) - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="NAsh replay buffer startup and batch assembly"
+    )
+    parser.add_argument("--buffers", type=int, default=512)
+    parser.add_argument("--trajectory-length", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--gen", type=int, default=6)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--step", type=float, default=0.3)
+    args = parser.parse_args()
+
+    fds = open_fds()
+    start = time.perf_counter()
+    replay_buffer = ReplayBuffer(
+        args.trajectory_length, args.gen, "singles", args.buffers, torch.device("cpu")
+    )
+    startup = time.perf_counter() - start
+    print(
+        f"{args.buffers} buffers: {startup:.2f}s to allocate, "
+        f"{open_fds() - fds} fds, {len(replay_buffer.buffers)} tensors"
+    )
+    fill(replay_buffer)
+
+    generator = torch.Generator().manual_seed(1)
+    reference, batched = [], []
+    for _ in range(args.repeats):
+        indices = torch.randperm(args.buffers, generator=generator)
+        indices = indices[: args.batch_size].tolist()
+
+        start = time.perf_counter()
+        expected = reference_batch(replay_buffer, indices)
+        reference.append(time.perf_counter() - start)
+
+        actual, elapsed = sample(replay_buffer, indices)
+        batched.append(elapsed)
+
+        assert expected.keys() == actual.keys()
+        for key, value in expected.items():
+            assert value.shape == actual[key].shape, key
+            assert torch.equal(value, actual[key]), key
+
+    reference = 1000 * sorted(reference)[len(reference) // 2]
+    batched = 1000 * sorted(batched)[len(batched) // 2]
+    print(
+        f"batch of {args.batch_size}: per slot {reference:.1f}ms, "
+        f"get_batch {batched:.1f}ms, outputs identical"
+    )
+
+    for prefetch in (0, 2):
+        wait = learner_waits(replay_buffer, args, prefetch)
+        print(
+            f"learner step of {1000 * args.step:.0f}ms, prefetch {prefetch}: "
+            f"waits {1000 * wait:.1f}ms per batch"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import time
+import random
+import asyncio
+import argparse
+
+from benchmarks.recorded import load_battles
+from meloetta.client import MessageRouter, get_room_id
+from meloetta.player import Player
+from meloetta.room import BattleRoomPool
+
+
+class ReplaySocket:
+    """Stands in for a websocket carrying the recorded messages of many battles"""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    async def recv(self) -> str:
+        if not self.messages:
+            await asyncio.Event().wait()
+        # let the battle loops run between frames, as a real socket would
+        await asyncio.sleep(0)
+        return self.messages.pop(0)
+
+
+def interleave(battles, seed: int):
+    """Messages of every battle on one connection, in a random order per battle"""
+    rng = random.Random(seed)
+    cursors = [0 for _ in battles]
+    messages = []
+    while any(cursor < len(battle) for cursor, battle in zip(cursors, battles)):
+        index = rng.choice(
+            [i for i, battle in enumerate(battles) if cursors[i] < len(battle)]
+        )
+        messages.append(battles[index][cursors[index]])
+        cursors[index] += 1
+        if rng.random() < 0.1:
+            messages.append("|updatesearch|{}")
+    return messages
+
+
+def retag(messages, battle_tag: str):
+    return [
+        f">{battle_tag}\n{message[message.index(chr(10)) + 1:]}"
+        if message.startswith(">")
+        else message
+        for message in messages
+    ]
+
+
+async def play(router: MessageRouter, pool: BattleRoomPool, expected: dict):
+    battle_tag = await router.next_battle()
+    player = Player.from_client(None, pool.room(battle_tag))
+    seen = []
+    while True:
+        message = await router.get(battle_tag)
+        assert get_room_id(message) == battle_tag
+        seen.append(message)
+        player._recieve(message)
+        if player.room.status["ended"]:
+            break
+    router.close(battle_tag)
+    assert seen == expected[battle_tag], battle_tag
+    return player.room.get_battle()["turn"]
+
+
+async def run(battles, seed: int):
+    expected = {}
+    tagged = []
+    for index, messages in enumerate(battles):
+        battle_tag = f"battle-gen9randombattle-{index}"
+        expected[battle_tag] = retag(messages, battle_tag)
+        tagged.append(expected[battle_tag])
+
+    # nothing reads the global queue here, as with a login that only challenges
+    router = MessageRouter(ReplaySocket(interleave(tagged, seed)), global_backlog=8)
+    router.start()
+    pool = BattleRoomPool()
+    try:
+        turns = await asyncio.gather(*[play(router, pool, expected) for _ in battles])
+        assert router.queues[""].qsize() <= router.global_backlog
+        for battle_tag in expected:
+            router.dispatch(f">{battle_tag}\n|j|☆late")
+            router.dispatch(f">{battle_tag}\n|deinit")
+        assert set(router.queues) == {""} and not router.closed
+        return turns
+    finally:
+        router.stop()
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Many battles on one connection through MessageRouter"
+    )
+    parser.add_argument("--battles", type=str, default=None, help="glob of battles")
+    parser.add_argument("--concurrent", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    recorded = load_battles(args.battles)
+    battles = [recorded[i % len(recorded)] for i in range(args.concurrent)]
+
+    start = time.perf_counter()
+    turns = asyncio.run(run(battles, args.seed))
+    elapsed = time.perf_counter() - start
+    messages = sum(len(battle) for battle in battles)
+    print(f"{args.concurrent} battles on one connection, every room saw its own")
+    print(f"{sum(turns)} turns, {1000 * elapsed / messages:.3f}ms per message")
+
+
+if __name__ == "__main__":
+    main()
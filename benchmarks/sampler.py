@@ -0,0 +1,163 @@
+import time
+import queue
+import argparse
+import threading
+import multiprocessing as mp
+
+import torch
+
+from meloetta.frameworks.nash_ketchum.buffer import ReplayBuffer
+from meloetta.frameworks.nash_ketchum.sampler import SAMPLERS, SumTree
+
+from benchmarks.replay_buffer import fill
+
+
+def proportions(capacity: int, draws: int) -> float:
+    """Largest gap between how often the tree picks a slot and its share of
+    the total priority"""
+    generator = torch.Generator().manual_seed(0)
+    priorities = torch.rand(capacity, generator=generator, dtype=torch.float64)
+    priorities[::7] = 0
+    tree = SumTree(capacity)
+    tree.update(range(capacity), priorities)
+    assert abs(tree.total() - priorities.sum().item()) < 1e-9
+
+    counts = torch.zeros(capacity, dtype=torch.float64)
+    for _ in range(draws // 64):
+        counts += torch.bincount(tree.sample(64, generator), minlength=capacity)
+    assert counts[::7].sum() == 0, "sampled a slot of priority 0"
+    return (counts / counts.sum() - priorities / priorities.sum()).abs().max().item()
+
+
+def fifo_order(num_buffers: int, batch_size: int):
+    """The default sampler hands out slots in the order they finished, each
+    exactly once, as reading `full_queue` directly did"""
+    replay_buffer = ReplayBuffer(4, 6, "singles", num_buffers)
+    fill(replay_buffer)
+    claimed = [replay_buffer.free_queue.get() for _ in range(num_buffers)]
+    expected = [claimed[i] for i in torch.randperm(num_buffers)]
+    for index in expected:
+        replay_buffer.full_queue.put(index)
+    sampled = []
+    for _ in range(num_buffers // batch_size):
+        indices, _, _ = replay_buffer.get_batch(batch_size)
+        sampled += indices
+    assert sampled == expected, (sampled, expected)
+    assert replay_buffer.free_queue.qsize() == num_buffers
+    assert replay_buffer.waiting() == 0
+
+
+def put(sampler, indices):
+    for index in indices:
+        sampler.put(index)
+
+
+def across_processes(name: str, num_buffers: int):
+    """Slots put by other processes are visible to, and sampled by, this one"""
+    sampler = SAMPLERS[name](num_buffers)
+    processes = [
+        mp.Process(target=put, args=(sampler, range(k, num_buffers, 4)))
+        for k in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert sampler.ready() == num_buffers
+    assert sampler.clock[0] == num_buffers
+    indices, _ = sampler.sample(num_buffers)
+    assert all(0 <= index < num_buffers for index in indices)
+    if name == "fifo":
+        assert sorted(indices) == list(range(num_buffers))
+
+
+def stale_updates(num_buffers: int):
+    """Errors on a trajectory that reach `update` after its slot was refilled,
+    as they do with batches prefetched ahead of the learner, leave the new
+    trajectory's priority alone"""
+    sampler = SAMPLERS["prioritized"](num_buffers, max_age=1)
+    put(sampler, range(num_buffers))
+    indices, arrivals = sampler.sample(num_buffers)
+    sampler.update(indices, [10.0] * len(indices), arrivals)
+    seed = sampler.max_priority.item()
+
+    # evicted, released to the actors, refilled and put again
+    assert sorted(sampler.evict()) == list(range(num_buffers))
+    put(sampler, range(num_buffers))
+    sampler.update(indices, [0.0] * len(indices), arrivals)
+    assert torch.all(sampler.priorities.get(range(num_buffers)) == seed)
+
+    # errors on the trajectories actually held still land
+    indices, arrivals = sampler.sample(num_buffers)
+    sampler.update(indices, [0.0] * len(indices), arrivals)
+    assert torch.all(sampler.priorities.get(indices) == sampler.eps**sampler.alpha)
+
+
+def steps_per_game(name: str, args) -> float:
+    """Learner steps taken per finished game when the actors are the
+    bottleneck, each game taking `--game` seconds to finish"""
+    sampler = SAMPLERS[name](args.buffers)
+    replay_buffer = ReplayBuffer(4, 6, "singles", args.buffers, sampler=sampler)
+    fill(replay_buffer)
+    stop = threading.Event()
+    games = 0
+
+    def actors():
+        nonlocal games
+        while not stop.is_set():
+            try:
+                index = replay_buffer.free_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            time.sleep(args.game)
+            replay_buffer.full_queue.put(index)
+            games += 1
+
+    thread = threading.Thread(target=actors, daemon=True)
+    thread.start()
+    steps = 0
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        indices, arrivals, _ = replay_buffer.get_batch(args.batch_size)
+        if name == "prioritized":
+            sampler.update(indices, torch.rand(len(indices)), arrivals)
+        time.sleep(args.step)
+        steps += 1
+    stop.set()
+    thread.join()
+    return steps / games
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay samplers: sum-tree sampling, FIFO order, reuse"
+    )
+    parser.add_argument("--buffers", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--draws", type=int, default=200_000)
+    parser.add_argument("--game", type=float, default=0.02)
+    parser.add_argument("--step", type=float, default=0.02)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    gap = proportions(100, args.draws)
+    print(f"sum tree: {args.draws} draws, largest gap to priority share {gap:.4f}")
+
+    fifo_order(args.buffers, args.batch_size)
+    print("fifo: every slot once, in the order they finished")
+
+    for name in SAMPLERS:
+        across_processes(name, args.buffers)
+    print("slots put from 4 processes sampled in this one, for every sampler")
+
+    stale_updates(args.buffers)
+    print("prioritized: late errors on refilled slots ignored")
+
+    for name in SAMPLERS:
+        ratio = steps_per_game(name, args)
+        print(f"{name}: {ratio:.2f} learner steps per finished game")
+
+
+if __name__ == "__main__":
+    main()
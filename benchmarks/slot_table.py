@@ -0,0 +1,85 @@
+import time
+import argparse
+import multiprocessing as mp
+
+from meloetta.frameworks.nash_ketchum.buffer import ReplayBuffer
+
+
+def writer(replay_buffer: ReplayBuffer, pair: int, pid: int, battles: int):
+    """One player of `battles` battles, the other player in another process"""
+    for battle in range(battles):
+        battle_tag = f"battle-{pair}-{battle}"
+        index = replay_buffer._get_index(battle_tag, pid)
+        # the learner checks that both players wrote into the same slot
+        replay_buffer.append_reward(index, 0, pid, pair * battles + battle + 1)
+        replay_buffer.register_done(battle_tag, pid)
+
+
+def stress(replay_buffer: ReplayBuffer, pairs: int, battles: int):
+    # daemons, so a failed check does not leave them waiting on a slot
+    processes = [
+        mp.Process(target=writer, args=(replay_buffer, pair, pid, battles), daemon=True)
+        for pair in range(pairs)
+        for pid in range(2)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+
+    seen = set()
+    while len(seen) < pairs * battles:
+        index = replay_buffer.full_queue.get(timeout=60)
+        rewards = replay_buffer.buffers["rewards"][index, :, 0]
+        assert rewards[0] == rewards[1] != 0, (index, rewards)
+        marker = int(rewards[0].item())
+        assert marker not in seen, f"battle {marker} completed twice"
+        seen.add(marker)
+        replay_buffer.release(index)
+    elapsed = time.perf_counter() - start
+
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert replay_buffer.full_queue.empty()
+    assert replay_buffer.free_queue.qsize() == replay_buffer.num_buffers
+    assert not len(replay_buffer.slots)
+    return elapsed
+
+
+def lookups(table, keys, repeats: int):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for key in keys:
+            table(key)
+    return (time.perf_counter() - start) / (repeats * len(keys))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Concurrent writers against the replay buffer's slot table"
+    )
+    parser.add_argument("--pairs", type=int, default=8)
+    parser.add_argument("--battles", type=int, default=200)
+    parser.add_argument("--buffers", type=int, default=16)
+    args = parser.parse_args()
+
+    replay_buffer = ReplayBuffer(4, 6, "singles", args.buffers)
+    elapsed = stress(replay_buffer, args.pairs, args.battles)
+    print(
+        f"{2 * args.pairs} writers, {args.pairs * args.battles} battles through "
+        f"{args.buffers} slots in {elapsed:.1f}s, each completed exactly once"
+    )
+
+    # the lookup every stored step used to make
+    keys = [f"battle-{i}" for i in range(args.buffers)]
+    index_cache = mp.Manager().dict()
+    for index, key in enumerate(keys):
+        index_cache[key] = index
+        replay_buffer.slots.claim(key, index, 0)
+    manager = lookups(index_cache.__getitem__, keys, 50)
+    table = lookups(replay_buffer.slots.find, keys, 50)
+    print(f"lookup: Manager dict {1e6 * manager:.1f}us, SlotTable {1e6 * table:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import time
+import argparse
+
+from meloetta import room
+from meloetta.room import SRC, BattleRoom, ContextPool, create_context
+
+
+def _time(fn, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return 1000 * sum(times) / len(times)
+
+
+def cold_room():
+    """The original startup path: every file is read, stripped and eval'd"""
+    from py_mini_racer import MiniRacer
+
+    ctx = MiniRacer()
+    for file in SRC:
+        with open(file, "r", encoding="utf-8") as f:
+            ctx.eval(room._strip_exports(f.read()))
+    ctx.eval("engine.start()")
+    return BattleRoom(ctx)
+
+
+def fresh_room():
+    """A context created on demand, from sources read once per process"""
+    return BattleRoom(create_context())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BattleRoom startup benchmark")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    room.load_sources()
+    print(
+        f"load_sources: {1000 * (time.perf_counter() - start):.1f}ms, once per process"
+    )
+
+    print(f"cold BattleRoom(): {_time(cold_room, args.repeats):.1f}ms")
+    print(f"fresh BattleRoom(): {_time(fresh_room, args.repeats):.1f}ms")
+
+    pool = ContextPool()
+    pool.warm(args.repeats)
+    print(
+        f"pooled BattleRoom(): "
+        f"{_time(lambda: BattleRoom(pool.acquire()), args.repeats):.2f}ms"
+    )
+    print(
+        f"reset + release: "
+        f"{_time(lambda: pool.release(pool.acquire()), args.repeats):.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+import time
+import signal
+import random
+import argparse
+
+from meloetta.frameworks.nash_ketchum.buffer import ReplayBuffer
+from meloetta.workers.supervisor import WorkerSupervisor
+
+
+class FlakyWorker:
+    """Plays make-believe battles into the buffer, finishing some and dying
+    with others still holding their slots, like a worker whose socket dropped"""
+
+    def __init__(self, worker_index: int, replay_buffer: ReplayBuffer, crash: float):
+        self.worker_index = worker_index
+        self.replay_buffer = replay_buffer
+        self.crash = crash
+
+    def __repr__(self):
+        return "FlakyWorker"
+
+    def run(self, stop=None):
+        rng = random.Random(self.worker_index)
+        battle = 0
+        while stop is None or not stop.is_set():
+            battle_tag = f"battle-{self.worker_index}-{battle}"
+            self.replay_buffer._get_index(battle_tag, 0)
+            time.sleep(rng.uniform(0.01, 0.05))
+            if rng.random() < self.crash:
+                os._exit(1)
+            for pid in range(2):
+                self.replay_buffer.register_done(battle_tag, pid)
+            battle += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Workers that crash mid-battle under a WorkerSupervisor"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--buffers", type=int, default=16)
+    parser.add_argument("--crash", type=float, default=0.2)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    replay_buffer = ReplayBuffer(8, 6, "singles", args.buffers)
+    supervisor = WorkerSupervisor(
+        lambda i: FlakyWorker(i, replay_buffer, args.crash),
+        num_workers=args.workers,
+        replay_buffer=replay_buffer,
+        interval=0.05,
+    )
+    supervisor.start()
+
+    # the learner, handing finished trajectories' slots back
+    finished = 0
+    retired = []
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        supervisor.poll()
+        # retire a worker now and then, as scaling down does
+        if random.random() < 0.05 and len(supervisor) > 1:
+            worker_index = max(supervisor.processes)
+            retired.append(supervisor.processes[worker_index])
+            supervisor.retire(worker_index)
+            supervisor.spawn()
+        while not replay_buffer.full_queue.empty():
+            replay_buffer.release(replay_buffer.full_queue.get())
+            finished += 1
+        time.sleep(0.05)
+    supervisor.stop()
+    while not replay_buffer.full_queue.empty():
+        replay_buffer.release(replay_buffer.full_queue.get())
+        finished += 1
+
+    # every slot is either free again or still claimed by a live battle
+    time.sleep(0.1)
+    free = replay_buffer.free_queue.qsize()
+    # retired workers returned between battles, or crashed on their own
+    terminated = sum(process.exitcode == -signal.SIGTERM for process in retired)
+    print(
+        f"{finished} trajectories, {supervisor.restarts} restarts, "
+        f"{len(retired)} retired, {terminated} of them terminated, "
+        f"{free}/{args.buffers} slots free, "
+        f"{len(replay_buffer.slots)} leaked"
+    )
+    assert free == args.buffers and not len(replay_buffer.slots)
+    assert not terminated
+
+
+if __name__ == "__main__":
+    main()
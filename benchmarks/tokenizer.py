@@ -0,0 +1,102 @@
+import time
+import argparse
+
+from collections import defaultdict
+
+from benchmarks.recorded import load_battles, replay
+from meloetta import data, vector
+from meloetta.data import TOKENIZED_SCHEMA, Tokenizer, to_id
+from meloetta.vector import VectorizedState
+
+DEX_TYPES = {
+    "get_species_token": "pokedex",
+    "get_move_token": "movedex",
+    "get_ability_token": "abilitydex",
+    "get_item_token": "itemdex",
+}
+
+
+def reference_token(gen: int, dex_type: str, key: str, value):
+    """The original lookup: `to_id` then two nested dict lookups"""
+    value = to_id(value)
+    lookup = TOKENIZED_SCHEMA[f"gen{gen}"][dex_type][key]
+    return lookup.get(value, -1)
+
+
+def record_workload(battles):
+    """Every (gen, dex_type, key, value) looked up while vectorizing `battles`"""
+    workload = []
+    originals = {name: getattr(vector, name) for name in DEX_TYPES}
+
+    def recorder(name):
+        def record(gen, key, value):
+            workload.append((gen, DEX_TYPES[name], key, value))
+            return originals[name](gen, key, value)
+
+        return record
+
+    for name in DEX_TYPES:
+        setattr(vector, name, recorder(name))
+    try:
+        for messages in battles:
+            for player, _, action_required in replay(messages):
+                room = player.room
+                if not action_required or room.status["ended"]:
+                    continue
+                battle = room.status["battle"] or room.get_battle()
+                VectorizedState.from_battle(room, battle)
+    finally:
+        for name, fn in originals.items():
+            setattr(vector, name, fn)
+    return workload
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Memoized Tokenizer vs to_id + schema lookups"
+    )
+    parser.add_argument("--battles", type=str, default=None, help="glob of battles")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    workload = record_workload(load_battles(args.battles))
+
+    by_field = defaultdict(list)
+    for gen, dex_type, key, value in workload:
+        by_field[(gen, dex_type, key)].append(value)
+
+    for gen, dex_type, key, value in workload:
+        expected = reference_token(gen, dex_type, key, value)
+        assert data.get_tokenizer(gen).token(dex_type, key, value) == expected
+    for (gen, dex_type, key), values in by_field.items():
+        tokens = Tokenizer(gen).tokens(dex_type, key, values)
+        expected = [reference_token(gen, dex_type, key, value) for value in values]
+        assert tokens.tolist() == expected
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        for gen, dex_type, key, value in workload:
+            reference_token(gen, dex_type, key, value)
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        for gen, dex_type, key, value in workload:
+            data.get_tokenizer(gen).token(dex_type, key, value)
+    memo_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        for (gen, dex_type, key), values in by_field.items():
+            data.get_tokenizer(gen).tokens(dex_type, key, values)
+    bulk_time = time.perf_counter() - start
+
+    calls = len(workload) * args.repeats
+    print(f"{len(workload)} lookups over {len(by_field)} fields, all identical")
+    print(f"to_id + schema: {1e6 * reference_time / calls:.2f}us")
+    print(f"Tokenizer.token: {1e6 * memo_time / calls:.2f}us")
+    print(f"Tokenizer.tokens: {1e6 * bulk_time / calls:.2f}us")
+
+
+if __name__ == "__main__":
+    main()
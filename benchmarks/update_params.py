@@ -0,0 +1,233 @@
+import time
+import argparse
+
+import torch
+
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+from benchmarks.ensemble_forward import make_batch
+from meloetta.frameworks.nash_ketchum.learner import _FIELDS, NAshKetchumLearner
+from meloetta.frameworks.nash_ketchum.modelv2 import NAshKetchumModel
+from meloetta.frameworks.nash_ketchum.utils import (
+    _get_leading_dims,
+    _player_masks,
+    get_loss_nerd,
+    get_loss_v,
+)
+
+
+def make_inputs(model: NAshKetchumModel, gen: int, rows: int, batch_size: int):
+    """A `[T, B]` batch of `rows` states and random v-trace targets for it,
+    with every field played by both players"""
+    generator = torch.Generator().manual_seed(0)
+    states = make_batch(model, gen, rows)
+    T = rows // batch_size
+    batch = {k: v.view(T, batch_size, *v.shape[2:]) for k, v in states.items()}
+    batch["valid"] = torch.rand(T, batch_size, generator=generator) < 0.9
+    batch["player_id"] = torch.randint(0, 2, (T, batch_size), generator=generator)
+    batch["policy_select"] = torch.randint(0, 4, (T, batch_size), generator=generator)
+    batch["has_played"], _ = _player_masks(batch["valid"], batch["player_id"])
+
+    targets = {
+        "value_targets": [
+            torch.randn(T, batch_size, 1, generator=generator) for _ in range(2)
+        ],
+        "has_played": list(batch["has_played"].unbind(-1)),
+    }
+    for field in _FIELDS:
+        size = batch[f"{field}_mask"].shape[-1]
+        targets[f"{field}_policy_target"] = [
+            torch.randn(T, batch_size, size, generator=generator) for _ in range(2)
+        ]
+        targets[f"{field}_is"] = [
+            torch.rand(T, batch_size, 1, generator=generator) for _ in range(2)
+        ]
+    return batch, targets
+
+
+def reference_update_params(
+    model: NAshKetchumModel,
+    batch: Dict[str, torch.Tensor],
+    targets: Dict[str, List[torch.Tensor]],
+) -> Dict[str, List[float]]:
+    """`_update_params` and `_step` as they were written: a transfer per
+    minibatch, two loss calls per field and an `.item()` per loss"""
+    minibatch_size = 1024
+    T, B = _get_leading_dims(batch)
+
+    n_iters = ((T * B) // minibatch_size) + 1
+
+    batch = {k: v.flatten(0, 1).unsqueeze(1) for k, v in batch.items()}
+    targets = {
+        k: [v.flatten(0, 1).unsqueeze(1) for v in vt] for k, vt in targets.items()
+    }
+
+    valid_sum = {}
+    loss_dict = {}
+
+    for policy_select, field in enumerate(_FIELDS):
+        for k in range(2):
+            policy_valid_sum_field = f"{field}_policy_valid_sum"
+            value_valid_sum_field = f"{field}_value_valid_sum"
+
+            for valid_sum_field in [policy_valid_sum_field, value_valid_sum_field]:
+                if valid_sum_field not in valid_sum:
+                    valid_sum[valid_sum_field] = []
+
+            mask = batch["policy_select"] == policy_select
+
+            policy_mask = batch["has_played"][..., k] & mask
+            valid_sum[policy_valid_sum_field].append(policy_mask.sum().item())
+
+            value_mask = targets["has_played"][k] & mask
+            valid_sum[value_valid_sum_field].append(value_mask.sum().item())
+
+        loss_dict[f"{field}_value_loss"] = [0, 0]
+        loss_dict[f"{field}_policy_loss"] = [0, 0]
+
+    for i in range(n_iters):
+        start_idx, end_idx = i * minibatch_size, (i + 1) * minibatch_size
+
+        if not batch["valid"][start_idx:end_idx].sum().item():
+            continue
+
+        minibatch = {k: v[start_idx:end_idx] for k, v in batch.items()}
+        minitargets = {
+            k: [v[start_idx:end_idx] for v in vt] for k, vt in targets.items()
+        }
+
+        model_output = model(minibatch, compute_log_policy=False)
+
+        loss = 0
+        N, _ = _get_leading_dims(minibatch)
+
+        for policy_select, field in enumerate(_FIELDS):
+            policy_valid = minibatch["valid"].view(N)
+            trajectory_mask = minibatch["policy_select"] == policy_select
+            policy_valid = (policy_valid & trajectory_mask.squeeze(-1)).unsqueeze(-1)
+
+            pg_losses = get_loss_nerd(
+                [model_output[f"{field}_logits"]] * 2,
+                [model_output[f"{field}_policy"]] * 2,
+                minitargets[f"{field}_policy_target"],
+                policy_valid,
+                minibatch["player_id"],
+                valid_sum[f"{field}_policy_valid_sum"],
+                minibatch[f"{field}_mask"],
+                minitargets[f"{field}_is"],
+            )
+            value_losses = get_loss_v(
+                [model_output[f"{field}_value"]] * 2,
+                minitargets["value_targets"],
+                [h & trajectory_mask for h in minitargets["has_played"]],
+                valid_sum[f"{field}_value_valid_sum"],
+            )
+            for k, (pg_loss, value_loss) in enumerate(zip(pg_losses, value_losses)):
+                loss += pg_loss
+                loss += value_loss
+                loss_dict[f"{field}_policy_loss"][k] += pg_loss.item()
+                loss_dict[f"{field}_value_loss"][k] += value_loss.item()
+
+        loss.backward()
+
+    return loss_dict
+
+
+class CachedOutputs:
+    """`model`'s outputs on each minibatch, computed once and replayed as
+    leaves, so timing the update path times only what comes after the model"""
+
+    def __init__(self, model: NAshKetchumModel):
+        self.model = model
+        self.outputs = {}
+
+    def __call__(self, batch: Dict[str, torch.Tensor], **kwargs):
+        key = batch["valid"].data_ptr()
+        if key not in self.outputs:
+            with torch.no_grad():
+                output = self.model(batch, **kwargs)
+            self.outputs[key] = {
+                k: v.requires_grad_(v.is_floating_point())
+                if isinstance(v, torch.Tensor)
+                else v
+                for k, v in output.items()
+            }
+        return self.outputs[key]
+
+
+def compare(before, after, repeats: int) -> Tuple[float, float]:
+    """Median seconds of each, interleaved so drift in the machine's speed
+    lands on both"""
+    times = [], []
+    for _ in range(repeats):
+        for fn, fn_times in zip((before, after), times):
+            start = time.perf_counter()
+            fn()
+            fn_times.append(time.perf_counter() - start)
+    return tuple(sorted(fn_times)[repeats // 2] for fn_times in times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="The learner's update path, fused losses vs per field and player"
+    )
+    parser.add_argument("--gen", type=int, default=6)
+    parser.add_argument("--rows", type=int, default=2048)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = NAshKetchumModel(gen=args.gen).train()
+    batch, targets = make_inputs(model, args.gen, args.rows, args.batch_size)
+
+    # `_update_params` only needs the learner's model and device
+    learner = SimpleNamespace(
+        learner_model=model, replay_buffer=SimpleNamespace(device="cpu")
+    )
+    learner._step = NAshKetchumLearner._step.__get__(learner)
+
+    def update():
+        return NAshKetchumLearner._update_params(learner, batch, targets)
+
+    def grads():
+        grads = [p.grad.clone() for p in model.parameters() if p.grad is not None]
+        model.zero_grad(set_to_none=True)
+        return grads
+
+    expected = reference_update_params(model, batch, targets)
+    expected_grads = grads()
+    actual = update()
+    actual_grads = grads()
+    assert expected.keys() == actual.keys()
+    for key in expected:
+        torch.testing.assert_close(
+            torch.tensor(actual[key]), torch.tensor(expected[key]), rtol=1e-4, atol=1e-6
+        )
+    assert len(expected_grads) == len(actual_grads)
+    for expected_grad, actual_grad in zip(expected_grads, actual_grads):
+        torch.testing.assert_close(actual_grad, expected_grad, rtol=1e-4, atol=1e-6)
+
+    before, after = compare(
+        lambda: reference_update_params(model, batch, targets), update, args.repeats
+    )
+    print(
+        f"gen{args.gen}, {args.rows} rows: losses and gradients match, "
+        f"{before:.2f}s -> {after:.2f}s per update ({before / after:.2f}x), "
+        f"{1 / before:.3f} -> {1 / after:.3f} steps/sec"
+    )
+
+    cached = CachedOutputs(model)
+    learner.learner_model = cached
+    before, after = compare(
+        lambda: reference_update_params(cached, batch, targets), update, 10
+    )
+    print(
+        f"without the model's forward and backward: "
+        f"{1000 * before:.1f}ms -> {1000 * after:.1f}ms ({before / after:.2f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+import time
+import argparse
+
+import torch
+import torch.nn.functional as F
+
+from typing import Any, NamedTuple, Sequence, Tuple
+
+from meloetta.frameworks.nash_ketchum.utils import (
+    _player_masks,
+    _player_others,
+    _policy_ratio,
+    _where,
+    pytorch_scan,
+    v_trace,
+)
+
+_SIZES = [3, 5, 4, 6]
+
+
+class LoopVTraceCarry(NamedTuple):
+    """The carry of the v-trace scan loop."""
+
+    reward: torch.Tensor
+    # The cumulated reward until the end of the episode. Uncorrected (v-trace).
+    # Gamma discounted and includes eta_reg_entropy.
+    reward_uncorrected: torch.Tensor
+    next_value: torch.Tensor
+    next_v_target: torch.Tensor
+    importance_sampling: torch.Tensor
+
+
+def reference_has_played(
+    valid: torch.Tensor, player_id: torch.Tensor, player: int
+) -> torch.Tensor:
+    """`_has_played` as it was written, a `pytorch_scan` over time"""
+    assert valid.shape == player_id.shape
+
+    def _loop_has_played(carry, x):
+        valid, player_id = x
+        assert valid.shape == player_id.shape
+
+        our_res = torch.ones_like(player_id)
+        opp_res = carry
+        reset_res = torch.zeros_like(carry)
+
+        our_carry = carry
+        opp_carry = carry
+        reset_carry = torch.zeros_like(player_id)
+
+        # pyformat: disable
+        return _where(
+            valid,
+            _where(
+                (player_id == player),
+                (our_carry, our_res),
+                (opp_carry, opp_res),
+            ),
+            (reset_carry, reset_res),
+        )
+        # pyformat: enable
+
+    _, result = pytorch_scan(
+        f=_loop_has_played,
+        init=torch.zeros_like(player_id[-1]),
+        xs=(valid, player_id),
+        reverse=True,
+    )
+    return result
+
+
+@torch.no_grad()
+def reference_v_trace(
+    v: Sequence[torch.Tensor],
+    policy_select: torch.Tensor,
+    valid: torch.Tensor,
+    policies_valid: Sequence[torch.Tensor],
+    player_id: torch.Tensor,
+    acting_policies: Sequence[torch.Tensor],
+    merged_policies: Sequence[torch.Tensor],
+    merged_log_policies: Sequence[torch.Tensor],
+    player_other: torch.Tensor,
+    actions_ohs: Sequence[torch.Tensor],
+    reward: torch.Tensor,
+    player: int,
+    # Scalars below.
+    eta: float,
+    lambda_: float,
+    c: float,
+    rho: float,
+    gamma: float = 1.0,
+) -> Tuple[Any, Any, Any]:
+    """`v_trace` as it was written, one `pytorch_scan` step per timestep"""
+
+    has_played = reference_has_played(valid, player_id, player)
+
+    policy_ratios = []
+    inv_mus = []
+    eta_reg_entropies = []
+    eta_log_policies = []
+
+    for (
+        merged_policy,
+        acting_policy,
+        actions_oh,
+        policy_valid,
+        merged_log_policy,
+    ) in zip(
+        merged_policies,
+        acting_policies,
+        actions_ohs,
+        policies_valid,
+        merged_log_policies,
+    ):
+        policy_ratios.append(
+            _policy_ratio(merged_policy, acting_policy, actions_oh, policy_valid)
+        )
+        inv_mus.append(
+            _policy_ratio(
+                torch.ones_like(merged_policy), acting_policy, actions_oh, policy_valid
+            )
+        )
+        eta_reg_entropies.append(
+            torch.sum(merged_policy * merged_log_policy, dim=-1)
+            * torch.squeeze(player_other, dim=-1)
+        )
+        eta_log_policies.append(-eta * merged_log_policy * player_other)
+
+    eta_reg_entropy = torch.stack(eta_reg_entropies, dim=-1)
+    eta_reg_entropy = eta_reg_entropy * torch.stack(policies_valid, dim=-1)
+    eta_reg_entropy = -eta * torch.sum(eta_reg_entropy, dim=-1)
+    policy_ratio = torch.prod(torch.stack(policy_ratios, dim=-1), dim=-1)
+
+    init_state_v_trace = LoopVTraceCarry(
+        reward=torch.zeros_like(reward[-1]),
+        reward_uncorrected=torch.zeros_like(reward[-1]),
+        next_value=torch.zeros_like(v[0][-1]),
+        next_v_target=torch.zeros_like(v[0][-1]),
+        importance_sampling=torch.ones_like(policy_ratio[-1]),
+    )
+
+    def _loop_v_trace(carry: LoopVTraceCarry, x) -> Tuple[LoopVTraceCarry, Any]:
+        (
+            cs,
+            player_id,
+            v,
+            reward,
+            eta_reg_entropy,
+            valid,
+            inv_mus,
+            actions_ohs,
+            eta_log_policies,
+        ) = x
+
+        reward_uncorrected = reward + gamma * carry.reward_uncorrected + eta_reg_entropy
+        discounted_reward = reward + gamma * carry.reward
+
+        # V-target:
+        our_v_target = (
+            v
+            + torch.unsqueeze(
+                torch.minimum(torch.tensor(rho), cs * carry.importance_sampling), dim=-1
+            )
+            * (
+                torch.unsqueeze(reward_uncorrected, dim=-1)
+                + gamma * carry.next_value
+                - v
+            )
+            + lambda_
+            * torch.unsqueeze(
+                torch.minimum(torch.tensor(c), cs * carry.importance_sampling), dim=-1
+            )
+            * gamma
+            * (carry.next_v_target - carry.next_value)
+        )
+
+        opp_v_target = torch.zeros_like(our_v_target)
+        reset_v_target = torch.zeros_like(our_v_target)
+
+        # Learning output:
+        our_learning_outputs = [
+            (
+                v
+                + eta_log_policy  # value
+                + actions_oh  # regularisation
+                * torch.unsqueeze(inv_mu, dim=-1)
+                * (
+                    torch.unsqueeze(discounted_reward, dim=-1)
+                    + gamma
+                    * torch.unsqueeze(carry.importance_sampling, dim=-1)
+                    * carry.next_v_target
+                    - v
+                )
+            )
+            for eta_log_policy, inv_mu, actions_oh in zip(
+                eta_log_policies, inv_mus, actions_ohs
+            )
+        ]
+
+        opp_learning_outputs = [
+            torch.zeros_like(our_learning_output)
+            for our_learning_output in our_learning_outputs
+        ]
+        reset_learning_output = [
+            torch.zeros_like(our_learning_output)
+            for our_learning_output in our_learning_outputs
+        ]
+
+        # State carry:
+        our_carry = LoopVTraceCarry(
+            reward=torch.zeros_like(carry.reward),
+            next_value=v,
+            next_v_target=our_v_target,
+            reward_uncorrected=torch.zeros_like(carry.reward_uncorrected),
+            importance_sampling=torch.ones_like(carry.importance_sampling),
+        )
+        opp_carry = LoopVTraceCarry(
+            reward=eta_reg_entropy + cs * discounted_reward,
+            reward_uncorrected=reward_uncorrected,
+            next_value=gamma * carry.next_value,
+            next_v_target=gamma * carry.next_v_target,
+            importance_sampling=cs * carry.importance_sampling,
+        )
+        reset_carry = init_state_v_trace
+
+        # Invalid turn: init_state_v_trace and (zero target, learning_output)
+        # pyformat: disable
+        return _where(
+            valid,
+            _where(
+                (player_id == player),
+                (our_carry, (our_v_target, our_learning_outputs)),
+                (opp_carry, (opp_v_target, opp_learning_outputs)),
+            ),
+            (reset_carry, (reset_v_target, reset_learning_output)),
+        )
+
+    v = torch.stack(v, dim=-1).squeeze()
+    v = (v * F.one_hot(policy_select, 4)).sum(-1, keepdim=True)
+
+    _, (v_target, learning_output) = pytorch_scan(
+        f=_loop_v_trace,
+        init=init_state_v_trace,
+        xs=(
+            policy_ratio,
+            player_id,
+            v,
+            reward,
+            eta_reg_entropy,
+            valid,
+            inv_mus,
+            actions_ohs,
+            eta_log_policies,
+        ),
+        reverse=True,
+    )
+
+    return v_target, has_played, learning_output, policy_ratios
+
+
+def make_inputs(T: int, B: int, seed: int = 0):
+    """A batch shaped like `_get_targets` builds it: trajectories of random
+    length with players taking turns at random, and learner policies close
+    to the acting ones so the importance weights stay near 1"""
+    generator = torch.Generator().manual_seed(seed)
+    lengths = torch.randint(T // 2, T + 1, (B,), generator=generator)
+    valid = torch.arange(T).unsqueeze(-1) < lengths
+    player_id = torch.randint(0, 2, (T, B), generator=generator) * valid
+    policy_select = torch.randint(0, 4, (T, B), generator=generator)
+
+    policies_valid, acting_policies, merged_policies = [], [], []
+    merged_log_policies, actions_ohs = [], []
+    for f, size in enumerate(_SIZES):
+        logits = torch.randn(T, B, size, generator=generator)
+        noise = 0.3 * torch.randn(T, B, size, generator=generator)
+        acting = logits.softmax(-1)
+        merged = (logits + noise).softmax(-1)
+        index = torch.multinomial(acting.view(-1, size), 1, generator=generator)
+        policies_valid.append(valid & (policy_select == f))
+        acting_policies.append(acting)
+        merged_policies.append(merged)
+        merged_log_policies.append(merged.log() - acting.log().mean(-1, keepdim=True))
+        actions_ohs.append(F.one_hot(index.view(T, B), size))
+
+    v = [torch.rand(T, B, 1, generator=generator) * 2 - 1 for _ in _SIZES]
+    rewards = torch.zeros(T, B, 2)
+    outcome = torch.randint(0, 2, (B,), generator=generator).float() * 2 - 1
+    rewards[lengths - 1, torch.arange(B), 0] = outcome
+    rewards[lengths - 1, torch.arange(B), 1] = -outcome
+
+    return (
+        v,
+        policy_select,
+        valid,
+        policies_valid,
+        player_id,
+        acting_policies,
+        merged_policies,
+        merged_log_policies,
+        actions_ohs,
+        rewards,
+    )
+
+
+def run(fn, inputs, player: int):
+    (
+        v,
+        policy_select,
+        valid,
+        policies_valid,
+        player_id,
+        acting_policies,
+        merged_policies,
+        merged_log_policies,
+        actions_ohs,
+        rewards,
+    ) = inputs
+    return fn(
+        v,
+        policy_select,
+        valid,
+        policies_valid,
+        player_id,
+        acting_policies,
+        merged_policies,
+        merged_log_policies,
+        _player_others(player_id, valid, player),
+        actions_ohs,
+        rewards[:, :, player],
+        player,
+        eta=0.2,
+        lambda_=0.95,
+        c=1.0,
+        rho=1.0,
+        gamma=0.99,
+    )
+
+
+def timed(fn, inputs, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for player in range(2):
+            run(fn, inputs, player)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Vectorized v-trace against the per-timestep reference"
+    )
+    parser.add_argument("--lengths", type=int, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 64])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    for T in args.lengths:
+        for B in args.batch_sizes:
+            inputs = make_inputs(T, B)
+            for player in range(2):
+                expected = run(reference_v_trace, inputs, player)
+                actual = run(v_trace, inputs, player)
+                torch.testing.assert_close(actual[0], expected[0])
+                assert torch.equal(actual[1], expected[1])
+                for a, e in zip(actual[2], expected[2]):
+                    torch.testing.assert_close(a, e)
+
+            valid, player_id = inputs[2], inputs[4]
+            start = time.perf_counter()
+            expected = [
+                [reference_has_played(valid, player_id, k) for k in range(2)],
+                [_player_others(player_id, valid, k) for k in range(2)],
+            ]
+            per_player = time.perf_counter() - start
+            start = time.perf_counter()
+            has_played, player_others = _player_masks(valid, player_id)
+            masks = time.perf_counter() - start
+            for k in range(2):
+                assert torch.equal(has_played[..., k], expected[0][k].bool())
+                assert torch.equal(player_others[..., k, None], expected[1][k])
+            print(
+                f"T={T} B={B}: masks for both players, per player scan "
+                f"{1000 * per_player:.1f}ms, _player_masks {1000 * masks:.2f}ms"
+            )
+
+            reference = timed(reference_v_trace, inputs, args.repeats)
+            vectorized = timed(v_trace, inputs, args.repeats)
+            print(
+                f"T={T} B={B}: both players per step, reference "
+                f"{1000 * reference:.1f}ms, vectorized {1000 * vectorized:.1f}ms "
+                f"({reference / vectorized:.0f}x), outputs match"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import time
+import random
+import argparse
+
+from meloetta.env import VectorBattleEnv
+from meloetta.simulator import simulator_command
+
+
+def random_action(choices):
+    choice_type = random.choice([key for key, value in choices.items() if value])
+    return choice_type, random.choice(list(choices[choice_type]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Decisions/s of VectorBattleEnv with a random policy"
+    )
+    parser.add_argument("--format", type=str, default="gen9randombattle")
+    parser.add_argument("--showdown", type=str, default=None)
+    parser.add_argument("--command", nargs="+", default=None)
+    parser.add_argument("--envs", type=int, nargs="+", default=[2, 8, 32])
+    parser.add_argument("--steps", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.command is not None:
+        command = args.command
+    elif args.showdown is not None:
+        command = simulator_command(args.showdown)
+    else:
+        command = simulator_command()
+
+    for num_envs in args.envs:
+        env = VectorBattleEnv(num_envs, args.format, simulator_command=command)
+        try:
+            output = env.reset()
+            decisions = episodes = 0
+            start = time.perf_counter()
+            for _ in range(args.steps):
+                actions = [
+                    random_action(choices) if ready else None
+                    for choices, ready in zip(env.choices, output.ready.tolist())
+                ]
+                decisions += int(output.ready.sum())
+                output = env.step(actions)
+                episodes += int(output.done.sum())
+            elapsed = time.perf_counter() - start
+        finally:
+            env.close()
+        print(
+            f"{num_envs} envs: {decisions / elapsed:.0f} decisions/s, "
+            f"{args.steps / elapsed:.1f} steps/s, {episodes} episodes"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
 import ray
 import torch
+import asyncio
+import inspect
+import functools
 
 from abc import ABC, abstractmethod
+from concurrent.futures import Executor
 
-from typing import Any, Dict
+from typing import Any, Callable, Dict
 
-from meloetta.vector import VectorizedState
+from meloetta.vector import IncrementalVectorizedState
 from meloetta.room import BattleRoom
 from meloetta.actors.types import State, Choices, Battle
 
@@ -36,7 +40,115 @@ class Actor(ABC):
     def post_match(self, room: BattleRoom):
         pass
 
+    def get_battle(self, room: BattleRoom) -> Battle:
+        battle = room.status["battle"]
+        if battle is None:
+            battle = room.get_battle()
+        return battle
+
     def get_vectorized_state(
         self, room: BattleRoom, battle: Battle
     ) -> Dict[str, torch.Tensor]:
-        return VectorizedState.from_battle(room, battle).to_dict()
+        # one encoder per actor, started over whenever the room changes
+        vectorizer = getattr(self, "_vectorizer", None)
+        if vectorizer is None or vectorizer.room is not room:
+            vectorizer = self._vectorizer = IncrementalVectorizedState(room)
+        return vectorizer.vectorize_battle(battle).to_dict()
+
+
+class AsyncActor(Actor):
+    """An actor whose `choose_action` is a coroutine.
+
+    Reading the battle out of the js context, encoding it and the forward pass
+    are CPU bound, so they run on `executor` (the event loop's default thread
+    pool when None) instead of stalling every other battle on the loop.
+    `get_battle` and `get_vectorized_state` are coroutines here too.
+    """
+
+    executor: Executor = None
+
+    def __call__(
+        self,
+        env_output: State,
+        room: BattleRoom,
+        choices: Choices,
+        *args,
+        **kwargs,
+    ) -> Any:
+        return self.choose_action(env_output, room, choices)
+
+    @abstractmethod
+    async def choose_action(
+        self,
+        env_output: State,
+        room: BattleRoom,
+        choices: Choices,
+    ):
+        raise NotImplementedError
+
+    async def run_in_executor(self, fn: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    async def get_battle(self, room: BattleRoom) -> Battle:
+        return await self.run_in_executor(super().get_battle, room)
+
+    async def get_vectorized_state(
+        self, room: BattleRoom, battle: Battle
+    ) -> Dict[str, torch.Tensor]:
+        return await self.run_in_executor(super().get_vectorized_state, room, battle)
+
+
+class ExecutorActor(AsyncActor):
+    """Runs a synchronous actor on an executor, one call at a time.
+
+    Anything not defined here is looked up on the wrapped actor.
+    """
+
+    def __init__(self, actor: Actor, executor: Executor = None):
+        self.actor = actor
+        self.executor = executor
+
+    @classmethod
+    def factory(cls, actor_fn: Callable[..., Actor], executor: Executor = None):
+        """An `actor_fn` for the workers, wrapping each actor `actor_fn` builds"""
+
+        def build(*args, **kwargs) -> "ExecutorActor":
+            return cls(actor_fn(*args, **kwargs), executor)
+
+        return build
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "actor":
+            raise AttributeError(name)
+        return getattr(self.actor, name)
+
+    async def choose_action(
+        self,
+        env_output: State,
+        room: BattleRoom,
+        choices: Choices,
+    ):
+        return await self.run_in_executor(
+            self.actor.choose_action, env_output, room, choices
+        )
+
+    async def get_battle(self, room: BattleRoom) -> Battle:
+        return await self.run_in_executor(self.actor.get_battle, room)
+
+    async def get_vectorized_state(
+        self, room: BattleRoom, battle: Battle
+    ) -> Dict[str, torch.Tensor]:
+        return await self.run_in_executor(self.actor.get_vectorized_state, room, battle)
+
+    def post_match(self, room: BattleRoom):
+        self.actor.post_match(room)
+
+
+async def resolve(value: Any) -> Any:
+    """The result of an actor call, awaited if the actor is an `AsyncActor`"""
+    if inspect.isawaitable(value):
+        return await value
+    return value
@@ -0,0 +1,165 @@
+import time
+import queue
+import asyncio
+import threading
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from concurrent.futures import Future
+from typing import Callable, List, Tuple
+
+from meloetta.actors.parameters import ParameterServer
+from meloetta.actors.types import State, TensorDict
+
+
+def collate(states: List[State], pad_value: int = -1) -> State:
+    """Concatenates `(T, B, ...)` states along the batch dim.
+
+    Tensors whose trailing dims differ are padded up to the largest, with
+    `pad_value` or `False` for masks.
+    """
+    batch = {}
+    for key, value in states[0].items():
+        if not isinstance(value, torch.Tensor):
+            values = [state[key] for state in states]
+            # fields a format does not use are None for every battle
+            batch[key] = None if all(v is None for v in values) else values
+            continue
+
+        values = [state[key] for state in states]
+        shape = [max(sizes) for sizes in zip(*(value.shape for value in values))]
+        padded = []
+        for value in values:
+            padding = []
+            for size, max_size in zip(reversed(value.shape), reversed(shape)):
+                padding += [0, max_size - size]
+            if any(padding):
+                fill = False if value.dtype == torch.bool else pad_value
+                value = F.pad(value, padding, value=fill)
+            padded.append(value)
+        batch[key] = torch.cat(padded, dim=1)
+    return batch
+
+
+def scatter(output: TensorDict, index: int) -> TensorDict:
+    """The `index`th battle of a batched `(T, B, ...)` output"""
+    return {
+        key: value[:, index : index + 1].clone()
+        if isinstance(value, torch.Tensor) and value.dim() >= 2
+        else value
+        for key, value in output.items()
+    }
+
+
+class InferenceServer:
+    """Runs the forward passes of many concurrent battles as one batch.
+
+    Requests wait until `max_batch_size` of them are pending or the oldest
+    has waited `max_wait` seconds, then go through `forward_fn` together on
+    the server's thread. `forward` blocks the calling thread, `infer` is the
+    coroutine equivalent. A batch only fills if its callers run
+    concurrently, e.g. from executor threads or separate coroutines.
+
+    With `params`, the newest published weights are synced into `model`, the
+    one `forward_fn` runs, between batches, and every result carries the
+    version its batch used as `"policy_version"`.
+    """
+
+    def __init__(
+        self,
+        forward_fn: Callable[[State], TensorDict],
+        max_batch_size: int = 64,
+        max_wait: float = 0.002,
+        pad_value: int = -1,
+        params: ParameterServer = None,
+        model: nn.Module = None,
+    ):
+        if params is not None and model is None:
+            raise ValueError("Syncing with `params` needs the `model` to sync")
+        self.forward_fn = forward_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pad_value = pad_value
+        self.params = params
+        self.model = model
+
+        # running totals, so the mean batch size costs no memory over time
+        self.batches = 0
+        self.states = 0
+        self._requests: "queue.Queue[Tuple[State, Future]]" = queue.Queue()
+        self._thread = None
+
+    def start(self) -> "InferenceServer":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._requests.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "InferenceServer":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, state: State) -> Future:
+        future = Future()
+        self._requests.put((state, future))
+        return future
+
+    def forward(self, state: State) -> TensorDict:
+        return self.submit(state).result()
+
+    async def infer(self, state: State) -> TensorDict:
+        return await asyncio.wrap_future(self.submit(state))
+
+    def _run(self):
+        running = True
+        while running:
+            request = self._requests.get()
+            if request is None:
+                break
+
+            batch = [request]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    # finish what is pending, then stop
+                    running = False
+                    break
+                batch.append(request)
+
+            self._process(batch)
+
+    def _process(self, batch: List[Tuple[State, Future]]):
+        states, futures = zip(*batch)
+        self.batches += 1
+        self.states += len(batch)
+        try:
+            if self.params is not None:
+                version = self.params.sync(self.model)
+            with torch.no_grad():
+                output = self.forward_fn(collate(states, self.pad_value))
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for index, future in enumerate(futures):
+            result = scatter(output, index)
+            if self.params is not None:
+                result["policy_version"] = version
+            future.set_result(result)
@@ -0,0 +1,113 @@
+import time
+import weakref
+
+import torch
+import torch.nn as nn
+
+from typing import Iterator, Tuple
+
+
+class ParameterServer:
+    """Hands the learner's weights to actor processes as numbered versions.
+
+    The weights live in two flat slabs in shared memory. `publish` writes the
+    slab the actors are not reading from, then stamps it with its version and
+    points `latest` at it, so the newest complete version is always readable.
+    `sync` copies it into an actor's own model between forwards, and checks
+    the stamp again afterwards: a slab rewritten mid-copy, which takes two
+    publishes during one read, is read again instead of being half used.
+
+    A single process, the learner's, publishes. Every other process keeps
+    its own copy of the model and calls `sync` at its turn or episode
+    boundaries, so no forward ever runs on partly updated weights.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        publish_steps: int = 1,
+        publish_seconds: float = None,
+    ):
+        state = model.state_dict()
+        self.names = list(state)
+        self.sizes = [tensor.numel() for tensor in state.values()]
+        self.slabs = torch.zeros(2, sum(self.sizes), dtype=torch.float32)
+        self.slabs.share_memory_()
+        # the version held by each slab, -1 while one is being written
+        self.versions = torch.full((2,), -1, dtype=torch.long).share_memory_()
+        self.latest = torch.zeros(1, dtype=torch.long).share_memory_()
+
+        self.publish_steps = publish_steps
+        self.publish_seconds = publish_seconds
+        self._published_version = None
+        self._published_at = None
+        self._synced = weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # which version each model holds is only meaningful in its process
+        del state["_synced"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._synced = weakref.WeakKeyDictionary()
+
+    def _tensors(self, model: nn.Module) -> Iterator[Tuple[torch.Tensor, int, int]]:
+        state = model.state_dict()
+        offset = 0
+        for name, size in zip(self.names, self.sizes):
+            yield state[name], offset, size
+            offset += size
+
+    def version(self) -> int:
+        """The newest complete version, -1 before the first publish"""
+        return self.versions[self.latest[0]].item()
+
+    @torch.no_grad()
+    def publish(self, model: nn.Module, version: int):
+        slot = 1 - self.latest[0].item()
+        self.versions[slot] = -1
+        torch.cat(
+            [
+                tensor.detach().flatten().float().cpu()
+                for tensor, *_ in self._tensors(model)
+            ],
+            out=self.slabs[slot],
+        )
+        self.versions[slot] = version
+        self.latest[0] = slot
+        self._published_version = version
+        self._published_at = time.monotonic()
+
+    def step(self, model: nn.Module, version: int) -> bool:
+        """Publishes `model` as `version` once `publish_steps` versions or
+        `publish_seconds` seconds have gone by since the last publish"""
+        due = (
+            self._published_version is None
+            or version - self._published_version >= self.publish_steps
+            or (
+                self.publish_seconds is not None
+                and time.monotonic() - self._published_at >= self.publish_seconds
+            )
+        )
+        if due:
+            self.publish(model, version)
+        return due
+
+    @torch.no_grad()
+    def sync(self, model: nn.Module) -> int:
+        """Loads the newest complete version into `model` if it holds an
+        older one, and returns the version it holds"""
+        held = self._synced.get(model, -1)
+        while True:
+            slot = self.latest[0].item()
+            version = self.versions[slot].item()
+            if version <= held:
+                return held
+            slab = self.slabs[slot]
+            for tensor, offset, size in self._tensors(model):
+                tensor.copy_(slab[offset : offset + size].view_as(tensor))
+            if self.versions[slot].item() == version:
+                self._synced[model] = version
+                return version
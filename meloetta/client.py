@@ -1,10 +1,106 @@
 import json
+import asyncio
 import requests
 import websockets
 
+from collections import OrderedDict
+from typing import Dict
+
+
+def get_room_id(message: str) -> str:
+    """The room a message is for, `""` for global messages"""
+    if not message.startswith(">"):
+        return ""
+    end = message.find("\n")
+    return message[1:] if end < 0 else message[1:end]
+
+
+class MessageRouter:
+    """Reads one websocket and hands each message to the queue of its room.
+
+    Global messages (challstr, pms, searches) go to the `""` queue. The first
+    message of an unseen battle also puts its tag on `new_battles`, so one
+    login can play many battles at once, each reading only its own queue.
+
+    Only the newest `global_backlog` global messages are kept, since a login
+    that never accepts challenges never reads them. Left rooms are remembered
+    until the server deinits them, and at most `closed_backlog` of them.
+    """
+
+    def __init__(
+        self, websocket, global_backlog: int = 256, closed_backlog: int = 1024
+    ):
+        self.websocket = websocket
+        self.queues: Dict[str, asyncio.Queue] = {"": asyncio.Queue()}
+        self.new_battles: asyncio.Queue = asyncio.Queue()
+        self.closed: "OrderedDict[str, None]" = OrderedDict()
+        self.global_backlog = global_backlog
+        self.closed_backlog = closed_backlog
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        try:
+            while True:
+                self.dispatch(await self.websocket.recv())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # wake every reader, they all share the broken connection
+            for queue in [*self.queues.values(), self.new_battles]:
+                queue.put_nowait(e)
+
+    def queue(self, room_id: str) -> asyncio.Queue:
+        queue = self.queues.get(room_id)
+        if queue is None:
+            queue = self.queues[room_id] = asyncio.Queue()
+        return queue
+
+    def dispatch(self, message: str):
+        room_id = get_room_id(message)
+        if room_id in self.closed:
+            if "\n|deinit" in message:
+                # the server sends nothing for a room after deiniting it
+                del self.closed[room_id]
+            return
+        if room_id not in self.queues and room_id.startswith("battle-"):
+            self.new_battles.put_nowait(room_id)
+        queue = self.queue(room_id)
+        if not room_id and queue.qsize() >= self.global_backlog:
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    async def get(self, room_id: str = "") -> str:
+        message = await self.queue(room_id).get()
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    async def next_battle(self) -> str:
+        battle_tag = await self.new_battles.get()
+        if isinstance(battle_tag, Exception):
+            raise battle_tag
+        return battle_tag
+
+    def close(self, room_id: str):
+        """Drops the queue of a room that was left, along with its late messages"""
+        self.queues.pop(room_id, None)
+        self.closed[room_id] = None
+        if len(self.closed) > self.closed_backlog:
+            self.closed.popitem(last=False)
+
 
 class Client:
     websocket = None
+    router: MessageRouter = None
     address = None
     login_uri = None
     username = None
@@ -22,8 +118,18 @@ class Client:
         self.login_uri = "https://play.pokemonshowdown.com/action.php"
         return self
 
-    async def receive_message(self):
-        message = await self.websocket.recv()
+    def start_router(self) -> MessageRouter:
+        """Routes messages by room from now on, see `MessageRouter`"""
+        if self.router is None:
+            self.router = MessageRouter(self.websocket)
+            self.router.start()
+        return self.router
+
+    async def receive_message(self, room_id: str = None):
+        if self.router is None:
+            message = await self.websocket.recv()
+        else:
+            message = await self.router.get(room_id or "")
         return message
 
     async def search_for_match(self, battle_format, team):
@@ -88,6 +194,8 @@ class Client:
     async def leave_battle(self, battle_tag):
         message = ["/leave {}".format(battle_tag)]
         await self.send_message("", message)
+        if self.router is not None:
+            self.router.close(battle_tag)
 
     async def join_room(self, room_name):
         message = "/join {}".format(room_name)
@@ -1,123 +1,223 @@
 import os
 import json
+import pickle
+import hashlib
 import numpy as np
 
-from copy import deepcopy
-from typing import Dict, Any
+from typing import Dict, Tuple, Sequence, Any
 
 from collections import OrderedDict
 
 ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
 DATA_DIR = f"{ROOT_DIR}/js/data"
 
-with open(os.path.join(DATA_DIR, "BattleAbilities.json"), "r") as f:
-    BattleAbilities = json.loads(f.read())
+SCHEMA_PATH = f"{ROOT_DIR}/pretrained/schema.json"
+TOKENIZED_SCHEMA_PATH = f"{ROOT_DIR}/pretrained/tokenized_schema.pkl"
+
+# [attribute: file in `DATA_DIR`], loaded on first access by `__getattr__`
+_JSON_TABLES = {
+    "BattleAbilities": "BattleAbilities.json",
+    "BattleAliases": "BattleAliases.json",
+    "BattleArticleTitles": "BattleArticleTitles.json",
+    "BattleFormatsData": "BattleFormatsData.json",
+    "BattleItems": "BattleItems.json",
+    "BattleLearnsets": "BattleLearnsets.json",
+    "BattleMovedex": "BattleMovedex.json",
+    "BattlePokedex": "BattlePokedex.json",
+    "BattleSearchCountIndex": "BattleSearchCountIndex.json",
+    "BattleSearchIndex": "BattleSearchIndex.json",
+    "BattleSearchIndexOffset": "BattleSearchIndexOffset.json",
+    "BattleTeambuilderTable": "BattleTeambuilderTable.json",
+    "BattleText": "BattleText.json",
+    "BattleTypeChart": "BattleTypeChart.json",
+    "Formats": "Formats.json",
+}
 
-with open(os.path.join(DATA_DIR, "BattleAliases.json"), "r") as f:
-    BattleAliases = json.loads(f.read())
 
-with open(os.path.join(DATA_DIR, "BattleArticleTitles.json"), "r") as f:
-    BattleArticleTitles = json.loads(f.read())
+def _load_json(path: str) -> Any:
+    with open(path, "r") as f:
+        return json.loads(f.read())
 
-with open(os.path.join(DATA_DIR, "BattleFormatsData.json"), "r") as f:
-    BattleFormatsData = json.loads(f.read())
 
-with open(os.path.join(DATA_DIR, "BattleItems.json"), "r") as f:
-    BattleItems = json.loads(f.read())
+def __getattr__(name: str) -> Any:
+    if name in _JSON_TABLES:
+        value = _load_json(os.path.join(DATA_DIR, _JSON_TABLES[name]))
+    elif name == "GMAX_MOVES":
+        value = [move for move in __getattr__("BattleMovedex") if "gmax" in move]
+    elif name == "schema":
+        value = _load_json(SCHEMA_PATH)
+    elif name == "TOKENIZED_SCHEMA":
+        value = load_tokenized_schema()
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
 
-with open(os.path.join(DATA_DIR, "BattleLearnsets.json"), "r") as f:
-    BattleLearnsets = json.loads(f.read())
 
-with open(os.path.join(DATA_DIR, "BattleMovedex.json"), "r") as f:
-    BattleMovedex = json.loads(f.read())
+def __dir__():
+    return sorted(
+        set(globals())
+        | set(_JSON_TABLES)
+        | {"GMAX_MOVES", "schema", "TOKENIZED_SCHEMA"}
+    )
 
-with open(os.path.join(DATA_DIR, "BattlePokedex.json"), "r") as f:
-    BattlePokedex = json.loads(f.read())
 
-with open(os.path.join(DATA_DIR, "BattleSearchCountIndex.json"), "r") as f:
-    BattleSearchCountIndex = json.loads(f.read())
+BOOSTS = ["atk", "def", "spc", "spa", "spd", "spe", "evasion", "accuracy"]
 
-with open(os.path.join(DATA_DIR, "BattleSearchIndex.json"), "r") as f:
-    BattleSearchIndex = json.loads(f.read())
 
-with open(os.path.join(DATA_DIR, "BattleSearchIndexOffset.json"), "r") as f:
-    BattleSearchIndexOffset = json.loads(f.read())
+def load_feature_embedding(type: str, gen: int):
+    return np.load(os.path.join("pretrained", f"gen{gen}", type + ".npy"))
 
-with open(os.path.join(DATA_DIR, "BattleTeambuilderTable.json"), "r") as f:
-    BattleTeambuilderTable = json.loads(f.read())
 
-with open(os.path.join(DATA_DIR, "BattleText.json"), "r") as f:
-    BattleText = json.loads(f.read())
+Schema = Dict[str, Dict[str, Dict[str, Dict[str, Any]]]]
 
-with open(os.path.join(DATA_DIR, "BattleTypeChart.json"), "r") as f:
-    BattleTypeChart = json.loads(f.read())
 
-with open(os.path.join(DATA_DIR, "Formats.json"), "r") as f:
-    Formats = json.loads(f.read())
+def to_id(value: Any):
+    if isinstance(value, str):
+        return "".join([c for c in value if c.isalnum()]).lower()
+    else:
+        return str(value)
 
 
-GMAX_MOVES = [move for move in BattleMovedex if "gmax" in move]
+def _get_schema_hash() -> str:
+    with open(SCHEMA_PATH, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_tokenized_schema(path: str = TOKENIZED_SCHEMA_PATH) -> Schema:
+    """Tokenizes every gen of `schema.json` and pickles it to `path`.
+
+    The pickle records the hash of `schema.json` so that
+    `load_tokenized_schema` can detect when it has gone stale.
+    """
+    schema_hash = _get_schema_hash()
+    schema: Schema = _load_json(SCHEMA_PATH)
+    tokenized_schema = {}
+    for gen in schema:
+        tokenized_schema[gen] = {}
+        for dex_type in schema[gen]:
+            tokenized_schema[gen][dex_type] = {}
+            for key, values in sorted(schema[gen][dex_type].items()):
+                tokenized_schema[gen][dex_type][key] = {
+                    to_id(value): index
+                    for index, value in enumerate(values)
+                    if to_id(value)
+                }
 
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump((schema_hash, tokenized_schema), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError:
+        # a read-only install still works, it just tokenizes every time
+        pass
+    return tokenized_schema
 
-BOOSTS = ["atk", "def", "spc", "spa", "spd", "spe", "evasion", "accuracy"]
 
+_tokenized_schema = None
 
-def load_feature_embedding(type: str, gen: int):
-    return np.load(os.path.join("pretrained", f"gen{gen}", type + ".npy"))
 
+def load_tokenized_schema(path: str = TOKENIZED_SCHEMA_PATH) -> Schema:
+    """Returns the tokenized schema, rebuilding the cache if it is stale"""
+    global _tokenized_schema
+    if _tokenized_schema is not None:
+        return _tokenized_schema
 
-Schema = Dict[str, Dict[str, Dict[str, Dict[str, Any]]]]
-with open(os.path.join(f"{ROOT_DIR}/pretrained/schema.json"), "r") as f:
-    schema: Schema = json.loads(f.read())
+    try:
+        with open(path, "rb") as f:
+            schema_hash, tokenized_schema = pickle.load(f)
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError, ValueError):
+        schema_hash, tokenized_schema = None, None
 
-TOKENIZED_SCHEMA = deepcopy(schema)
+    if schema_hash != _get_schema_hash():
+        tokenized_schema = build_tokenized_schema(path)
 
+    _tokenized_schema = tokenized_schema
+    return tokenized_schema
 
-def to_id(value: Any):
-    if isinstance(value, str):
-        return "".join([c for c in value if c.isalnum()]).lower()
-    else:
-        return str(value)
 
+class Tokenizer:
+    """Token lookups for one gen.
+
+    Every field keeps a memo from the raw value to its token, so `to_id`
+    only runs the first time a value is seen.
+    """
+
+    def __init__(self, gen: int):
+        self.gen = gen
+        self.schema = load_tokenized_schema()[f"gen{gen}"]
+        self._memos: Dict[Tuple[str, str], Dict[Any, int]] = {}
+
+    def memo(self, dex_type: str, key: str) -> Dict[Any, int]:
+        memo = self._memos.get((dex_type, key))
+        if memo is None:
+            memo = self._memos[(dex_type, key)] = {}
+        return memo
+
+    def token(self, dex_type: str, key: str, value: Any) -> int:
+        memo = self.memo(dex_type, key)
+        try:
+            return memo[value]
+        except KeyError:
+            token = memo[value] = self.schema[dex_type][key].get(to_id(value), -1)
+            return token
+
+    def tokens(self, dex_type: str, key: str, values: Sequence[Any]) -> np.ndarray:
+        memo = self.memo(dex_type, key)
+        lookup = self.schema[dex_type][key]
+        tokens = np.empty(len(values), dtype=np.int64)
+        for index, value in enumerate(values):
+            try:
+                tokens[index] = memo[value]
+            except KeyError:
+                tokens[index] = memo[value] = lookup.get(to_id(value), -1)
+        return tokens
+
+    def type(self, value: Any) -> int:
+        return self.token("movedex", "type", value)
+
+    def species(self, key: str, value: Any) -> int:
+        return self.token("pokedex", key, value)
+
+    def move(self, key: str, value: Any) -> int:
+        return self.token("movedex", key, value)
 
-for gen in TOKENIZED_SCHEMA:
-    for dex_type in schema[gen]:
-        for key, values in sorted(schema[gen][dex_type].items()):
-            TOKENIZED_SCHEMA[gen][dex_type][key] = {
-                to_id(value): index
-                for index, value in enumerate(values)
-                if to_id(value)
-            }
+    def ability(self, key: str, value: Any) -> int:
+        return self.token("abilitydex", key, value)
+
+    def item(self, key: str, value: Any) -> int:
+        return self.token("itemdex", key, value)
+
+
+_TOKENIZERS: Dict[int, Tokenizer] = {}
+
+
+def get_tokenizer(gen: int) -> Tokenizer:
+    tokenizer = _TOKENIZERS.get(gen)
+    if tokenizer is None:
+        tokenizer = _TOKENIZERS[gen] = Tokenizer(gen)
+    return tokenizer
 
 
 def get_type_token(gen: int, value: Any):
-    value = to_id(value)
-    lookup = TOKENIZED_SCHEMA[f"gen{gen}"]["movedex"]["type"]
-    return lookup.get(value, -1)
+    return get_tokenizer(gen).token("movedex", "type", value)
 
 
 def get_species_token(gen: int, key: int, value: Any):
-    value = to_id(value)
-    lookup = TOKENIZED_SCHEMA[f"gen{gen}"]["pokedex"][key]
-    return lookup.get(value, -1)
+    return get_tokenizer(gen).token("pokedex", key, value)
 
 
 def get_move_token(gen: int, key: int, value: Any):
-    value = to_id(value)
-    lookup = TOKENIZED_SCHEMA[f"gen{gen}"]["movedex"][key]
-    return lookup.get(value, -1)
+    return get_tokenizer(gen).token("movedex", key, value)
 
 
 def get_ability_token(gen: int, key: int, value: Any):
-    value = to_id(value)
-    lookup = TOKENIZED_SCHEMA[f"gen{gen}"]["abilitydex"][key]
-    return lookup.get(value, -1)
+    return get_tokenizer(gen).token("abilitydex", key, value)
 
 
 def get_item_token(gen: int, key: int, value: Any):
-    value = to_id(value)
-    lookup = TOKENIZED_SCHEMA[f"gen{gen}"]["itemdex"][key]
-    return lookup.get(value, -1)
+    return get_tokenizer(gen).token("itemdex", key, value)
 
 
 GENDERS = OrderedDict({"M": 0, "F": 1, "N": 2})
@@ -1,20 +1,138 @@
 import os
+import json
+import struct
+import threading
+
+import numpy as np
 import torch
 
 from torch import nn
 
-from typing import List
+from typing import Dict, List, Tuple
 
 from meloetta.data import ROOT_DIR
 
 
+# [torch dtype: (safetensors dtype, numpy dtype)]
+_DTYPES = {
+    torch.float64: ("F64", np.float64),
+    torch.float32: ("F32", np.float32),
+    torch.float16: ("F16", np.float16),
+}
+
+
+def get_pretrained_path(gen: int, dex: str) -> str:
+    return f"{ROOT_DIR}/pretrained/gen{gen}/{dex}.pt"
+
+
+def get_converted_path(gen: int, dex: str, dtype: torch.dtype) -> str:
+    return f"{ROOT_DIR}/pretrained/gen{gen}/{dex}.{_DTYPES[dtype][0]}.safetensors"
+
+
+def _get_src_signature(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _read_header(path: str) -> Tuple[Dict, int]:
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+
+def convert_embeddings(
+    gen: int, dex: str, dtype: torch.dtype = torch.float32, path: str = None
+) -> str:
+    """Writes the pretrained `{dex}.pt` of `gen` as a safetensors file of `dtype`.
+
+    The metadata keeps the names and the size and mtime of the `.pt` file so
+    that `load_embeddings` can detect when the conversion has gone stale.
+    """
+    src = get_pretrained_path(gen, dex)
+    if path is None:
+        path = get_converted_path(gen, dex, dtype)
+
+    names, embeddings = torch.load(src)
+    data = embeddings.to(dtype).contiguous().numpy().tobytes()
+    header = {
+        "embeddings": {
+            "dtype": _DTYPES[dtype][0],
+            "shape": list(embeddings.shape),
+            "data_offsets": [0, len(data)],
+        },
+        "__metadata__": {
+            "signature": _get_src_signature(src),
+            "names": json.dumps(names),
+        },
+    }
+    header = json.dumps(header).encode()
+    # keeps the data aligned for the memory map
+    header += b" " * (-len(header) % 8)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+_embeddings: Dict[Tuple[int, str, torch.dtype], Tuple[List[str], torch.Tensor]] = {}
+_embeddings_lock = threading.Lock()
+
+
+def load_embeddings(
+    gen: int, dex: str, dtype: torch.dtype = torch.float32
+) -> Tuple[List[str], torch.Tensor]:
+    """Returns the names and embeddings of a pretrained dex.
+
+    The embeddings are a copy-on-write memory map of the converted file, so
+    every process that loads them shares one physical copy and writes stay
+    private to the writer. Each process maps a table once and hands the
+    same tensor to every caller.
+    """
+    key = (gen, dex, dtype)
+    with _embeddings_lock:
+        if key in _embeddings:
+            return _embeddings[key]
+
+        signature = _get_src_signature(get_pretrained_path(gen, dex))
+        path = get_converted_path(gen, dex, dtype)
+        try:
+            header, offset = _read_header(path)
+        except (FileNotFoundError, struct.error, ValueError):
+            header = None
+
+        if header is None or header["__metadata__"]["signature"] != signature:
+            try:
+                convert_embeddings(gen, dex, dtype, path)
+            except OSError:
+                # a read-only install still works, just without sharing
+                names, embeddings = torch.load(get_pretrained_path(gen, dex))
+                _embeddings[key] = (names, embeddings.to(dtype))
+                return _embeddings[key]
+            header, offset = _read_header(path)
+
+        names = json.loads(header["__metadata__"]["names"])
+        embeddings = np.memmap(
+            path,
+            dtype=_DTYPES[dtype][1],
+            mode="c",
+            offset=offset,
+            shape=tuple(header["embeddings"]["shape"]),
+        )
+        _embeddings[key] = (names, torch.from_numpy(embeddings))
+        return _embeddings[key]
+
+
 class PokedexEmbedding(nn.Module):
     def __init__(self, gen: int, dtype: torch.dtype = torch.float32):
         super().__init__()
 
         embeddings: torch.Tensor
-        names, embeddings = torch.load(f"{ROOT_DIR}/pretrained/gen{gen}/pokedex.pt")
-        embeddings = embeddings.to(dtype)
+        names, embeddings = load_embeddings(gen, "pokedex", dtype)
         self.names: List[str] = names
         self.num_embeddings = embeddings.shape[0]
         self.embedding_dim = embeddings.shape[-1]
@@ -32,8 +150,7 @@ class AbilityEmbedding(nn.Module):
         super().__init__()
 
         embeddings: torch.Tensor
-        names, embeddings = torch.load(f"{ROOT_DIR}/pretrained/gen{gen}/abilitydex.pt")
-        embeddings = embeddings.to(dtype)
+        names, embeddings = load_embeddings(gen, "abilitydex", dtype)
         self.names: List[str] = names
         self.num_embeddings = embeddings.shape[0]
         self.embedding_dim = embeddings.shape[-1]
@@ -51,8 +168,7 @@ class MoveEmbedding(nn.Module):
         super().__init__()
 
         embeddings: torch.Tensor
-        names, embeddings = torch.load(f"{ROOT_DIR}/pretrained/gen{gen}/movedex.pt")
-        embeddings = embeddings.to(dtype)
+        names, embeddings = load_embeddings(gen, "movedex", dtype)
         self.names: List[str] = names
         self.num_embeddings = embeddings.shape[0]
         self.embedding_dim = embeddings.shape[-1]
@@ -70,8 +186,7 @@ class ItemEmbedding(nn.Module):
         super().__init__()
 
         embeddings: torch.Tensor
-        names, embeddings = torch.load(f"{ROOT_DIR}/pretrained/gen{gen}/itemdex.pt")
-        embeddings = embeddings.to(dtype)
+        names, embeddings = load_embeddings(gen, "itemdex", dtype)
         self.names: List[str] = names
         self.num_embeddings = embeddings.shape[0]
         self.embedding_dim = embeddings.shape[-1]
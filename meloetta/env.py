@@ -0,0 +1,335 @@
+import torch
+import asyncio
+
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+from meloetta.player import Player
+from meloetta.room import BattleRoomPool
+from meloetta.actors.base import Actor, resolve
+from meloetta.actors.inference import collate
+from meloetta.actors.types import State
+from meloetta.simulator import SIDES, LocalBattleStream
+from meloetta.utils import expand_bt
+from meloetta.vector import IncrementalVectorizedState
+
+DRAW_BY_TURNS = 300
+
+TRAPPED = "Can't switch: The active Pokémon is trapped"
+
+
+class StepOutput(NamedTuple):
+    """`(1, num_envs, ...)` observations, and per env `reward`, `done` and
+    `ready`, which is False for envs that are waiting on their opponent and
+    whose action will be ignored"""
+
+    observation: State
+    reward: torch.Tensor
+    done: torch.Tensor
+    ready: torch.Tensor
+
+
+class Seat:
+    """One side of a battle, and everything needed to act for it"""
+
+    def __init__(self, player: Player, side: str):
+        self.player = player
+        self.side = side
+        self.stream: LocalBattleStream = None
+        self.vectorizer = IncrementalVectorizedState(player.room)
+        self.vstate = None
+        self.choices = None
+        self.observation = None
+        self.turn = 0
+        self.turns_since_last_move = expand_bt(torch.tensor(0, dtype=torch.long))
+        self.task: asyncio.Task = None
+        self.ready = False
+        self.ended = False
+
+    def reset(self, stream: LocalBattleStream):
+        self.player.reset()
+        self.stream = stream
+        self.vstate = None
+        self.choices = None
+        self.turn = 0
+        self.turns_since_last_move = expand_bt(torch.tensor(0, dtype=torch.long))
+        self.ready = False
+        self.ended = False
+
+    @property
+    def blocked(self) -> bool:
+        """Waiting on a message that has not been sent yet"""
+        return self.stream.queues[self.side].empty()
+
+
+class VectorBattleEnv:
+    """Steps `num_envs` battles together against local simulators.
+
+    Envs pair up into self-play battles, env `2k` playing env `2k + 1`,
+    unless `opponent_fn` is given, in which case every env is its own battle
+    against an actor built by `opponent_fn`. Observations are the states the
+    workers hand their actors, stacked along the batch dim. An action is a
+    `(choice_type, index)` key into `choices[env]`, or the `(func, args,
+    kwargs)` an actor returns. Battles that end are restarted, and their
+    envs observe the first state of the new battle.
+    """
+
+    def __init__(
+        self,
+        num_envs: int,
+        battle_format: str,
+        team: str = None,
+        simulator_command: Sequence[str] = None,
+        opponent_fn: Callable[[], Actor] = None,
+    ):
+        if opponent_fn is None and num_envs % 2:
+            raise ValueError("self-play needs an even number of envs")
+
+        self.num_envs = num_envs
+        self.battle_format = battle_format
+        self.team = team
+        self.simulator_command = simulator_command
+        self.opponent_fn = opponent_fn
+
+        self.loop = asyncio.new_event_loop()
+        self.room_pool = BattleRoomPool()
+        self.seats = [
+            Seat(
+                Player.from_client(None, self.room_pool.room(f"env{index}")),
+                "p1" if opponent_fn is not None else SIDES[index % 2],
+            )
+            for index in range(num_envs)
+        ]
+
+        # the seats of every battle, with the opponent's last when there is one
+        if opponent_fn is None:
+            self.battles = [self.seats[i : i + 2] for i in range(0, num_envs, 2)]
+        else:
+            self.battles = [
+                [
+                    seat,
+                    Seat(
+                        Player.from_client(
+                            None, self.room_pool.room(f"opponent{index}")
+                        ),
+                        "p2",
+                    ),
+                ]
+                for index, seat in enumerate(self.seats)
+            ]
+        self.opponents: Dict[int, asyncio.Task] = {}
+        self._spares: List[LocalBattleStream] = []
+
+    @property
+    def choices(self) -> List[Dict[str, Dict[int, Tuple[Callable, list, dict]]]]:
+        return [seat.choices.choices for seat in self.seats]
+
+    def reset(self) -> StepOutput:
+        return self.loop.run_until_complete(self._reset())
+
+    def step(self, actions: Sequence[Any]) -> StepOutput:
+        return self.loop.run_until_complete(self._step(actions))
+
+    def close(self):
+        tasks = [*self.opponents.values()]
+        streams = [*self._spares]
+        for battle in self.battles:
+            for seat in battle:
+                if seat.task is not None:
+                    tasks.append(seat.task)
+                if seat.stream is not None and seat.stream not in streams:
+                    streams.append(seat.stream)
+        for task in tasks:
+            task.cancel()
+        for stream in streams:
+            stream.close()
+
+        async def wait_closed():
+            await asyncio.gather(
+                *tasks,
+                *[stream.wait_closed() for stream in streams],
+                return_exceptions=True,
+            )
+
+        self.loop.run_until_complete(wait_closed())
+        self.room_pool.close()
+        self.loop.close()
+
+    async def _reset(self) -> StepOutput:
+        for index in range(len(self.battles)):
+            await self._start_battle(index)
+        done = torch.zeros(self.num_envs, dtype=torch.bool)
+        reward = torch.zeros(self.num_envs)
+        await asyncio.gather(
+            *[self._settle(index, reward, done) for index in range(len(self.battles))]
+        )
+        return self._output(reward, torch.zeros_like(done))
+
+    async def _step(self, actions: Sequence[Any]) -> StepOutput:
+        for seat, action in zip(self.seats, actions):
+            if seat.ready and not await self._act(seat, action):
+                seat.task = asyncio.ensure_future(self._advance(seat))
+
+        done = torch.zeros(self.num_envs, dtype=torch.bool)
+        reward = torch.zeros(self.num_envs)
+        await asyncio.gather(
+            *[self._settle(index, reward, done) for index in range(len(self.battles))]
+        )
+        return self._output(reward, done)
+
+    def _output(self, reward: torch.Tensor, done: torch.Tensor) -> StepOutput:
+        observations = [seat.observation for seat in self.seats]
+        template = next(obs for obs in observations if obs is not None)
+        observations = [
+            obs
+            if obs is not None
+            else {
+                key: torch.zeros_like(value)
+                if isinstance(value, torch.Tensor)
+                else value
+                for key, value in template.items()
+            }
+            for obs in observations
+        ]
+        ready = torch.tensor([seat.ready for seat in self.seats])
+        return StepOutput(collate(observations), reward, done, ready)
+
+    async def _spawn(self) -> LocalBattleStream:
+        stream = LocalBattleStream(self.battle_format, self.simulator_command)
+        return await stream.spawn()
+
+    async def _start_battle(self, index: int):
+        # the next battle's simulator loads while this one is played
+        stream = self._spares.pop() if self._spares else await self._spawn()
+        self._spares.append(await self._spawn())
+
+        if index in self.opponents:
+            self.opponents.pop(index).cancel()
+        battle = self.battles[index]
+        for seat in battle:
+            if seat.task is not None:
+                seat.task.cancel()
+                seat.task = None
+            if seat.stream is not None:
+                seat.stream.close()
+                await seat.stream.wait_closed()
+            seat.reset(stream)
+        await stream.start([f"env{index}p1", f"env{index}p2"], self.team)
+
+        for seat in battle[: len(battle) - (self.opponent_fn is not None)]:
+            seat.task = asyncio.ensure_future(self._advance(seat))
+        if self.opponent_fn is not None:
+            self.opponents[index] = asyncio.ensure_future(
+                self._play(battle[-1], self.opponent_fn())
+            )
+
+    async def _settle(self, index: int, reward: torch.Tensor, done: torch.Tensor):
+        """Waits until a seat of battle `index` has to act and its other seats
+        are waiting on it, restarting the battle if it ended"""
+        battle = self.battles[index]
+        seats = battle if self.opponent_fn is None else battle[:1]
+        while True:
+            pending = [seat.task for seat in seats if seat.task is not None]
+            if index in self.opponents:
+                pending.append(self.opponents[index])
+            if not any(seat.ready for seat in seats):
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # let the other seats catch up on what was already sent to them
+            while any(
+                seat.task is not None and not seat.task.done() and not seat.blocked
+                for seat in seats
+            ):
+                await asyncio.sleep(0)
+
+            opponent = self.opponents.get(index)
+            if opponent is not None and opponent.done():
+                # surfaces the opponent's errors, it is restarted with the battle
+                opponent.result()
+            for seat in seats:
+                if seat.task is not None and seat.task.done():
+                    seat.task.result()
+                    seat.task = None
+
+            if all(seat.ended for seat in seats):
+                for seat in seats:
+                    env = self.seats.index(seat)
+                    reward[env] = seat.player.room.get_reward()["reward"]
+                    done[env] = True
+                await self._start_battle(index)
+            elif any(seat.ready for seat in seats):
+                return
+
+    async def _advance(self, seat: Seat):
+        """Reads `seat`'s messages until it has to act or its battle ends"""
+        player = seat.player
+        while True:
+            message = await seat.stream.receive(seat.side)
+            action_required = player._recieve(message)
+
+            if TRAPPED in message:
+                message = await seat.stream.receive(seat.side)
+                action_required = player._recieve(message)
+                action_required = True
+
+            if action_required:
+                battle = player.room.status["battle"]
+                if battle is None:
+                    battle = player.room.get_battle()
+                seat.turn = battle["turn"]
+                seat.vstate = seat.vectorizer.vectorize_battle(battle).to_dict()
+
+            if player.room.status["ended"]:
+                seat.ended = True
+                return
+
+            if seat.turn > DRAW_BY_TURNS:
+                await seat.stream.send(seat.side, "/offertie")
+
+            if action_required and not player.room.status["waiting"]:
+                self._observe(seat)
+                return
+
+    def _observe(self, seat: Seat):
+        seat.choices = seat.player.get_choices(seat.turns_since_last_move)
+        seat.observation = {
+            **seat.vstate,
+            **seat.choices.action_masks,
+            **seat.choices.prev_choices,
+            "targeting": seat.choices.targeting,
+        }
+        seat.ready = True
+
+    async def _act(self, seat: Seat, action: Any) -> bool:
+        """Makes a choice for `seat`, returning whether it has another to make"""
+        if isinstance(action[0], str):
+            choice_type, index = action
+            action = seat.choices.choices[choice_type][index]
+        func, args, kwargs = action
+        func(*args, **kwargs)
+        seat.ready = False
+
+        room = seat.player.room
+        outgoing_message = room.pop_outgoing()
+        if outgoing_message:
+            if "move" in outgoing_message:
+                seat.turns_since_last_move = seat.turns_since_last_move * 0
+            else:
+                seat.turns_since_last_move = seat.turns_since_last_move + 1
+            await seat.stream.send(seat.side, outgoing_message)
+
+        if not room.status["waiting"] and not outgoing_message:
+            # more choices to make this turn, e.g. the other slot in doubles
+            self._observe(seat)
+            return True
+        return False
+
+    async def _play(self, seat: Seat, actor: Actor):
+        while True:
+            await self._advance(seat)
+            if seat.ended:
+                break
+            while seat.ready:
+                action = await resolve(
+                    actor(seat.observation, seat.player.room, seat.choices.choices)
+                )
+                await self._act(seat, action)
+        actor.post_match(seat.player.room)
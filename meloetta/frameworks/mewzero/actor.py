@@ -12,6 +12,7 @@ from meloetta.frameworks.mewzero.model import (
 )
 
 from meloetta.actors.base import Actor
+from meloetta.actors.parameters import ParameterServer
 from meloetta.actors.types import State, Choices
 
 
@@ -20,9 +21,11 @@ class MewZeroActor(Actor):
         self,
         model: MewZeroModel,
         replay_buffer: ReplayBuffer = None,
+        params: ParameterServer = None,
     ):
         self.model = model
         self.replay_buffer = replay_buffer
+        self.params = params
         self.hidden_state = model.core.initial_state(1)
 
     @property
@@ -36,6 +39,9 @@ class MewZeroActor(Actor):
         choices: Choices,
     ):
         output: Tuple[EnvStep, PostProcess]
+        if self.params is not None:
+            # between forwards, so no forward sees a partial update
+            self.params.sync(self.model)
         with torch.no_grad():
             output = self.model(state, self.hidden_state, choices)
         env_step, postprocess, self.hidden_state = output
@@ -2,13 +2,13 @@ import torch
 import threading
 import multiprocessing as mp
 
-from typing import Dict, List
+from typing import Dict
 
 from meloetta.frameworks.mewzero.model.interfaces import Batch
 from meloetta.frameworks.mewzero.utils import create_buffers
 
 
-Buffers = Dict[str, List[torch.Tensor]]
+Buffers = Dict[str, torch.Tensor]
 
 
 class ReplayBuffer:
@@ -101,7 +101,7 @@ class ReplayBuffer:
         with lock:
             indices = [self.full_queue.get() for _ in range(batch_size)]
 
-        valids = torch.stack([self.buffers["valid"][m] for m in indices])
+        valids = self.buffers["valid"][torch.tensor(indices)]
         lengths = valids.sum(-1)
 
         if torch.any(lengths == 0):
@@ -119,13 +119,10 @@ class ReplayBuffer:
             )
         )[1]
 
-        batch = {
-            key: torch.stack(
-                [self.buffers[key][index][:max_length] for index in indices],
-                dim=1,
-            )
-            for key in self.buffers
-        }
+        # one gather per key, `[max_length, batch_size, ...]`
+        index = torch.tensor(indices).unsqueeze(0)
+        steps = torch.arange(max_length).unsqueeze(-1)
+        batch = {key: value[index, steps] for key, value in self.buffers.items()}
 
         for m in indices:
             self.free_queue.put(m)
@@ -47,6 +47,10 @@ class MewZeroConfig:
     clip_gradient: float = 10_000
     # The "speed" at which `params_target` is following `params`.
     target_network_avg: float = 0.01
+    # The learner publishes its weights to the actors every `publish_steps`
+    # steps, or sooner once `publish_seconds` have passed since the last.
+    publish_steps: int = 1
+    publish_seconds: float = None
 
     # RNaD algorithm configuration.
     # Entropy schedule configuration. See EntropySchedule class documentation.
@@ -10,6 +10,7 @@ import torch.nn.functional as F
 
 from typing import Tuple
 
+from meloetta.actors.parameters import ParameterServer
 from meloetta.frameworks.mewzero import utils
 from meloetta.frameworks.mewzero.buffer import ReplayBuffer
 from meloetta.frameworks.mewzero.config import MewZeroConfig
@@ -94,6 +95,13 @@ class MewZeroLearner:
         )
         self.learner_steps = 0
 
+        # actor processes each keep a copy of `actor_model` and load the
+        # weights published here between forwards
+        self.params = ParameterServer(
+            self.actor_model, config.publish_steps, config.publish_seconds
+        )
+        self.params.publish(self.actor_model, self.learner_steps)
+
     def get_config(self):
         return {
             "parameters": self.learner_model.get_learnable_params(),
@@ -150,7 +158,6 @@ class MewZeroLearner:
             gen=gen, gametype=gametype, config=config.model_config
         )
         actor_model.load_state_dict(learner_model.state_dict())
-        actor_model.share_memory()
         actor_model.eval()
 
         target_model = MewZeroModel(
@@ -223,6 +230,8 @@ class MewZeroLearner:
         else:
             print("Learner steps not loaded")
 
+        learner.params.publish(learner.actor_model, learner.learner_steps)
+
         return learner
 
     def collect_batch_trajectory(self):
@@ -279,7 +288,8 @@ class MewZeroLearner:
                 self.model_prev_.load_state_dict(self.model_prev.state_dict())
                 self.model_prev.load_state_dict(self.learner_model.state_dict())
 
-            self.actor_model.load_state_dict(self.learner_model.state_dict())
+            if self.params.step(self.learner_model, self.learner_steps + 1):
+                self.params.sync(self.actor_model)
 
     def _get_targets(
         self,
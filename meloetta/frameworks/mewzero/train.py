@@ -88,6 +88,7 @@ def main(fpath: str = None):
                 eval_actor_fn=main_actor,
                 eval_actor_kwargs={
                     "model": learner.actor_model,
+                    "params": learner.params,
                 },
                 baseline_actor_fn=opponent_actor,
                 baseline_actor_args=opponent_actor_args,
@@ -118,6 +119,7 @@ def main(fpath: str = None):
             actor_kwargs={
                 "model": learner.actor_model,
                 "replay_buffer": learner.replay_buffer,
+                "params": learner.params,
             },
         )
 
@@ -1,7 +1,7 @@
 import re
 import torch
 
-from typing import Dict, List, Any, Sequence, Callable, NamedTuple, Tuple
+from typing import Dict, Any, Sequence, Callable, NamedTuple, Tuple
 
 
 from meloetta.data import CHOICE_FLAGS
@@ -89,43 +89,38 @@ def scan(f: Callable, init, xs, length=None, reverse: bool = False):
     return carry, res
 
 
+def _reverse_affine_scan(
+    a: torch.Tensor, b: torch.Tensor, init: torch.Tensor
+) -> torch.Tensor:
+    """Solves `y[t] = a[t] + b[t] * y[t + 1]` backwards over the leading
+    dimension, with `y[T] = init`, in `log2(T)` vectorized steps by
+    composing ever longer spans of the recursion. Where `b[t]` is 0 the
+    recursion restarts, and nothing after `t` reaches `y[t]`, not even nan."""
+    length = a.shape[0]
+    shift = 1
+    while shift < length:
+        keep = b[:-shift] != 0
+        a = torch.cat(
+            [a[:-shift] + torch.where(keep, b[:-shift] * a[shift:], 0), a[-shift:]]
+        )
+        b = torch.cat([torch.where(keep, b[:-shift] * b[shift:], 0), b[-shift:]])
+        shift *= 2
+    return a + b * init
+
+
+def _shift_back(x: torch.Tensor, last: torch.Tensor) -> torch.Tensor:
+    """`x[t + 1]` at every `t`, with `last` after the final step"""
+    return torch.cat([x[1:], last.expand_as(x[:1])])
+
+
 def _has_played(
     valid: torch.Tensor, player_id: torch.Tensor, player: int
 ) -> torch.Tensor:
     """Compute a mask of states which have a next state in the sequence."""
     assert valid.shape == player_id.shape
-
-    def _loop_has_played(carry, x):
-        valid, player_id = x
-        assert valid.shape == player_id.shape
-
-        our_res = torch.ones_like(player_id)
-        opp_res = carry
-        reset_res = torch.zeros_like(carry)
-
-        our_carry = carry
-        opp_carry = carry
-        reset_carry = torch.zeros_like(player_id)
-
-        # pyformat: disable
-        return _where(
-            valid,
-            _where(
-                (player_id == player),
-                (our_carry, our_res),
-                (opp_carry, opp_res),
-            ),
-            (reset_carry, reset_res),
-        )
-        # pyformat: enable
-
-    _, result = scan(
-        f=_loop_has_played,
-        init=torch.zeros_like(player_id[-1]),
-        xs=(valid, player_id),
-        reverse=True,
-    )
-    return result
+    # The reverse scan this mirrors only ever resets its carry to zero, so a
+    # state has a next one exactly when it is a valid turn of `player`.
+    return (valid & (player_id == player)).to(player_id.dtype)
 
 
 def _policy_ratio(
@@ -190,115 +185,78 @@ def v_trace(
     )
     eta_log_policy = -eta * merged_log_policy * player_others
 
-    init_state_v_trace = LoopVTraceCarry(
-        reward=torch.zeros_like(reward[-1]),
-        reward_uncorrected=torch.zeros_like(reward[-1]),
-        next_value=torch.zeros_like(v[-1]),
-        next_v_target=torch.zeros_like(v[-1]),
-        importance_sampling=torch.ones_like(policy_ratio[-1]),
+    our = valid & (player_id == player)
+    opp = valid & (player_id != player)
+    cs = policy_ratio
+    zeros = torch.zeros_like(cs)
+
+    # The carry each step hands to the one before it. On our turns and
+    # invalid ones it is reset, on the opponent's it accumulates, so every
+    # field is an affine function of the one after: y[t] = a[t] + b[t] * y[t + 1]
+    carry_a = torch.stack(
+        [
+            (~opp).to(cs.dtype),
+            torch.where(opp, reward + eta_reg_entropy, zeros),
+            torch.where(opp, eta_reg_entropy + cs * reward, zeros),
+            torch.where(our, v.squeeze(-1), zeros),
+        ],
+        dim=-1,
+    )
+    carry_b = torch.stack(
+        [
+            torch.where(opp, cs, zeros),
+            torch.where(opp, gamma, zeros),
+            torch.where(opp, gamma * cs, zeros),
+            torch.where(opp, gamma, zeros),
+        ],
+        dim=-1,
+    )
+    # importance_sampling, reward_uncorrected, reward, next_value
+    carry_init = torch.tensor([1.0, 0.0, 0.0, 0.0], dtype=cs.dtype, device=cs.device)
+    carry = _reverse_affine_scan(carry_a, carry_b, carry_init)
+    carry = _shift_back(carry, carry_init)
+    (
+        importance_sampling,
+        carry_reward_uncorrected,
+        carry_reward,
+        next_value,
+    ) = carry.unbind(-1)
+    next_value = next_value.unsqueeze(-1)
+
+    reward_uncorrected = reward + gamma * carry_reward_uncorrected + eta_reg_entropy
+    discounted_reward = reward + gamma * carry_reward
+    cs_is = cs * importance_sampling
+
+    # V-target, itself carried back from our next turn:
+    # v_target[t] = base[t] + coef[t] * (next_v_target[t] - next_value[t])
+    base = v + torch.unsqueeze(torch.clamp(cs_is, max=rho), dim=-1) * (
+        torch.unsqueeze(reward_uncorrected, dim=-1) + gamma * next_value - v
+    )
+    coef = lambda_ * torch.unsqueeze(torch.clamp(cs_is, max=c), dim=-1) * gamma
+    our_, opp_ = our.unsqueeze(-1), opp.unsqueeze(-1)
+    next_v_target = _reverse_affine_scan(
+        torch.where(our_, base - coef * next_value, torch.zeros_like(v)),
+        torch.where(our_, coef, torch.where(opp_, gamma, torch.zeros_like(v))),
+        torch.zeros_like(v[-1]),
+    )
+    next_v_target = _shift_back(next_v_target, torch.zeros_like(v[-1]))
+    v_target = torch.where(
+        our_, base + coef * (next_v_target - next_value), torch.zeros_like(v)
     )
 
-    def _loop_v_trace(carry: LoopVTraceCarry, x) -> Tuple[LoopVTraceCarry, Any]:
-        (
-            cs,
-            player_id,
-            v,
-            reward,
-            eta_reg_entropy,
-            valid,
-            inv_mu,
-            actions_oh,
-            eta_log_policy,
-        ) = x
-
-        reward_uncorrected = reward + gamma * carry.reward_uncorrected + eta_reg_entropy
-        discounted_reward = reward + gamma * carry.reward
-
-        # V-target:
-        our_v_target = (
-            v
-            + torch.unsqueeze(
-                torch.clamp(cs * carry.importance_sampling, max=rho), dim=-1
-            )
-            * (
-                torch.unsqueeze(reward_uncorrected, dim=-1)
-                + gamma * carry.next_value
-                - v
-            )
-            + lambda_
-            * torch.unsqueeze(
-                torch.clamp(cs * carry.importance_sampling, max=c), dim=-1
-            )
-            * gamma
-            * (carry.next_v_target - carry.next_value)
-        )
-
-        opp_v_target = torch.zeros_like(our_v_target)
-        reset_v_target = torch.zeros_like(our_v_target)
-
-        # Learning output:
-        our_learning_output = (
-            v
-            + eta_log_policy  # value
-            + actions_oh  # regularisation
-            * torch.unsqueeze(inv_mu, dim=-1)
-            * (
-                torch.unsqueeze(discounted_reward, dim=-1)
-                + gamma
-                * torch.unsqueeze(carry.importance_sampling, dim=-1)
-                * carry.next_v_target
-                - v
-            )
-        )
-
-        opp_learning_output = torch.zeros_like(our_learning_output)
-        reset_learning_output = torch.zeros_like(our_learning_output)
-
-        # State carry:
-        our_carry = LoopVTraceCarry(
-            reward=torch.zeros_like(carry.reward),
-            next_value=v,
-            next_v_target=our_v_target,
-            reward_uncorrected=torch.zeros_like(carry.reward_uncorrected),
-            importance_sampling=torch.ones_like(carry.importance_sampling),
-        )
-        opp_carry = LoopVTraceCarry(
-            reward=eta_reg_entropy + cs * discounted_reward,
-            reward_uncorrected=reward_uncorrected,
-            next_value=gamma * carry.next_value,
-            next_v_target=gamma * carry.next_v_target,
-            importance_sampling=cs * carry.importance_sampling,
-        )
-        reset_carry = init_state_v_trace
-
-        # Invalid turn: init_state_v_trace and (zero target, learning_output)
-        # pyformat: disable
-        return _where(
-            valid,
-            _where(
-                (player_id == player),
-                (our_carry, (our_v_target, our_learning_output)),
-                (opp_carry, (opp_v_target, opp_learning_output)),
-            ),
-            (reset_carry, (reset_v_target, reset_learning_output)),
-        )
-        # pyformat: enable
-
-    _, (v_target, learning_output) = scan(
-        f=_loop_v_trace,
-        init=init_state_v_trace,
-        xs=(
-            policy_ratio,
-            player_id,
-            v,
-            reward,
-            eta_reg_entropy,
-            valid,
-            inv_mu,
-            actions_oh,
-            eta_log_policy,
+    # Learning output:
+    learning_output = torch.where(
+        our_,
+        v
+        + eta_log_policy  # value
+        + actions_oh  # regularisation
+        * torch.unsqueeze(inv_mu, dim=-1)
+        * (
+            torch.unsqueeze(discounted_reward, dim=-1)
+            + gamma * torch.unsqueeze(importance_sampling, dim=-1) * next_v_target
+            - v
         ),
-        reverse=True,
+        torch.zeros_like(actions_oh),
     )
 
     return v_target, has_played, learning_output
@@ -638,13 +596,14 @@ def create_buffers(num_buffers: int, trajectory_length: int, gen: int, gametype:
         trajectory_length, gen, gametype, private_reserve_size
     )
 
-    buffers: Dict[str, List[torch.Tensor]] = {key: [] for key in buffer_specs}
-    for _ in range(num_buffers):
-        for key in buffer_specs:
-            if key.endswith("_mask"):
-                buffers[key].append(torch.ones(**buffer_specs[key]).share_memory_())
-            else:
-                buffers[key].append(torch.zeros(**buffer_specs[key]).share_memory_())
+    # one shared slab per key, `[num_buffers, trajectory_length, ...]`
+    buffers: Dict[str, torch.Tensor] = {}
+    for key, spec in buffer_specs.items():
+        size = (num_buffers, *spec["size"])
+        if key.endswith("_mask"):
+            buffers[key] = torch.ones(size, dtype=spec["dtype"]).share_memory_()
+        else:
+            buffers[key] = torch.zeros(size, dtype=spec["dtype"]).share_memory_()
     return buffers
 
 
@@ -12,9 +12,12 @@ from meloetta.frameworks.nash_ketchum.buffer import ReplayBuffer
 from meloetta.frameworks.nash_ketchum.modelv2 import NAshKetchumModel
 
 from meloetta.data import to_id
-from meloetta.actors.base import Actor
+from meloetta.actors.base import Actor, AsyncActor
+from meloetta.actors.inference import InferenceServer
+from meloetta.actors.parameters import ParameterServer
 from meloetta.actors.types import State, Choices, Battle, TensorDict
 from meloetta.utils import expand_bt
+from meloetta.vector import ProtocolTracker
 from meloetta.data import (
     BOOSTS,
     VOLATILES,
@@ -81,14 +84,27 @@ POKEMON_VECTOR_SIZE = 38
 
 
 class NAshKetchumActor(Actor):
+    def __new__(cls, *args, inference: InferenceServer = None, **kwargs):
+        # with an inference server, forwards are awaited instead of blocking
+        # the worker's event loop, see `AsyncNAshKetchumActor`
+        if inference is not None and cls is NAshKetchumActor:
+            cls = AsyncNAshKetchumActor
+        return super().__new__(cls)
+
     def __init__(
         self,
         model: NAshKetchumModel = None,
         replay_buffer: ReplayBuffer = None,
         pid: str = None,
+        inference: InferenceServer = None,
+        params: ParameterServer = None,
     ):
         self.model = model
         self.gen = model.gen
+        self.inference = inference
+        self.params = params
+        # the published version of the weights `model` acted with, -1 if unknown
+        self.policy_version = -1
 
         self.replay_buffer = replay_buffer
 
@@ -100,15 +116,32 @@ class NAshKetchumActor(Actor):
         self.turns = []
         self.trajectory = []
 
+        self.tracker = ProtocolTracker()
+        self._pokemon_vectors = {}
+        self._prev_active = set()
+
     @property
     def storing_transition(self):
         return self.replay_buffer is not None
 
     @torch.no_grad()
     def choose_action(self, state: State, room: BattleRoom, choices: Choices):
+        if self.params is not None:
+            # between forwards, so no forward sees a partial update
+            self.policy_version = self.params.sync(self.model)
         model_output = self.model.forward(
             state, compute_log_policy=False, compute_value=False
         )
+        return self._act(state, room, choices, model_output)
+
+    @torch.no_grad()
+    def _act(
+        self,
+        state: State,
+        room: BattleRoom,
+        choices: Choices,
+        model_output: TensorDict,
+    ):
         postprocess = self.model.postprocess(
             state=state,
             model_output=model_output,
@@ -120,6 +153,9 @@ class NAshKetchumActor(Actor):
         func, args, kwargs = data[index]
 
         if self.storing_transition:
+            model_output["policy_version"] = torch.tensor(
+                self.policy_version, dtype=torch.long
+            )
             action_type = model_output["action_type_index"].item()
             if action_type == 0:
                 policies_to_store = []
@@ -263,6 +299,22 @@ class NAshKetchumActor(Actor):
         ]
         return torch.tensor(data)
 
+    def _cached_vectorize_pokemon(
+        self,
+        key: Any,
+        datum: Dict[str, Any],
+        sideid: int,
+        public: bool = False,
+        clean: bool = False,
+    ) -> torch.Tensor:
+        # reused when no protocol line touched the pokemon or its datum is unchanged
+        cached = self._pokemon_vectors.get(key)
+        if cached is not None and (clean or cached[0] == datum):
+            return cached[1]
+        vector = self._vectorize_pokemon(datum, sideid=sideid, public=public)
+        self._pokemon_vectors[key] = (datum, vector)
+        return vector
+
     def _get_turns(
         self,
         my_private_side: Dict[str, Dict[str, Any]],
@@ -379,6 +431,22 @@ class NAshKetchumActor(Actor):
             p["searchid"] for p in battle["farSide"]["active"] if p is not None
         }
 
+        delta = self.tracker.update(room)
+        if delta.reset:
+            self._pokemon_vectors = {}
+        active_idents = {
+            p["ident"]
+            for side in SIDES
+            for p in battle[side]["active"]
+            if p is not None
+        }
+        stale = active_idents | self._prev_active
+        self._prev_active = active_idents
+
+        def _clean(pokemon: Dict[str, Any]):
+            ident = pokemon["ident"]
+            return ident not in stale and not delta.touched(ident)
+
         my_public_side_lst = [
             (k, v) if k in my_public_side else ("", None)
             for k, v in my_private_side.items()
@@ -472,7 +540,9 @@ class NAshKetchumActor(Actor):
                 if value is not None:
                     datum[key] = value
 
-            private_vector = self._vectorize_pokemon(datum, sideid=0)
+            private_vector = self._cached_vectorize_pokemon(
+                ("private", sid), datum, sideid=0
+            )
             my_private_side_vectors.append(private_vector)
 
         my_public_side_vectors = []
@@ -489,7 +559,10 @@ class NAshKetchumActor(Actor):
                         if value is not None:
                             datum[key] = value
 
-                public_vector = self._vectorize_pokemon(datum, sideid=0, public=True)
+                # built from the request, so always compared
+                public_vector = self._cached_vectorize_pokemon(
+                    ("mySide", sid), datum, sideid=0, public=True
+                )
             my_public_side_vectors.append(public_vector)
 
         opp_public_side_vectors = []
@@ -502,7 +575,13 @@ class NAshKetchumActor(Actor):
                     if value is not None:
                         datum[key] = value
 
-            public_vector = self._vectorize_pokemon(datum, sideid=1, public=True)
+            public_vector = self._cached_vectorize_pokemon(
+                ("farSide", sid),
+                datum,
+                sideid=1,
+                public=True,
+                clean=_clean(public_data),
+            )
             opp_public_side_vectors.append(public_vector)
 
         if my_private_side_vectors:
@@ -576,3 +655,18 @@ class NAshKetchumActor(Actor):
         }
         state = {key: expand_bt(value) for key, value in state.items()}
         return state
+
+
+class AsyncNAshKetchumActor(AsyncActor, NAshKetchumActor):
+    """A `NAshKetchumActor` whose forwards go through an `InferenceServer`.
+
+    `NAshKetchumActor(..., inference=server)` builds one. Awaiting the server
+    leaves the event loop free to send the requests of the worker's other
+    battles, so they share a batch instead of each waiting out `max_wait`.
+    """
+
+    async def choose_action(self, state: State, room: BattleRoom, choices: Choices):
+        model_output = await self.inference.infer(state)
+        # the version the server synced for this forward, if it syncs at all
+        self.policy_version = model_output.pop("policy_version", -1)
+        return self._act(state, room, choices, model_output)
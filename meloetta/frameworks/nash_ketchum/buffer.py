@@ -1,14 +1,18 @@
+import os
+import queue
 import torch
 import threading
 import multiprocessing as mp
 
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from meloetta.actors.types import TensorDict
-from meloetta.frameworks.nash_ketchum.utils import create_buffers
+from meloetta.frameworks.nash_ketchum.sampler import FIFOSampler, Sampler
+from meloetta.frameworks.nash_ketchum.slots import SlotTable
+from meloetta.frameworks.nash_ketchum.utils import _player_masks, create_buffers
 
 
-Buffers = Dict[str, List[torch.Tensor]]
+Buffers = Dict[str, torch.Tensor]
 
 
 class ReplayBuffer:
@@ -21,21 +25,22 @@ class ReplayBuffer:
         device: torch.device = torch.device(
             "cuda" if torch.cuda.is_available() else "cpu"
         ),
+        sampler: Sampler = None,
     ):
         self.trajectory_length = trajectory_length
         self.num_buffers = num_buffers
         self.device = device
         self.finish_queue = mp.Queue()
 
-        manager = mp.Manager()
-        self.index_cache = manager.dict()
+        self.slots = SlotTable(num_buffers)
+        # which finished trajectories each batch is made of, and for how long
+        # they are kept around to be sampled again
+        self.sampler = FIFOSampler(num_buffers) if sampler is None else sampler
 
         self.buffers = create_buffers(num_buffers, trajectory_length, gen, gametype)
 
         self.valid_masks = [field for field in self.buffers if field.endswith("_mask")]
 
-        self.done_cache = [[0 for _ in range(num_buffers)] for _ in range(2)]
-
         self.full_queue = mp.Queue()
         self.free_queue = mp.Queue()
 
@@ -43,103 +48,126 @@ class ReplayBuffer:
             self.free_queue.put(m)
 
     def _get_index(self, battle_tag: str, pid: int = None) -> int:
-        if battle_tag in self.index_cache:
-            index = self.index_cache[battle_tag]
-        else:
-            index = self.free_queue.get()
-            self._reset_index(index)
-            self.index_cache[battle_tag] = index
-            assert torch.all(~self.buffers["valid"][pid][index]).item()
+        index = self.slots.find(battle_tag)
+        while index is None:
+            try:
+                free_index = self.free_queue.get(timeout=0.1)
+            except queue.Empty:
+                # the other player may have taken the battle's slot meanwhile,
+                # and waiting on another one could then wait forever
+                index = self.slots.find(battle_tag)
+                continue
+            # reset before the claim makes it visible to the other player
+            self._reset_index(free_index)
+            index = self.slots.claim(battle_tag, free_index, os.getpid())
+            if index != free_index:
+                # the battle's other player claimed a slot first
+                self.free_queue.put(free_index)
+        assert torch.all(~self.buffers["valid"][index, pid]).item()
         return index
 
     def store_sample(self, index: int, turn: int, pid: int, step: TensorDict):
-        assert (~self.buffers["valid"][pid][index][turn]).item()
+        assert (~self.buffers["valid"][index, pid, turn]).item()
         for key, value in step.items():
             try:
-                self.buffers[key][pid][index][turn][...] = value
+                self.buffers[key][index, pid, turn][...] = value
             except Exception as e:
                 raise e
-        self.buffers["valid"][pid][index][turn][...] = 1
+        self.buffers["valid"][index, pid, turn][...] = 1
 
     def store_trajectory(self, index: int, pid: int, step: TensorDict):
         trajectory_length = step["utc"].shape[0]
-        assert torch.all(~self.buffers["valid"][pid][index]).item()
+        assert torch.all(~self.buffers["valid"][index, pid]).item()
         for key, values in step.items():
             try:
-                self.buffers[key][pid][index][:trajectory_length][...] = values
+                self.buffers[key][index, pid, :trajectory_length][...] = values
             except Exception as e:
                 raise e
-        self.buffers["valid"][pid][index][:trajectory_length][...] = 1
+        self.buffers["valid"][index, pid, :trajectory_length][...] = 1
 
     def append_reward(self, index: int, turn: int, pid: int, reward: int):
-        self.buffers["rewards"][pid][index][turn][...] = reward
+        self.buffers["rewards"][index, pid, turn][...] = reward
 
     def register_done(self, battle_tag: str, pid: int):
-        index = self._get_index(battle_tag)
-        self.done_cache[pid][index] = 1
-        if sum([self.done_cache[k][index] for k in range(2)]) == 2:
-            t_valid = torch.stack([self.buffers["valid"][k][index] for k in range(2)])
-            length = t_valid.sum().item()
+        index = self.slots.find(battle_tag)
+        if self.slots.mark_done(index, pid):
+            length = self.buffers["valid"][index].sum().item()
             self.finish_queue.put((None, length))
-            self._clear_cache(battle_tag, index)
+            self.full_queue.put(index)
 
-    def _clear_cache(self, battle_tag: str, index: int):
-        self.full_queue.put(index)
-        for k in range(2):
-            self.done_cache[k][index] = 0
-        self.index_cache.pop(battle_tag)
+    def reclaim(self, owner: int) -> int:
+        """Frees the slots of battles that process `owner` left unfinished"""
+        indices = self.slots.reclaim(owner)
+        for index in indices:
+            self.free_queue.put(index)
+        return len(indices)
 
-    def _reset_index(self, index: int):
-        for pid in range(2):
-            self.buffers["valid"][pid][index][...] = 0
-            self.buffers["rewards"][pid][index][...] = 0
-            self.buffers["scalars"][pid][index][...] = 0
-            self.buffers["utc"][pid][index][...] = float("inf")
-            for valid_mask in self.valid_masks:
-                self.buffers[valid_mask][pid][index][...] = 1
-
-    def get_batch(self, batch_size: int, lock=threading.Lock()) -> TensorDict:
-        def _get_index():
-            index = self.full_queue.get()
-            return index
+    def release(self, index: int):
+        """Hands slot `index` back to the actors once it has been consumed"""
+        self.slots.release(index)
+        self.free_queue.put(index)
 
+    def _reset_index(self, index: int):
+        self.buffers["valid"][index][...] = 0
+        self.buffers["rewards"][index][...] = 0
+        self.buffers["scalars"][index][...] = 0
+        self.buffers["utc"][index][...] = float("inf")
+        for valid_mask in self.valid_masks:
+            self.buffers[valid_mask][index][...] = 1
+
+    def get_batch(
+        self, batch_size: int, lock=threading.Lock()
+    ) -> Tuple[List[int], List[int], TensorDict]:
+        """The slots of a batch, their arrival numbers and the batch"""
         with lock:
-            indices = [_get_index() for _ in range(batch_size)]
-
-        order1 = torch.stack(
-            [
-                torch.cat([self.buffers["utc"][k][index] for k in range(2)])
-                for index in indices
-            ],
-            dim=1,
-        ).argsort(0)
-        orders1 = torch.chunk(order1, batch_size, 1)
-        orders1 = [order.squeeze(-1) for order in orders1]
-
-        max_len = (
-            torch.stack(
-                [
-                    torch.cat([self.buffers["valid"][k][index] for k in range(2)])
-                    for index in indices
-                ],
-                dim=1,
-            )
-            .sum(0)
-            .max()
-            .item()
-        )
+            self._collect(batch_size)
+            indices, arrivals = self.sampler.sample(batch_size)
 
+        batch = self.assemble(indices)
+
+        for m in self.sampler.evict():
+            self.release(m)
+
+        return indices, arrivals, batch
+
+    def waiting(self) -> int:
+        """Finished trajectories that have not been sampled yet"""
+        sampler = self.sampler
+        unsampled = (sampler.added >= 0) & (sampler.uses == 0)
+        return self.full_queue.qsize() + unsampled.sum().item()
+
+    def _collect(self, batch_size: int):
+        """Hands the sampler every finished trajectory, waiting for more
+        until it holds at least `batch_size`"""
+        while True:
+            try:
+                self.sampler.put(self.full_queue.get_nowait())
+            except queue.Empty:
+                if self.sampler.ready() >= batch_size:
+                    return
+                self.sampler.put(self.full_queue.get())
+
+    def assemble(self, indices: List[int]) -> TensorDict:
+        """The trajectories in slots `indices` as a `[T, B, ...]` batch, each
+        slot's two players interleaved by `utc` and cut to the longest"""
+        batch_size = len(indices)
+        length = 2 * self.trajectory_length
+
+        # both players' trajectories back to back, `[num_buffers * 2 * T, ...]`
+        steps = {key: value.flatten(0, 2) for key, value in self.buffers.items()}
+        index = torch.tensor(indices)
+
+        # one sort order for the whole batch, in rows of the flattened slabs
+        offsets = index.unsqueeze(-1) * length + torch.arange(length)
+        order1 = steps["utc"][offsets].argsort(1)
+        max_len = steps["valid"][offsets].sum(1).max().item()
+        order1 = order1[:, :max_len].T
+        rows = (index * length + order1).flatten()
+
+        # which every key then shares, a single gather each
         batch = {
-            key: torch.stack(
-                [
-                    torch.cat([self.buffers[key][k][batch_index] for k in range(2)])[
-                        orders1[order_index]
-                    ][:max_len]
-                    for order_index, batch_index in enumerate(indices)
-                ],
-                dim=1,
-            )
-            for key in self.buffers
+            key: value.index_select(0, rows).view(max_len, batch_size, *value.shape[1:])
+            for key, value in steps.items()
             if key != "rewards"
         }
 
@@ -147,38 +175,75 @@ class ReplayBuffer:
         batch.pop("utc")
 
         rewards = torch.zeros(max_len, batch_size, 2)
-        final_reward = torch.stack(
-            [
-                torch.stack(
-                    [self.buffers["rewards"][k][index] for k in range(2)], dim=-1
-                )
-                for index in indices
-            ],
-            dim=1,
-        )
-        final_reward = final_reward.sum(0)
+        final_reward = self.buffers["rewards"].index_select(0, index)
+        final_reward = final_reward.permute(2, 0, 1).contiguous().sum(0)
         final_idx = batch["valid"].sum(0) - 1
         rewards[final_idx, torch.arange(batch_size)] = final_reward
         batch["rewards"] = rewards
 
-        player_id = torch.zeros(
-            2 * self.trajectory_length, batch_size, dtype=torch.long
-        )
-        player_id[self.trajectory_length :] = 1
-        player_id = torch.stack(
-            [
-                ids.squeeze(-1)[orders1[index]][:max_len]
-                for index, ids in enumerate(player_id.chunk(batch_size, 1))
-            ],
-            dim=1,
+        # the second player's steps are the second half of each trajectory
+        batch["player_id"] = (order1 >= self.trajectory_length).long()
+        # each player's masks, shared by the learner's targets and losses
+        batch["has_played"], batch["player_others"] = _player_masks(
+            batch["valid"], batch["player_id"]
         )
-        batch["player_id"] = player_id
 
-        for m in indices:
-            self.free_queue.put(m)
-            # if random.random() < 0.5:
-            #     self.free_queue.put(m)
-            # else:
-            #     self.full_queue.put(m)
+        return batch
+
 
-        return indices, batch
+class BatchPrefetcher:
+    """Assembles batches from `replay_buffer` in a background thread, up to
+    `depth` ahead of the learner, so the learner never waits on one that
+    could have been ready. Batches are pinned when bound for a GPU, which
+    lets their copy to the device overlap with compute."""
+
+    def __init__(
+        self,
+        replay_buffer: ReplayBuffer,
+        batch_size: int,
+        depth: int = 2,
+        pin_memory: bool = None,
+    ):
+        self.replay_buffer = replay_buffer
+        self.batch_size = batch_size
+        if pin_memory is None:
+            pin_memory = torch.device(replay_buffer.device).type == "cuda"
+        self.pin_memory = pin_memory
+        self.batches = queue.Queue(maxsize=depth)
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self) -> "BatchPrefetcher":
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="BatchPrefetcher", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        # the thread may be blocked waiting on trajectories, and as a daemon
+        # is left to be torn down with the learner
+        self._thread = None
+
+    def get(self) -> Tuple[List[int], List[int], TensorDict]:
+        batch = self.batches.get()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def _run(self):
+        thread = self._thread
+        try:
+            while self._thread is thread:
+                indices, arrivals, batch = self.replay_buffer.get_batch(self.batch_size)
+                if self.pin_memory:
+                    batch = {key: value.pin_memory() for key, value in batch.items()}
+                self.batches.put((indices, arrivals, batch))
+        except Exception as e:
+            self.batches.put(e)
@@ -41,6 +41,16 @@ class NAshKetchumConfig:
 
     # The batch size to use when learning/improving parameters.
     batch_size: int = 8
+    # The number of batches assembled ahead of the learner in a background
+    # thread. With 0, each batch is assembled when the learner asks for it.
+    prefetch_batches: int = 2
+    # How batches are drawn from finished trajectories: "fifo" uses each
+    # once, "uniform" and "prioritized" (by value error) reuse them until
+    # `sampler_max_age` batches have been drawn since they finished.
+    sampler: str = "fifo"
+    sampler_max_age: int = 4
+    # The exponent applied to value errors by the "prioritized" sampler.
+    priority_alpha: float = 0.6
     # The learning rate for `params`.
     learning_rate: float = 5e-5
     # The config related to the ADAM optimizer used for updating `params`.
@@ -49,6 +59,10 @@ class NAshKetchumConfig:
     clip_gradient: float = 10_000
     # The "speed" at which `params_target` is following `params`.
     target_network_avg: float = 1e-3
+    # The learner publishes its weights to the actors every `publish_steps`
+    # steps, or sooner once `publish_seconds` have passed since the last.
+    publish_steps: int = 1
+    publish_seconds: float = None
 
     # RNaD algorithm configuration.
     # Entropy schedule configuration. See EntropySchedule class documentation.
@@ -101,6 +115,10 @@ class NAshKetchumConfig:
     # for a total of 40 players, playing 20 games.
     # it is recommended to have an even number of players per worker
     num_actors: int = 1 if debug_mode else 12
+    # the supervisor adds or retires workers within these bounds to keep
+    # `batch_size` trajectories ready for the learner
+    min_actors: int = num_actors
+    max_actors: int = num_actors if debug_mode else 2 * num_actors
     num_buffers: int = 64
 
     model_config: config.NAshKetchumModelConfig = config.NAshKetchumModelConfig()
@@ -1,7 +1,6 @@
 import os
 import wandb
 import traceback
-import threading
 
 import torch
 import torch.optim as optim
@@ -9,18 +8,19 @@ import torch.nn.functional as F
 
 from typing import List, Dict, Tuple
 
+from meloetta.actors.parameters import ParameterServer
 from meloetta.actors.types import TensorDict
-from meloetta.frameworks.nash_ketchum.buffer import ReplayBuffer
+from meloetta.frameworks.nash_ketchum.buffer import BatchPrefetcher, ReplayBuffer
 from meloetta.frameworks.nash_ketchum.config import NAshKetchumConfig
 from meloetta.frameworks.nash_ketchum.entropy import EntropySchedule
 from meloetta.frameworks.nash_ketchum.modelv2 import NAshKetchumModel
+from meloetta.frameworks.nash_ketchum.sampler import SAMPLERS
 from meloetta.frameworks.nash_ketchum.utils import (
     FineTuning,
-    _player_others,
+    _gather_fields,
     _get_leading_dims,
     v_trace,
-    get_loss_nerd,
-    get_loss_v,
+    get_loss_nerd_v,
 )
 
 _FIELDS = ["action_type", "flag", "move", "switch"]
@@ -85,8 +85,6 @@ class NAshKetchumLearner:
             model.load_state_dict(self.learner_model.state_dict())
             model.requires_grad_(False)
 
-        self.actor_model.share_memory()
-
         if load_devices:
             self._to_devices()
 
@@ -94,6 +92,7 @@ class NAshKetchumLearner:
             self._init_optimizers()
 
         self.replay_buffer = replay_buffer if replay_buffer else self._init_buffer()
+        self.prefetcher: BatchPrefetcher = None
 
         self._entropy_schedule = EntropySchedule(
             sizes=self.config.entropy_schedule_size,
@@ -103,6 +102,13 @@ class NAshKetchumLearner:
         self.learner_steps = 0
         self.finetune = FineTuning()
 
+        # actor processes each keep a copy of `actor_model` and load the
+        # weights published here between forwards
+        self.params = ParameterServer(
+            self.actor_model, self.config.publish_steps, self.config.publish_seconds
+        )
+        self.params.publish(self.actor_model, self.learner_steps)
+
         print(f"learnabled params: {self.learner_model.get_learnable_params():,}")
 
     def get_config(self):
@@ -140,12 +146,21 @@ class NAshKetchumLearner:
         return model
 
     def _init_buffer(self):
+        sampler_kwargs = {}
+        if self.config.sampler != "fifo":
+            sampler_kwargs["max_age"] = self.config.sampler_max_age
+        if self.config.sampler == "prioritized":
+            sampler_kwargs["alpha"] = self.config.priority_alpha
+        sampler = SAMPLERS[self.config.sampler](
+            self.config.num_buffers, **sampler_kwargs
+        )
         return ReplayBuffer(
             self.config.trajectory_length,
             self.config.gen,
             self.config.gametype,
             self.config.num_buffers,
             self.config.learner_device,
+            sampler,
         )
 
     def _init_optimizers(self):
@@ -253,18 +268,31 @@ class NAshKetchumLearner:
         else:
             print("Learner steps not loaded")
 
+        learner.params.publish(learner.actor_model, learner.learner_steps)
+
         return learner
 
-    def collect_batch_trajectory(self) -> Tuple[List[int], TensorDict]:
-        return self.replay_buffer.get_batch(self.config.batch_size)
+    def collect_batch_trajectory(self) -> Tuple[List[int], List[int], TensorDict]:
+        if self.config.prefetch_batches <= 0:
+            return self.replay_buffer.get_batch(self.config.batch_size)
+        if self.prefetcher is None:
+            self.prefetcher = BatchPrefetcher(
+                self.replay_buffer,
+                self.config.batch_size,
+                self.config.prefetch_batches,
+            ).start()
+        return self.prefetcher.get()
 
-    def step(self, lock: threading.Lock = threading.Lock()):
-        _, batch = self.collect_batch_trajectory()
+    def step(self):
+        indices, arrivals, batch = self.collect_batch_trajectory()
         alpha, update_target_net = self._entropy_schedule(self.learner_steps)
 
         self.optimizer.zero_grad()
 
         targets = self._get_targets(batch, alpha)
+        self.replay_buffer.sampler.update(
+            indices, targets.pop("value_errors"), arrivals
+        )
         loss_dict = self._update_params(batch, targets)
 
         loss_dict["s"] = self.learner_steps
@@ -282,6 +310,12 @@ class NAshKetchumLearner:
             batch["action_type_policy"][..., 1].sum() / switch_available.sum()
         ).item()
 
+        # how many updates behind the learner the actors' policies were
+        policy_version = batch["policy_version"][batch["valid"]]
+        loss_dict["policy_lag"] = (
+            (self.learner_steps - policy_version).float().mean()
+        ).item()
+
         for k, v in loss_dict.items():
             if isinstance(v, list):
                 loss_dict[k] = sum(v)
@@ -304,11 +338,11 @@ class NAshKetchumLearner:
         if self.learner_steps % 1000 == 0:
             self.save()
 
-        with lock:
-            self.actor_model.load_state_dict(self.learner_model.state_dict())
-
         self.learner_steps += 1
 
+        if self.params.step(self.learner_model, self.learner_steps):
+            self.params.sync(self.actor_model)
+
     @torch.no_grad()
     def _learning_forward(
         self, batch: TensorDict, size: int = 1024
@@ -321,14 +355,20 @@ class NAshKetchumLearner:
                 k: v.to(self.replay_buffer.device, non_blocking=True)
                 for k, v in batch.items()
             }
+            # the input-only encodings are the same for all four models
+            features = self.learner_model.preprocess(batch)
             learner_model_output = self.learner_model.forward(
-                batch, compute_value=False
+                batch, compute_value=False, features=features
             )
             target_model_output = self.target_model.forward(
-                batch, compute_log_policy=False
+                batch, compute_log_policy=False, features=features
+            )
+            model_prev_output = self.model_prev.forward(
+                batch, compute_value=False, features=features
+            )
+            model_prev_output_ = self.model_prev_.forward(
+                batch, compute_value=False, features=features
             )
-            model_prev_output = self.model_prev.forward(batch, compute_value=False)
-            model_prev_output_ = self.model_prev_.forward(batch, compute_value=False)
             return [
                 {k: v.cpu() for k, v in model_output.items() if v is not None}
                 for model_output in [
@@ -355,10 +395,21 @@ class NAshKetchumLearner:
                 k: v[start:end].to(self.replay_buffer.device, non_blocking=True)
                 for k, v in flat_batch.items()
             }
-            learner_model_output = self.learner_model(minibatch, compute_value=False)
-            target_model_output = self.target_model(minibatch, compute_log_policy=False)
-            model_prev_output = self.model_prev(minibatch, compute_value=False)
-            model_prev_output_ = self.model_prev_(minibatch, compute_value=False)
+            features = self.learner_model.preprocess(minibatch)
+            learner_model_output = self.learner_model(
+                minibatch, compute_value=False, features=features
+            )
+            target_model_output = self.target_model(
+                minibatch, compute_log_policy=False, features=features
+            )
+            model_prev_output = self.model_prev(
+                minibatch, compute_value=False, features=features
+            )
+            model_prev_output_ = self.model_prev_(
+                minibatch, compute_value=False, features=features
+            )
+            # large, so freed before the next chunk's are computed
+            del features
 
             for midx, model_output in enumerate(
                 [
@@ -442,7 +493,7 @@ class NAshKetchumLearner:
                 acting_policies,
                 policies_pprocessed,
                 log_policies_reg,
-                _player_others(batch["player_id"], batch["valid"], player),
+                batch["player_others"][..., player, None],
                 action_ohs,
                 reward,
                 player,
@@ -451,6 +502,7 @@ class NAshKetchumLearner:
                 rho=self.config.rho_vtrace,
                 eta=self.config.eta_reward_transform,
                 gamma=self.config.gamma,
+                has_played=batch["has_played"][..., player],
             )
             v_target_list.append(v_target_)
             has_played_list.append(has_played)
@@ -460,6 +512,17 @@ class NAshKetchumLearner:
         targets_dict["value_targets"] = v_target_list
         targets_dict["has_played"] = has_played_list
 
+        # each trajectory's mean value error, which prioritized sampling uses
+        value = sum(
+            v * (batch["policy_select"] == f).unsqueeze(-1)
+            for f, v in enumerate(values)
+        )
+        errors, counts = 0, 0
+        for v_target, has_played in zip(v_target_list, has_played_list):
+            errors += ((v_target - value).abs().squeeze(-1) * has_played).sum(0)
+            counts += has_played.sum(0)
+        targets_dict["value_errors"] = errors / counts.clamp(min=1)
+
         for f, field in enumerate(_FIELDS):
             for k in range(2):
                 if k == 0:
@@ -479,111 +542,103 @@ class NAshKetchumLearner:
         self,
         batch: TensorDict,
         targets: Dict[str, List[torch.Tensor]],
-    ) -> Dict[str, float]:
+    ) -> Dict[str, List[float]]:
         minibatch_size = 1024
-        T, B = _get_leading_dims(batch)
-
-        n_iters = ((T * B) // minibatch_size) + 1
-
-        batch = {k: v.flatten(0, 1).unsqueeze(1) for k, v in batch.items()}
-        targets = {
-            k: [v.flatten(0, 1).unsqueeze(1) for v in vt] for k, vt in targets.items()
-        }
-
-        valid_sum = {}
-        loss_dict = {}
-
-        for policy_select, field in enumerate(_FIELDS):
-            for k in range(2):
-                policy_valid_sum_field = f"{field}_policy_valid_sum"
-                value_valid_sum_field = f"{field}_value_valid_sum"
-
-                for valid_sum_field in [policy_valid_sum_field, value_valid_sum_field]:
-                    if valid_sum_field not in valid_sum:
-                        valid_sum[valid_sum_field] = []
+        device = self.replay_buffer.device
 
-                mask = batch["policy_select"] == policy_select
+        batch = {k: v.flatten(0, 1) for k, v in batch.items()}
+        targets = {k: [v.flatten(0, 1) for v in vt] for k, vt in targets.items()}
 
-                policy_mask = batch["valid"] & mask & (batch["player_id"] == k)
-                valid_sum[policy_valid_sum_field].append(policy_mask.sum().item())
+        # a row only trains the heads of the field it acted on, towards the
+        # targets of the player who acted, so those are picked out once here
+        # and every field's losses are then computed together
+        field = batch["policy_select"].clamp(0, len(_FIELDS) - 1)
+        player = batch["player_id"]
 
-                value_mask = targets["has_played"][k] & mask
-                valid_sum[value_valid_sum_field].append(value_mask.sum().item())
-
-            loss_dict[f"{field}_value_loss"] = [0, 0]
-            loss_dict[f"{field}_policy_loss"] = [0, 0]
+        def _pick(key: str) -> torch.Tensor:
+            return _gather_fields(
+                [_gather_fields(targets[f"{f}_{key}"], player) for f in _FIELDS],
+                field,
+            )
 
-        for i in range(n_iters):
-            start_idx, end_idx = i * minibatch_size, (i + 1) * minibatch_size
+        # each field and player's losses are averaged over their turns
+        has_played = batch["has_played"].gather(-1, player.unsqueeze(-1)).squeeze(-1)
+        bucket = 2 * field + player
+        counts = torch.bincount(bucket[has_played], minlength=2 * len(_FIELDS))
+        num_actions = torch.tensor([batch[f"{f}_mask"].shape[-1] for f in _FIELDS])
+
+        rows = {
+            "field": field,
+            "bucket": bucket,
+            "weight": has_played / counts[bucket].clamp(min=1),
+            "q_vr": _pick("policy_target"),
+            "is": _pick("is"),
+            "value_target": _gather_fields(targets["value_targets"], player),
+            "legal_actions": _gather_fields(
+                [batch[f"{f}_mask"] for f in _FIELDS], field, value=False
+            ),
+            "num_actions": num_actions[field].unsqueeze(-1),
+        }
 
-            if not batch["valid"][start_idx:end_idx].sum().item():
-                continue
+        # decided on the host, before anything is on the device
+        starts = [
+            start
+            for start in range(0, field.shape[0], minibatch_size)
+            if batch["valid"][start : start + minibatch_size].any()
+        ]
 
-            minibatch = {
-                k: v[start_idx:end_idx].to(self.replay_buffer.device)
-                for k, v in batch.items()
-            }
-            minitargets = {
-                k: [v[start_idx:end_idx].to(self.replay_buffer.device) for v in vt]
-                for k, vt in targets.items()
-            }
+        batch = {
+            k: v.unsqueeze(1).to(device, non_blocking=True) for k, v in batch.items()
+        }
+        rows = {k: v.to(device, non_blocking=True) for k, v in rows.items()}
+
+        # the weighted policy and value loss of each field and player
+        losses = torch.zeros(2 * len(_FIELDS), 2, device=device)
+        for start in starts:
+            end = start + minibatch_size
+            self._step(
+                {k: v[start:end] for k, v in batch.items()},
+                {k: v[start:end] for k, v in rows.items()},
+                losses,
+            )
 
-            loss_dict = self._step(minibatch, minitargets, loss_dict, valid_sum)
+        losses = losses.view(len(_FIELDS), 2, 2).tolist()
+        loss_dict = {}
+        for f, field in enumerate(_FIELDS):
+            loss_dict[f"{field}_value_loss"] = [losses[f][k][1] for k in range(2)]
+            loss_dict[f"{field}_policy_loss"] = [losses[f][k][0] for k in range(2)]
 
         return loss_dict
 
     def _step(
         self,
         batch: TensorDict,
-        targets: Dict[str, List[torch.Tensor]],
-        loss_dict: Dict[str, float],
-        valid_sum: Dict[str, int],
+        rows: TensorDict,
+        losses: torch.Tensor,
     ):
         with torch.autocast(device_type="cuda", dtype=torch.float16):
             model_output = self.learner_model(batch, compute_log_policy=False)
 
-        loss = 0
-        T, _ = _get_leading_dims(batch)
-
-        for policy_select, field in enumerate(_FIELDS):
-            policy_valid = batch["valid"].view(T)
-
-            trajectory_mask = batch["policy_select"] == policy_select
-            policy_valid = (policy_valid & trajectory_mask.squeeze(-1)).unsqueeze(-1)
-
-            policy_loss_field = f"{field}_policy_loss"
-            value_loss_field = f"{field}_value_loss"
-
-            policy_field_valid_sum = valid_sum[f"{field}_policy_valid_sum"]
-            value_field_valid_sum = valid_sum[f"{field}_value_valid_sum"]
-
-            pg_losses = get_loss_nerd(
-                [model_output[f"{field}_logits"]] * 2,
-                [model_output[f"{field}_policy"]] * 2,
-                targets[f"{field}_policy_target"],
-                policy_valid,
-                batch["player_id"],
-                policy_field_valid_sum,
-                batch[f"{field}_mask"],
-                targets[f"{field}_is"],
-            )
-
-            value_losses = get_loss_v(
-                [model_output[f"{field}_value"]] * 2,
-                targets["value_targets"],
-                [has_played & trajectory_mask for has_played in targets["has_played"]],
-                value_field_valid_sum,
+        def _heads(key: str) -> torch.Tensor:
+            return _gather_fields(
+                [model_output[f"{f}_{key}"].squeeze(1) for f in _FIELDS], rows["field"]
             )
 
-            for k, (pg_loss, value_loss) in enumerate(zip(pg_losses, value_losses)):
-                loss += pg_loss
-                loss += value_loss
-                loss_dict[policy_loss_field][k] += pg_loss.item()
-                loss_dict[value_loss_field][k] += value_loss.item()
-
-        loss.backward()
+        pg_loss, value_loss = get_loss_nerd_v(
+            _heads("logits"),
+            _heads("policy"),
+            _heads("value"),
+            rows["q_vr"],
+            rows["is"],
+            rows["value_target"],
+            rows["legal_actions"],
+            rows["num_actions"],
+        )
+        loss = torch.stack((pg_loss, value_loss), dim=-1)
+        loss = loss * rows["weight"].unsqueeze(-1)
+        loss.sum().backward()
 
-        return loss_dict
+        losses.index_add_(0, rows["bucket"], loss.detach().float())
 
     def run(self):
         while True:
@@ -25,7 +25,11 @@ class Encoder(nn.Module):
         #     gen=gen, n_active=n_active, config=config.side_encoder_config
         # )
 
-    def forward(self, state: State) -> TensorDict:
+    def preprocess(self, state: State) -> TensorDict:
+        """The side encoder's input-only encodings of `state`"""
+        return self.side_encoder.preprocess(state["sides"])
+
+    def forward(self, state: State, features: TensorDict = None) -> TensorDict:
         sides = state["sides"]
         boosts = state["boosts"]
         volatiles = state["volatiles"]
@@ -49,7 +53,7 @@ class Encoder(nn.Module):
         max_move_mask = state.get("max_move_mask")
         target_mask = state.get("target_mask")
 
-        side_embeddings = self.side_encoder.forward(side=sides)
+        side_embeddings = self.side_encoder.forward(side=sides, features=features)
 
         scalar_embeddings = self.scalar_encoder.forward(
             turn=turn,
@@ -177,16 +177,9 @@ class PokemonEmbedding(nn.Module):
     def embed_item(
         self,
         item_token: torch.Tensor,
-        item_effect_token: torch.Tensor,
+        item_concat: torch.Tensor,
         species_embedding: torch.Tensor,
     ) -> torch.Tensor:
-        item_concat = torch.cat(
-            (
-                self.item_onehot(item_token),
-                self.item_effect_onehot(item_effect_token),
-            ),
-            dim=-1,
-        )
         known_item_embedding = self.item_embedding_known(item_concat)
         unknown_item_embedding = self.item_embedding_unknown(species_embedding)
         known_mask = (item_token > 0).unsqueeze(-1)
@@ -195,21 +188,14 @@ class PokemonEmbedding(nn.Module):
     def embed_moveset(
         self,
         move_tokens: torch.Tensor,
-        pp_token: torch.Tensor,
+        move_concat: torch.Tensor,
+        moveset_onehot: torch.Tensor,
         species_embedding: torch.Tensor,
     ) -> torch.Tensor:
-        move_concat = torch.cat(
-            (
-                self.move_raw_onehot(move_tokens),
-                self.pp_bin_enc(pp_token),
-            ),
-            dim=-1,
-        )
         known_mask = (move_tokens > 0).unsqueeze(-1)
 
         known_move_embedding = self.move_embedding(move_concat)
 
-        moveset_onehot = self.move_raw_onehot(move_tokens).sum(-2)
         moveset_onehot = self.moveset_onehot(moveset_onehot)
         unknown_move_embedding = self.unknown_move_embedding(
             moveset_onehot + species_embedding
@@ -221,9 +207,10 @@ class PokemonEmbedding(nn.Module):
 
         return moveset_embedding.sum(-2), known_move_embedding
 
-    def forward(
-        self, x: torch.Tensor
-    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor,]:
+    def preprocess(self, x: torch.Tensor) -> TensorDict:
+        """The tokens and fixed one-hot and binary encodings `forward` derives
+        from `x`. None of them depend on a learnt parameter, so models that
+        see the same inputs can share them."""
         longs = (x + 1).long().clamp(min=0)
 
         species_token = (x[..., 0] + 2).long()
@@ -258,8 +245,6 @@ class PokemonEmbedding(nn.Module):
 
         side = (longs[..., 37] - 1).clamp(min=0, max=1)
 
-        species_embedding = self.embed_species(species_token)
-
         hp_embedding = self.hp_onehot((hp_ratio * 10).clamp(min=0, max=10).long())
         stat_enc = hp_embedding
 
@@ -271,29 +256,24 @@ class PokemonEmbedding(nn.Module):
         #     # )
         # )
 
-        ability_embedding = self.embed_ability(ability_token, species_embedding)
-        # base_ability_emb = self.ability_embedding(base_ability)
-
-        item_embedding = self.embed_item(
-            item_token, item_effect_token, species_embedding
+        item_concat = torch.cat(
+            (
+                self.item_onehot(item_token),
+                self.item_effect_onehot(item_effect_token),
+            ),
+            dim=-1,
         )
-        # prev_item_emb = self.embed_item(prev_item, prev_item_effect)
 
         status_onehot = self.status_onehot(status_token)
         sleep_turns_onehot = self.sleep_turns_onehot(sleep_turns)
         toxic_turns_onehot = self.toxic_turns_onehot(toxic_turns)
 
-        moveset_embedding, move_embeddings = self.embed_moveset(
-            move_tokens, pp_tokens, species_embedding
+        move_raw_onehot = self.move_raw_onehot(move_tokens)
+        move_concat = torch.cat(
+            (move_raw_onehot, self.pp_bin_enc(pp_tokens)),
+            dim=-1,
         )
 
-        # last_move_emb = self.last_move_embedding(
-        #     torch.cat(
-        #         (self.move_embedding_ae(last_move), self.pp_bin_enc(last_move_pp)),
-        #         dim=-1,
-        #     )
-        # )
-
         forme_enc = self.forme_embedding(forme_token)
         active_enc = self.active_onehot(active_token)
         fainted_enc = self.fainted_onehot(fainted_token)
@@ -302,7 +282,6 @@ class PokemonEmbedding(nn.Module):
         status_enc = torch.cat(
             (status_onehot, sleep_turns_onehot, toxic_turns_onehot), dim=-1
         )
-        side_embedding = self.side_embedding(side)
 
         onehots = [
             forme_enc,
@@ -314,6 +293,59 @@ class PokemonEmbedding(nn.Module):
             status_enc,
         ]
 
+        features = OrderedDict(
+            species_token=species_token,
+            ability_token=ability_token,
+            item_token=item_token,
+            item_concat=item_concat,
+            move_tokens=move_tokens,
+            move_concat=move_concat,
+            moveset_onehot=move_raw_onehot.sum(-2),
+            side=side,
+        )
+
+        if self.gen == 9:
+            features["teratype"] = teratype
+            onehots += [self.tera_onehot((terastallized > 0).long())]
+
+        features["onehots"] = torch.cat(onehots, dim=-1)
+        return features
+
+    def forward(
+        self, x: torch.Tensor, features: TensorDict = None
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor,]:
+        if features is None:
+            features = self.preprocess(x)
+
+        species_token = features["species_token"]
+        species_embedding = self.embed_species(species_token)
+
+        ability_embedding = self.embed_ability(
+            features["ability_token"], species_embedding
+        )
+        # base_ability_emb = self.ability_embedding(base_ability)
+
+        item_embedding = self.embed_item(
+            features["item_token"], features["item_concat"], species_embedding
+        )
+        # prev_item_emb = self.embed_item(prev_item, prev_item_effect)
+
+        moveset_embedding, move_embeddings = self.embed_moveset(
+            features["move_tokens"],
+            features["move_concat"],
+            features["moveset_onehot"],
+            species_embedding,
+        )
+
+        # last_move_emb = self.last_move_embedding(
+        #     torch.cat(
+        #         (self.move_embedding_ae(last_move), self.pp_bin_enc(last_move_pp)),
+        #         dim=-1,
+        #     )
+        # )
+
+        side_embedding = self.side_embedding(features["side"])
+
         embeddings = [
             species_embedding,
             ability_embedding,
@@ -327,11 +359,9 @@ class PokemonEmbedding(nn.Module):
         ]
 
         if self.gen == 9:
-            embeddings += [self.teratype_onehot(teratype)]
-            onehots += [self.tera_onehot((terastallized > 0).long())]
+            embeddings += [self.teratype_onehot(features["teratype"])]
 
-        onehots = torch.cat(onehots, dim=-1)
-        onehots_embedding = self.onehots_lin(onehots)
+        onehots_embedding = self.onehots_lin(features["onehots"])
         embeddings += [onehots_embedding]
 
         pokemon_emb = sum(embeddings)
@@ -366,12 +396,15 @@ class SideEncoder(nn.Module):
             ]
         )
 
-    def forward(self, side: torch.Tensor) -> TensorDict:
+    def preprocess(self, side: torch.Tensor) -> TensorDict:
+        return self.embedding.preprocess(side)
+
+    def forward(self, side: torch.Tensor, features: TensorDict = None) -> TensorDict:
         (
             pokemon_embeddings,
             pokemon_mask,
             move_embeddings,
-        ) = self.embedding.forward(side)
+        ) = self.embedding.forward(side, features)
 
         T, B, N, S, *_ = pokemon_embeddings.shape
         active_pokemon_embedding = pokemon_embeddings[:, :, 0, 0]
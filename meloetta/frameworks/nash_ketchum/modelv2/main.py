@@ -75,10 +75,20 @@ class NAshKetchumModel(nn.Module):
     def clean(self, state: State) -> State:
         return {k: state[k] for k in self._STATE_FIELDS}
 
+    def preprocess(self, state: State) -> TensorDict:
+        """The input-only encodings of `state`, which every model of the same
+        gen and gametype would compute identically. Passing them to `forward`
+        lets several models share them."""
+        return self.encoder.preprocess(state)
+
     def forward(
-        self, state: State, compute_value: bool = True, compute_log_policy: bool = True
+        self,
+        state: State,
+        compute_value: bool = True,
+        compute_log_policy: bool = True,
+        features: TensorDict = None,
     ) -> TensorDict:
-        encoder_output = self.encoder.forward(state)
+        encoder_output = self.encoder.forward(state, features)
         state_emb = self.core.forward(encoder_output)
         action_policy_logits = self.policy_heads.forward(
             state_emb, encoder_output, state
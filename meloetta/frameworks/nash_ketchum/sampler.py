@@ -0,0 +1,229 @@
+import torch
+import multiprocessing as mp
+
+from typing import List, Sequence, Tuple
+
+
+class SumTree:
+    """Non-negative priorities of `capacity` slots, summed pairwise up a
+    binary tree in shared memory, so a slot can be drawn with probability
+    proportional to its priority in `O(log capacity)`."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 1 << max(capacity - 1, 1).bit_length()
+        # node `n` has children `2n` and `2n + 1`, leaves start at `size`
+        self.tree = torch.zeros(2 * self.size, dtype=torch.float64).share_memory_()
+        self.lock = mp.Lock()
+
+    def total(self) -> float:
+        return self.tree[1].item()
+
+    def get(self, indices: Sequence[int]) -> torch.Tensor:
+        return self.tree[self.size + torch.as_tensor(indices)]
+
+    def update(self, indices: Sequence[int], priorities: Sequence[float]):
+        nodes = self.size + torch.as_tensor(indices, dtype=torch.long)
+        priorities = torch.as_tensor(priorities, dtype=torch.float64)
+        if not len(nodes):
+            return
+        with self.lock:
+            self.tree[nodes] = priorities
+            while nodes[0] > 1:
+                nodes = (nodes // 2).unique()
+                self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values: torch.Tensor) -> torch.Tensor:
+        """The slots whose share of the cumulative priority holds `values`"""
+        nodes = torch.ones(len(values), dtype=torch.long)
+        values = values.clone()
+        while nodes[0] < self.size:
+            left = self.tree[2 * nodes]
+            right = values >= left
+            values -= left * right
+            nodes = 2 * nodes + right
+        return nodes - self.size
+
+    def sample(self, n: int, generator: torch.Generator = None) -> torch.Tensor:
+        """`n` slots drawn in proportion to their priority, one from each of
+        `n` equal strata of the total so a batch is spread over the slots"""
+        with self.lock:
+            total = self.tree[1].item()
+            offsets = torch.rand(n, generator=generator, dtype=torch.float64)
+            values = (torch.arange(n, dtype=torch.float64) + offsets) * (total / n)
+            indices = self.find(values.clamp(max=total * (1 - 1e-12)))
+        return indices
+
+
+class Sampler:
+    """Chooses which of the full slots make up each batch, and when a slot
+    is done with and can be handed back to the actors.
+
+    Slots arrive with `put` once both players are done, `sample` picks a
+    batch among those held and `evict` is called once it is assembled.
+    `sample` also returns the arrival number of each slot it picked, which
+    `update` uses to tell a slot's trajectory from a later one in it.
+    Everything is kept in shared memory, so any process can feed or read it.
+    """
+
+    def __init__(self, num_buffers: int):
+        self.num_buffers = num_buffers
+        # the batch number a held slot arrived at, -1 for slots not held
+        self.added = torch.full((num_buffers,), -1, dtype=torch.long)
+        self.added.share_memory_()
+        self.arrival = torch.zeros(num_buffers, dtype=torch.long).share_memory_()
+        self.uses = torch.zeros(num_buffers, dtype=torch.long).share_memory_()
+        # slots put so far, batches sampled so far
+        self.clock = torch.zeros(2, dtype=torch.long).share_memory_()
+        self.lock = mp.RLock()
+
+    def ready(self) -> int:
+        return (self.added >= 0).sum().item()
+
+    def held(self) -> torch.Tensor:
+        return (self.added >= 0).nonzero().flatten()
+
+    def put(self, index: int):
+        with self.lock:
+            self.arrival[index] = self.clock[0]
+            self.added[index] = self.clock[1]
+            self.uses[index] = 0
+            self.clock[0] += 1
+
+    def sample(self, batch_size: int) -> Tuple[List[int], List[int]]:
+        with self.lock:
+            indices = self._sample(batch_size)
+            arrivals = self.arrival[indices]
+            self.uses[indices] += 1
+            self.clock[1] += 1
+        return indices.tolist(), arrivals.tolist()
+
+    def evict(self) -> List[int]:
+        with self.lock:
+            held = self.held()
+            indices = held[self._expired(held)]
+            self.added[indices] = -1
+        return indices.tolist()
+
+    def update(
+        self,
+        indices: Sequence[int],
+        errors: Sequence[float],
+        arrivals: Sequence[int],
+    ):
+        """The learner's errors on the trajectories in `indices`, sampled
+        when they held the trajectories that arrived as `arrivals`"""
+
+    def _sample(self, batch_size: int) -> torch.Tensor:
+        raise NotImplementedError
+
+    def _expired(self, held: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+
+class FIFOSampler(Sampler):
+    """Every trajectory once, in the order they finished"""
+
+    def ready(self) -> int:
+        return ((self.added >= 0) & (self.uses == 0)).sum().item()
+
+    def _sample(self, batch_size: int) -> torch.Tensor:
+        held = self.held()
+        held = held[self.uses[held] == 0]
+        return held[self.arrival[held].argsort()[:batch_size]]
+
+    def _expired(self, held: torch.Tensor) -> torch.Tensor:
+        return self.uses[held] > 0
+
+
+class UniformSampler(Sampler):
+    """Samples held trajectories uniformly, with replacement, and frees them
+    once `max_age` batches have been sampled since they arrived. The learner
+    can then take several steps per finished game."""
+
+    def __init__(self, num_buffers: int, max_age: int = 4):
+        super().__init__(num_buffers)
+        self.max_age = max_age
+        self.priorities = SumTree(num_buffers)
+
+    def _priority(self, index: int) -> float:
+        return 1.0
+
+    def put(self, index: int):
+        with self.lock:
+            super().put(index)
+            self.priorities.update([index], [self._priority(index)])
+
+    def evict(self) -> List[int]:
+        with self.lock:
+            indices = super().evict()
+            if indices:
+                self.priorities.update(indices, [0.0] * len(indices))
+        return indices
+
+    def _sample(self, batch_size: int) -> torch.Tensor:
+        indices = self.priorities.sample(batch_size)
+        # rounding in the sums can, rarely, lead down to an empty leaf
+        empty = self.added[indices] < 0
+        if empty.any():
+            held = self.held()
+            indices[empty] = held[torch.randint(len(held), (empty.sum(),))]
+        return indices
+
+    def _expired(self, held: torch.Tensor) -> torch.Tensor:
+        return self.clock[1] - self.added[held] >= self.max_age
+
+
+class PrioritizedSampler(UniformSampler):
+    """Samples held trajectories in proportion to `(error + eps) ** alpha`,
+    the learner's last value error on them. New ones get the highest
+    priority seen so far, so every trajectory is learnt from at least once
+    before its error is known."""
+
+    def __init__(
+        self,
+        num_buffers: int,
+        max_age: int = 4,
+        alpha: float = 0.6,
+        eps: float = 1e-3,
+    ):
+        super().__init__(num_buffers, max_age)
+        self.alpha = alpha
+        self.eps = eps
+        self.max_priority = torch.ones(1, dtype=torch.float64).share_memory_()
+
+    def _priority(self, index: int) -> float:
+        return self.max_priority.item()
+
+    def update(
+        self,
+        indices: Sequence[int],
+        errors: Sequence[float],
+        arrivals: Sequence[int],
+    ):
+        errors = torch.as_tensor(errors, dtype=torch.float64)
+        priorities = (errors.abs() + self.eps) ** self.alpha
+        with self.lock:
+            # slots evicted since they were sampled stay at 0, slots refilled
+            # since keep the priority of their new trajectory, and a nan
+            # would poison every sum above it, so those keep their priority
+            indices = torch.as_tensor(indices, dtype=torch.long)
+            arrivals = torch.as_tensor(arrivals, dtype=torch.long)
+            held = (
+                (self.added[indices] >= 0)
+                & (self.arrival[indices] == arrivals)
+                & priorities.isfinite()
+            )
+            if not held.any():
+                return
+            self.priorities.update(indices[held], priorities[held])
+            self.max_priority[0] = max(
+                self.max_priority.item(), priorities[held].max().item()
+            )
+
+
+SAMPLERS = {
+    "fifo": FIFOSampler,
+    "uniform": UniformSampler,
+    "prioritized": PrioritizedSampler,
+}
@@ -0,0 +1,111 @@
+import torch
+import hashlib
+import numpy as np
+import multiprocessing as mp
+
+from typing import List
+
+FREE = 0
+CLAIMED = 1
+FULL = 2
+
+
+def tag_hash(battle_tag: str) -> int:
+    """A hash of `battle_tag` that is the same in every process, unlike `hash`"""
+    digest = hashlib.blake2b(battle_tag.encode(), digest_size=8).digest()
+    # non-zero and positive, so it fits an int64 and never matches a free slot
+    return int.from_bytes(digest, "little") >> 1 | 1
+
+
+class SlotTable:
+    """Which battle owns each replay buffer slot, in shared memory.
+
+    Slot `i` is FREE, CLAIMED by the battle whose tag hashes to `tags[i]`,
+    or FULL once every player has registered done. Lookups read the shared
+    tensors directly, so finding a battle's slot costs no round trip to
+    another process. The transitions that have to happen once, claiming a
+    tag and completing a slot, are serialized by a shared lock, and which
+    free slot a claim takes is decided by the buffer's `free_queue`.
+    """
+
+    def __init__(self, num_slots: int, num_players: int = 2):
+        self.num_slots = num_slots
+        self.num_players = num_players
+        self.state = torch.zeros(num_slots, dtype=torch.uint8).share_memory_()
+        self.tags = torch.zeros(num_slots, dtype=torch.long).share_memory_()
+        self.owners = torch.zeros(num_slots, dtype=torch.long).share_memory_()
+        self.done = torch.zeros(num_slots, num_players, dtype=torch.bool)
+        self.done.share_memory_()
+        self.lock = mp.Lock()
+        self._views()
+
+    def _views(self):
+        # numpy views of the same memory, far cheaper to index one slot at a time
+        self._state = self.state.numpy()
+        self._tags = self.tags.numpy()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_state"], state["_tags"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views()
+
+    def __len__(self):
+        return int((self._state == CLAIMED).sum())
+
+    def __contains__(self, battle_tag: str):
+        return self.find(battle_tag) is not None
+
+    def _find(self, tag: int) -> int:
+        matches = np.flatnonzero((self._tags == tag) & (self._state == CLAIMED))
+        if len(matches):
+            return int(matches[0])
+        return None
+
+    def find(self, battle_tag: str) -> int:
+        """The slot `battle_tag` has claimed, or None"""
+        return self._find(tag_hash(battle_tag))
+
+    def claim(self, battle_tag: str, index: int, owner: int) -> int:
+        """Claims free slot `index` for `battle_tag` on behalf of process
+        `owner`, unless the battle already has one. Returns the battle's slot,
+        and if that is not `index` the caller still holds `index`."""
+        tag = tag_hash(battle_tag)
+        with self.lock:
+            claimed = self._find(tag)
+            if claimed is not None:
+                return claimed
+            self.done[index] = False
+            self.owners[index] = owner
+            self._tags[index] = tag
+            # published last, so lookups never see a slot half claimed
+            self._state[index] = CLAIMED
+        return index
+
+    def mark_done(self, index: int, pid: int) -> bool:
+        """Registers player `pid` done with slot `index`, returning True for
+        exactly one caller, the one that completes the slot"""
+        with self.lock:
+            self.done[index, pid] = True
+            if self._state[index] == CLAIMED and self.done[index].all():
+                self._state[index] = FULL
+                self._tags[index] = 0
+                return True
+        return False
+
+    def release(self, index: int):
+        """Frees slot `index` once its trajectory has been consumed"""
+        self._state[index] = FREE
+        self._tags[index] = 0
+
+    def reclaim(self, owner: int) -> List[int]:
+        """Frees the slots process `owner` claimed and never completed"""
+        with self.lock:
+            indices = ((self.owners == owner) & (self.state == CLAIMED)).nonzero()
+            indices = indices.flatten().tolist()
+            for index in indices:
+                self.release(index)
+        return indices
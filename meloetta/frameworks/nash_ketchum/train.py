@@ -10,7 +10,7 @@ from typing import List
 
 from tqdm import tqdm
 
-from meloetta.workers import SelfPlayWorker, EvalWorker
+from meloetta.workers import SelfPlayWorker, EvalWorker, WorkerSupervisor
 
 from meloetta.frameworks.random import RandomActor
 from meloetta.frameworks.max_damage import MaxDamageActor
@@ -88,9 +88,9 @@ def main(fpath: str = None, latest: bool = False):
     # else:
     #     num_players = max(learner.config.batch_size // learner.config.num_actors, 2)
 
-    for i in range(learner.config.num_actors):
-        worker = SelfPlayWorker(
-            worker_index=i,
+    def make_worker(worker_index: int) -> SelfPlayWorker:
+        return SelfPlayWorker(
+            worker_index=worker_index,
             num_players=num_players,  # 2 is players per worker
             battle_format=learner.config.battle_format,
             team=learner.config.team,
@@ -98,15 +98,23 @@ def main(fpath: str = None, latest: bool = False):
             actor_kwargs={
                 "model": learner.actor_model,
                 "replay_buffer": learner.replay_buffer,
+                "params": learner.params,
             },
         )
 
-        process = mp.Process(
-            target=worker.run,
-            name=repr(worker) + str(i),
-        )
-        process.start()
-        procs.append(process)
+    # restarts crashed workers under fresh usernames and frees their slots
+    supervisor = WorkerSupervisor(
+        make_worker,
+        num_workers=learner.config.num_actors,
+        min_workers=learner.config.min_actors,
+        max_workers=learner.config.max_actors,
+        replay_buffer=learner.replay_buffer,
+        batch_size=learner.config.batch_size,
+    )
+    supervisor.start()
+    supervisor_thread = threading.Thread(target=supervisor.run, name="Supervisor")
+    supervisor_thread.start()
+    threads.append(supervisor_thread)
 
     if learner.config.eval:
         evals = [
@@ -135,6 +143,7 @@ def main(fpath: str = None, latest: bool = False):
                 eval_actor_fn=main_actor,
                 eval_actor_kwargs={
                     "model": learner.actor_model,
+                    "params": learner.params,
                 },
                 baseline_actor_fn=opponent_actor,
                 baseline_actor_args=opponent_actor_args,
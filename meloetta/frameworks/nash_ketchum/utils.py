@@ -2,7 +2,7 @@ import re
 import torch
 import torch.nn.functional as F
 
-from typing import Dict, List, Any, Sequence, NamedTuple, Tuple
+from typing import Dict, Any, Sequence, Tuple
 
 from jax import tree_util as tree
 
@@ -14,18 +14,6 @@ def _get_leading_dims(tensor_dict: TensorDict) -> int:
     return next(iter(tensor_dict.values())).shape[:2]
 
 
-class LoopVTraceCarry(NamedTuple):
-    """The carry of the v-trace scan loop."""
-
-    reward: torch.Tensor
-    # The cumulated reward until the end of the episode. Uncorrected (v-trace).
-    # Gamma discounted and includes eta_reg_entropy.
-    reward_uncorrected: torch.Tensor
-    next_value: torch.Tensor
-    next_v_target: torch.Tensor
-    importance_sampling: torch.Tensor
-
-
 def _player_others(
     player_ids: torch.Tensor, valid: torch.Tensor, player: int
 ) -> torch.Tensor:
@@ -46,6 +34,52 @@ def _player_others(
     return torch.unsqueeze(res, dim=-1)
 
 
+def _player_masks(
+    valid: torch.Tensor, player_id: torch.Tensor, num_players: int = 2
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """`_has_played` and `_player_others` of every player at once.
+
+    Args:
+      valid: Tensor [...] containing whether these states are valid.
+      player_id: Tensor [...] containing player ids (0 <= player_id < N).
+      num_players: N.
+
+    Returns:
+      has_played: a mask of each player's valid turns [..., N].
+      player_others: 1 for each player's turns and -1 for others [..., N].
+    """
+    players = torch.arange(num_players, device=player_id.device)
+    is_player = player_id.unsqueeze(-1) == players
+    valid = valid.unsqueeze(-1)
+    has_played = valid & is_player
+    player_others = (2 * is_player.to(torch.int32) - 1) * valid
+    return has_played, player_others
+
+
+def _gather_fields(
+    tensors: Sequence[torch.Tensor], index: torch.Tensor, value: float = 0
+) -> torch.Tensor:
+    """Each row's entry in the tensor of `tensors` that `index` picks.
+
+    Args:
+      tensors: Tensors [..., A_i], padded with `value` to the widest.
+      index: Tensor [...] of which tensor each row takes (0 <= index < len).
+
+    Returns:
+      The picked entries [..., max A_i].
+    """
+    width = max(tensor.shape[-1] for tensor in tensors)
+    stacked = torch.stack(
+        [
+            F.pad(tensor, (0, width - tensor.shape[-1]), value=value)
+            for tensor in tensors
+        ],
+        dim=-2,
+    )
+    index = index[..., None, None].expand(*index.shape, 1, width)
+    return stacked.gather(-2, index).squeeze(-2)
+
+
 def _where(pred: torch.Tensor, true_data: Any, false_data: Any) -> Any:
     """Similar to jax.where but treats `pred` as a broadcastable prefix."""
 
@@ -85,43 +119,38 @@ def pytorch_scan(f, init, xs, length=None, reverse=False):
     return state, ys
 
 
+def _reverse_affine_scan(
+    a: torch.Tensor, b: torch.Tensor, init: torch.Tensor
+) -> torch.Tensor:
+    """Solves `y[t] = a[t] + b[t] * y[t + 1]` backwards over the leading
+    dimension, with `y[T] = init`, in `log2(T)` vectorized steps by
+    composing ever longer spans of the recursion. Where `b[t]` is 0 the
+    recursion restarts, and nothing after `t` reaches `y[t]`, not even nan."""
+    length = a.shape[0]
+    shift = 1
+    while shift < length:
+        keep = b[:-shift] != 0
+        a = torch.cat(
+            [a[:-shift] + torch.where(keep, b[:-shift] * a[shift:], 0), a[-shift:]]
+        )
+        b = torch.cat([torch.where(keep, b[:-shift] * b[shift:], 0), b[-shift:]])
+        shift *= 2
+    return a + b * init
+
+
+def _shift_back(x: torch.Tensor, last: torch.Tensor) -> torch.Tensor:
+    """`x[t + 1]` at every `t`, with `last` after the final step"""
+    return torch.cat([x[1:], last.expand_as(x[:1])])
+
+
 def _has_played(
     valid: torch.Tensor, player_id: torch.Tensor, player: int
 ) -> torch.Tensor:
     """Compute a mask of states which have a next state in the sequence."""
     assert valid.shape == player_id.shape
-
-    def _loop_has_played(carry, x):
-        valid, player_id = x
-        assert valid.shape == player_id.shape
-
-        our_res = torch.ones_like(player_id)
-        opp_res = carry
-        reset_res = torch.zeros_like(carry)
-
-        our_carry = carry
-        opp_carry = carry
-        reset_carry = torch.zeros_like(player_id)
-
-        # pyformat: disable
-        return _where(
-            valid,
-            _where(
-                (player_id == player),
-                (our_carry, our_res),
-                (opp_carry, opp_res),
-            ),
-            (reset_carry, reset_res),
-        )
-        # pyformat: enable
-
-    _, result = pytorch_scan(
-        f=_loop_has_played,
-        init=torch.zeros_like(player_id[-1]),
-        xs=(valid, player_id),
-        reverse=True,
-    )
-    return result
+    # The reverse scan this mirrors only ever resets its carry to zero, so a
+    # state has a next one exactly when it is a valid turn of `player`.
+    return (valid & (player_id == player)).to(player_id.dtype)
 
 
 def _policy_ratio(
@@ -171,10 +200,12 @@ def v_trace(
     c: float,
     rho: float,
     gamma: float = 1.0,
+    has_played: torch.Tensor = None,
 ) -> Tuple[Any, Any, Any]:
     """Custom VTrace for trajectories with a mix of different player steps."""
 
-    has_played = _has_played(valid, player_id, player)
+    if has_played is None:
+        has_played = _has_played(valid, player_id, player)
 
     policy_ratios = []
     inv_mus = []
@@ -213,129 +244,87 @@ def v_trace(
     eta_reg_entropy = -eta * torch.sum(eta_reg_entropy, dim=-1)
     policy_ratio = torch.prod(torch.stack(policy_ratios, dim=-1), dim=-1)
 
-    init_state_v_trace = LoopVTraceCarry(
-        reward=torch.zeros_like(reward[-1]),
-        reward_uncorrected=torch.zeros_like(reward[-1]),
-        next_value=torch.zeros_like(v[0][-1]),
-        next_v_target=torch.zeros_like(v[0][-1]),
-        importance_sampling=torch.ones_like(policy_ratio[-1]),
+    v = torch.stack(v, dim=-1).squeeze()
+    v = (v * F.one_hot(policy_select, 4)).sum(-1, keepdim=True)
+
+    our = valid & (player_id == player)
+    opp = valid & (player_id != player)
+    cs = policy_ratio
+    zeros = torch.zeros_like(cs)
+
+    # The carry each step hands to the one before it. On our turns and
+    # invalid ones it is reset, on the opponent's it accumulates, so every
+    # field is an affine function of the one after: y[t] = a[t] + b[t] * y[t + 1]
+    carry_a = torch.stack(
+        [
+            (~opp).to(cs.dtype),
+            torch.where(opp, reward + eta_reg_entropy, zeros),
+            torch.where(opp, eta_reg_entropy + cs * reward, zeros),
+            torch.where(our, v.squeeze(-1), zeros),
+        ],
+        dim=-1,
+    )
+    carry_b = torch.stack(
+        [
+            torch.where(opp, cs, zeros),
+            torch.where(opp, gamma, zeros),
+            torch.where(opp, gamma * cs, zeros),
+            torch.where(opp, gamma, zeros),
+        ],
+        dim=-1,
+    )
+    # importance_sampling, reward_uncorrected, reward, next_value
+    carry_init = torch.tensor([1.0, 0.0, 0.0, 0.0], dtype=cs.dtype, device=cs.device)
+    carry = _reverse_affine_scan(carry_a, carry_b, carry_init)
+    carry = _shift_back(carry, carry_init)
+    (
+        importance_sampling,
+        carry_reward_uncorrected,
+        carry_reward,
+        next_value,
+    ) = carry.unbind(-1)
+    next_value = next_value.unsqueeze(-1)
+
+    reward_uncorrected = reward + gamma * carry_reward_uncorrected + eta_reg_entropy
+    discounted_reward = reward + gamma * carry_reward
+    cs_is = cs * importance_sampling
+
+    # V-target, itself carried back from our next turn:
+    # v_target[t] = base[t] + coef[t] * (next_v_target[t] - next_value[t])
+    base = v + torch.unsqueeze(torch.clamp(cs_is, max=rho), dim=-1) * (
+        torch.unsqueeze(reward_uncorrected, dim=-1) + gamma * next_value - v
+    )
+    coef = lambda_ * torch.unsqueeze(torch.clamp(cs_is, max=c), dim=-1) * gamma
+    our_, opp_ = our.unsqueeze(-1), opp.unsqueeze(-1)
+    next_v_target = _reverse_affine_scan(
+        torch.where(our_, base - coef * next_value, torch.zeros_like(v)),
+        torch.where(our_, coef, torch.where(opp_, gamma, torch.zeros_like(v))),
+        torch.zeros_like(v[-1]),
+    )
+    next_v_target = _shift_back(next_v_target, torch.zeros_like(v[-1]))
+    v_target = torch.where(
+        our_, base + coef * (next_v_target - next_value), torch.zeros_like(v)
     )
 
-    def _loop_v_trace(carry: LoopVTraceCarry, x) -> Tuple[LoopVTraceCarry, Any]:
-        (
-            cs,
-            player_id,
-            v,
-            reward,
-            eta_reg_entropy,
-            valid,
-            inv_mus,
-            actions_ohs,
-            eta_log_policies,
-        ) = x
-
-        reward_uncorrected = reward + gamma * carry.reward_uncorrected + eta_reg_entropy
-        discounted_reward = reward + gamma * carry.reward
-
-        # V-target:
-        our_v_target = (
+    # Learning output:
+    learning_output = [
+        torch.where(
+            our_,
             v
-            + torch.unsqueeze(
-                torch.minimum(torch.tensor(rho), cs * carry.importance_sampling), dim=-1
-            )
+            + eta_log_policy  # value
+            + actions_oh  # regularisation
+            * torch.unsqueeze(inv_mu, dim=-1)
             * (
-                torch.unsqueeze(reward_uncorrected, dim=-1)
-                + gamma * carry.next_value
+                torch.unsqueeze(discounted_reward, dim=-1)
+                + gamma * torch.unsqueeze(importance_sampling, dim=-1) * next_v_target
                 - v
-            )
-            + lambda_
-            * torch.unsqueeze(
-                torch.minimum(torch.tensor(c), cs * carry.importance_sampling), dim=-1
-            )
-            * gamma
-            * (carry.next_v_target - carry.next_value)
-        )
-
-        opp_v_target = torch.zeros_like(our_v_target)
-        reset_v_target = torch.zeros_like(our_v_target)
-
-        # Learning output:
-        our_learning_outputs = [
-            (
-                v
-                + eta_log_policy  # value
-                + actions_oh  # regularisation
-                * torch.unsqueeze(inv_mu, dim=-1)
-                * (
-                    torch.unsqueeze(discounted_reward, dim=-1)
-                    + gamma
-                    * torch.unsqueeze(carry.importance_sampling, dim=-1)
-                    * carry.next_v_target
-                    - v
-                )
-            )
-            for eta_log_policy, inv_mu, actions_oh in zip(
-                eta_log_policies, inv_mus, actions_ohs
-            )
-        ]
-
-        opp_learning_outputs = [
-            torch.zeros_like(our_learning_output)
-            for our_learning_output in our_learning_outputs
-        ]
-        reset_learning_output = [
-            torch.zeros_like(our_learning_output)
-            for our_learning_output in our_learning_outputs
-        ]
-
-        # State carry:
-        our_carry = LoopVTraceCarry(
-            reward=torch.zeros_like(carry.reward),
-            next_value=v,
-            next_v_target=our_v_target,
-            reward_uncorrected=torch.zeros_like(carry.reward_uncorrected),
-            importance_sampling=torch.ones_like(carry.importance_sampling),
-        )
-        opp_carry = LoopVTraceCarry(
-            reward=eta_reg_entropy + cs * discounted_reward,
-            reward_uncorrected=reward_uncorrected,
-            next_value=gamma * carry.next_value,
-            next_v_target=gamma * carry.next_v_target,
-            importance_sampling=cs * carry.importance_sampling,
-        )
-        reset_carry = init_state_v_trace
-
-        # Invalid turn: init_state_v_trace and (zero target, learning_output)
-        # pyformat: disable
-        return _where(
-            valid,
-            _where(
-                (player_id == player),
-                (our_carry, (our_v_target, our_learning_outputs)),
-                (opp_carry, (opp_v_target, opp_learning_outputs)),
             ),
-            (reset_carry, (reset_v_target, reset_learning_output)),
+            torch.zeros_like(actions_oh),
         )
-
-    v = torch.stack(v, dim=-1).squeeze()
-    v = (v * F.one_hot(policy_select, 4)).sum(-1, keepdim=True)
-
-    _, (v_target, learning_output) = pytorch_scan(
-        f=_loop_v_trace,
-        init=init_state_v_trace,
-        xs=(
-            policy_ratio,
-            player_id,
-            v,
-            reward,
-            eta_reg_entropy,
-            valid,
-            inv_mus,
-            actions_ohs,
-            eta_log_policies,
-        ),
-        reverse=True,
-    )
+        for eta_log_policy, inv_mu, actions_oh in zip(
+            eta_log_policies, inv_mus, actions_ohs
+        )
+    ]
 
     return v_target, has_played, learning_output, policy_ratios
 
@@ -420,6 +409,47 @@ def get_loss_nerd(
     return loss_pi_list
 
 
+def get_loss_nerd_v(
+    logits: torch.Tensor,
+    policy: torch.Tensor,
+    value: torch.Tensor,
+    q_vr: torch.Tensor,
+    importance_sampling_correction: torch.Tensor,
+    value_target: torch.Tensor,
+    legal_actions: torch.Tensor,
+    num_actions: torch.Tensor,
+    clip: float = 100,
+    threshold: float = 2,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """The nerd and critic losses of every row, before masking and scaling.
+
+    Rows can come from fields with different numbers of actions, padded to
+    one width with illegal actions. `num_actions` [..., 1] is each row's
+    width before padding, which its logits are centred over as in
+    `get_loss_nerd`.
+    """
+    adv_pi = q_vr - torch.sum(policy * q_vr, dim=-1, keepdim=True)
+    adv_pi = importance_sampling_correction * adv_pi
+    adv_pi = torch.clip(adv_pi, min=-clip, max=clip)
+    adv_pi = adv_pi.detach()
+
+    logits = (
+        logits - torch.sum(logits * legal_actions, dim=-1, keepdim=True) / num_actions
+    )
+
+    threshold_center = torch.zeros_like(logits)
+
+    force = apply_force_with_threshold(
+        logits,
+        adv_pi,
+        threshold,
+        threshold_center,
+    )
+    loss_pi = -torch.sum(legal_actions * force, dim=-1)
+    loss_v = torch.squeeze((value - value_target.detach()) ** 2, dim=-1)
+    return loss_pi, loss_v
+
+
 def get_gen_and_gametype(battle_format: str) -> Tuple[int, str]:
     gen = int(re.search(r"gen([0-9])", battle_format).groups()[0])
     if "triples" in battle_format:
@@ -592,6 +622,10 @@ def get_buffer_specs(
                 "size": (trajectory_length,),
                 "dtype": torch.float64,
             },
+            "policy_version": {
+                "size": (trajectory_length,),
+                "dtype": torch.long,
+            },
             "hist": {
                 "size": (trajectory_length, 10, 4, 4),
                 "dtype": torch.long,
@@ -627,20 +661,15 @@ def create_buffers(
         trajectory_length, gen, gametype, private_reserve_size
     )
 
-    buffers: Dict[str, List[List[torch.Tensor]]] = {
-        key: [[], []] for key in buffer_specs
-    }
-    for _ in range(num_buffers):
-        for k in range(num_players):
-            for key in buffer_specs:
-                if key.endswith("_mask"):
-                    buffers[key][k].append(
-                        torch.ones(**buffer_specs[key]).share_memory_()
-                    )
-                else:
-                    buffers[key][k].append(
-                        torch.zeros(**buffer_specs[key]).share_memory_()
-                    )
+    # one shared slab per key, `[num_buffers, num_players, trajectory_length,
+    # ...]`, instead of a tensor (and file descriptor) per slot and player
+    buffers: Dict[str, torch.Tensor] = {}
+    for key, spec in buffer_specs.items():
+        size = (num_buffers, num_players, *spec["size"])
+        if key.endswith("_mask"):
+            buffers[key] = torch.ones(size, dtype=spec["dtype"]).share_memory_()
+        else:
+            buffers[key] = torch.zeros(size, dtype=spec["dtype"]).share_memory_()
     return buffers
 
 
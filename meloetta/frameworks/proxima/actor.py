@@ -10,7 +10,8 @@ from meloetta.frameworks.proxima import ReplayBuffer
 from meloetta.frameworks.proxima.model import ProximaModel
 
 
-from meloetta.actors.base import Actor
+from meloetta.actors.base import Actor, AsyncActor
+from meloetta.actors.inference import InferenceServer
 from meloetta.actors.types import State, Choices, Battle, TensorDict
 from meloetta.utils import expand_bt
 from meloetta.data import (
@@ -79,14 +80,23 @@ POKEMON_VECTOR_SIZE = 38
 
 
 class ProximaActor(Actor):
+    def __new__(cls, *args, inference: InferenceServer = None, **kwargs):
+        # with an inference server, forwards are awaited instead of blocking
+        # the worker's event loop, see `AsyncProximaActor`
+        if inference is not None and cls is ProximaActor:
+            cls = AsyncProximaActor
+        return super().__new__(cls)
+
     def __init__(
         self,
         model: ProximaModel = None,
         replay_buffer: ReplayBuffer = None,
         pid: str = None,
+        inference: InferenceServer = None,
     ):
         self.model = model
         self.gen = model.gen
+        self.inference = inference
 
         self.replay_buffer = replay_buffer
 
@@ -103,6 +113,16 @@ class ProximaActor(Actor):
     @torch.no_grad()
     def choose_action(self, state: State, room: BattleRoom, choices: Choices):
         model_output = self.model.acting_forward(state)
+        return self._act(state, room, choices, model_output)
+
+    @torch.no_grad()
+    def _act(
+        self,
+        state: State,
+        room: BattleRoom,
+        choices: Choices,
+        model_output: TensorDict,
+    ):
         postprocess = self.model.postprocess(
             state=state,
             model_output=model_output,
@@ -411,3 +431,12 @@ class ProximaActor(Actor):
         }
         state = {key: expand_bt(value) for key, value in state.items()}
         return state
+
+
+class AsyncProximaActor(AsyncActor, ProximaActor):
+    """What `ProximaActor(..., inference=server)` builds, awaiting the server's
+    forwards like `AsyncNAshKetchumActor`"""
+
+    async def choose_action(self, state: State, room: BattleRoom, choices: Choices):
+        model_output = await self.inference.infer(state)
+        return self._act(state, room, choices, model_output)
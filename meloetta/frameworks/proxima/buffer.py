@@ -3,13 +3,13 @@ import random
 import threading
 import multiprocessing as mp
 
-from typing import Dict, List
+from typing import Dict
 
 from meloetta.actors.types import TensorDict
 from meloetta.frameworks.proxima.utils import create_buffers
 
 
-Buffers = Dict[str, List[torch.Tensor]]
+Buffers = Dict[str, torch.Tensor]
 
 
 class ReplayBuffer:
@@ -92,25 +92,19 @@ class ReplayBuffer:
         with lock:
             indices = [_get_index() for _ in range(batch_size)]
 
-        valids = torch.stack([self.buffers["valid"][m] for m in indices])
+        index = torch.tensor(indices)
+        valids = self.buffers["valid"][index]
         lengths = valids.sum(-1)  # + 1
         max_length = lengths.max().item()
 
-        def _check_and_return(buffers, key, index, max_length: int = None):
-            end = buffers["valid"][index].sum(-1)
-            assert buffers["valid"][index][:end].sum() == end
-            assert buffers["valid"][index][end:].sum() == 0
-            return self.buffers[key][index][:max_length]
+        # every trajectory's valid steps come first
+        steps = torch.arange(valids.shape[-1])
+        assert torch.equal(valids, steps < lengths.unsqueeze(-1))
 
+        # one gather per key, `[max_length, batch_size, ...]`
+        steps = steps[:max_length].unsqueeze(-1)
         batch = {
-            key: torch.stack(
-                [
-                    _check_and_return(self.buffers, key, index, max_length)
-                    for index in indices
-                ],
-                dim=1,
-            )
-            for key in self.buffers
+            key: value[index.unsqueeze(0), steps] for key, value in self.buffers.items()
         }
 
         for m in indices:
@@ -1,7 +1,21 @@
 Controls = {
     controls: "",
+    // the enabled choice buttons (and checkboxes) of `controls`, so they can
+    // be read without parsing the html
+    options: [],
+    pending: [],
     html: function (data) {
         this.controls = data;
+        this.options = this.pending;
+        this.pending = [];
+    },
+    option: function (name, value, target, tooltip) {
+        this.pending.push({
+            name: name,
+            value: value === undefined ? null : "" + value,
+            target: typeof target === "string" ? target : "",
+            tooltip: tooltip || "",
+        });
     },
 };
 
@@ -745,6 +759,9 @@ BattleRoom = {
                     if (Math.abs(farSlot - i) > 1) disabled = true;
                 }
 
+                if (!disabled) {
+                    this.controls.option("chooseMoveTarget", i + 1);
+                }
                 if (disabled) {
                     targetMenus[0] += '<button disabled="disabled"></button> ';
                 } else if (!pokemon || pokemon.fainted) {
@@ -796,6 +813,9 @@ BattleRoom = {
                 if (moveTarget !== "adjacentAllyOrSelf" && activePos == i)
                     disabled = true;
 
+                if (!disabled) {
+                    this.controls.option("chooseMoveTarget", -(i + 1));
+                }
                 if (disabled) {
                     targetMenus[1] +=
                         '<button disabled="disabled" style="visibility:hidden"></button> ';
@@ -867,6 +887,7 @@ BattleRoom = {
             var hasMoves = false;
             var moveMenu = "";
             var movebuttons = "";
+            var moveOptions = [];
             var activePos =
                 this.battle.mySide.n > 1
                     ? pos + this.battle.pokemonControlled
@@ -899,6 +920,7 @@ BattleRoom = {
                         BattleLog.escapeHTML(tooltipArgs) +
                         '">';
                 } else {
+                    moveOptions.push([i + 1, moveData.target, tooltipArgs]);
                     movebuttons +=
                         '<button class="type-' +
                         moveType +
@@ -922,6 +944,7 @@ BattleRoom = {
                     "</small>&nbsp;</button> ";
             }
             if (!hasMoves) {
+                this.controls.option("chooseMove", 0, "randomNormal");
                 moveMenu +=
                     '<button class="movebutton" name="chooseMove" value="0" data-move="Struggle" data-target="randomNormal">Struggle<br /><small class="type">Normal</small> <small class="pp">&ndash;</small>&nbsp;</button> ';
             } else {
@@ -929,6 +952,7 @@ BattleRoom = {
                     var classType = canZMove ? "z" : "max";
                     if (currentlyDynamaxed) {
                         movebuttons = "";
+                        moveOptions = [];
                     } else {
                         movebuttons =
                             '<div class="movebuttons-no' +
@@ -976,6 +1000,13 @@ BattleRoom = {
                             var isDisabled = specialMoves[i].disabled
                                 ? 'disabled="disabled"'
                                 : "";
+                            if (!isDisabled) {
+                                moveOptions.push([
+                                    i + 1,
+                                    specialMoves[i].target,
+                                    tooltipArgs,
+                                ]);
+                            }
                             movebuttons +=
                                 "<button " +
                                 isDisabled +
@@ -1016,20 +1047,33 @@ BattleRoom = {
                     if (!currentlyDynamaxed) movebuttons += "</div>";
                 }
                 moveMenu += movebuttons;
+                for (var i = 0; i < moveOptions.length; i++) {
+                    this.controls.option(
+                        "chooseMove",
+                        moveOptions[i][0],
+                        moveOptions[i][1],
+                        moveOptions[i][2]
+                    );
+                }
             }
             if (canMegaEvo) {
+                this.controls.option("checkbox", "megaevo");
                 moveMenu +=
                     '<br /><label class="megaevo"><input type="checkbox" name="megaevo" />&nbsp;Mega&nbsp;Evolution</label>';
             } else if (canZMove) {
+                this.controls.option("checkbox", "zmove");
                 moveMenu +=
                     '<br /><label class="megaevo"><input type="checkbox" name="zmove" />&nbsp;Z-Power</label>';
             } else if (canUltraBurst) {
+                this.controls.option("checkbox", "ultraburst");
                 moveMenu +=
                     '<br /><label class="megaevo"><input type="checkbox" name="ultraburst" />&nbsp;Ultra Burst</label>';
             } else if (canDynamax) {
+                this.controls.option("checkbox", "dynamax");
                 moveMenu +=
                     '<br /><label class="megaevo"><input type="checkbox" name="dynamax" />&nbsp;Dynamax</label>';
             } else if (canTerastallize) {
+                this.controls.option("checkbox", "terastallize");
                 moveMenu +=
                     '<br /><label class="megaevo"><input type="checkbox" name="terastallize" />&nbsp;Terastallize<br />' +
                     Dex.getTypeIcon(canTerastallize) +
@@ -1051,6 +1095,7 @@ BattleRoom = {
 
             var shiftControls = "";
             if (this.battle.gameType === "triples" && pos !== 1) {
+                this.controls.option("chooseShift");
                 shiftControls +=
                     '<div class="shiftselect"><button name="chooseShift">Shift</button></div>';
             }
@@ -1129,6 +1174,7 @@ BattleRoom = {
                         : "") +
                     "</button> ";
             } else {
+                this.controls.option("chooseSwitch", i);
                 party +=
                     '<button name="chooseSwitch" value="' +
                     i +
@@ -1255,6 +1301,7 @@ BattleRoom = {
                 } else if (!pokemon) {
                     controls += "<button disabled></button> ";
                 } else {
+                    this.controls.option("chooseSwitchTarget", i);
                     controls +=
                         '<button name="chooseSwitchTarget" value="' +
                         i +
@@ -1317,6 +1364,7 @@ BattleRoom = {
                             BattleLog.escapeHTML(tooltipArgs) +
                             '">';
                     } else {
+                        this.controls.option("chooseSwitch", i);
                         switchMenu +=
                             '<button name="chooseSwitch" value="' +
                             i +
@@ -1342,6 +1390,7 @@ BattleRoom = {
                             BattleLog.escapeHTML(tooltipArgs) +
                             '">';
                     } else {
+                        this.controls.option("chooseSwitch", i);
                         switchMenu +=
                             '<button name="chooseSwitch" value="' +
                             i +
@@ -1420,6 +1469,7 @@ BattleRoom = {
                     BattleLog.escapeHTML(pokemon.name) +
                     "</button> ";
             } else {
+                this.controls.option("chooseTeamPreview", i);
                 switchMenu +=
                     '<button name="chooseTeamPreview" value="' +
                     i +
@@ -12,18 +12,129 @@ function serialize(obj) {
     return JSON.decycle(obj);
 }
 
+// the pokemon fields read by `VectorizedState` and the framework actors
+var EXPORT_POKEMON_FIELDS = [
+    "name",
+    "speciesForme",
+    "ident",
+    "details",
+    "searchid",
+    "slot",
+    "fainted",
+    "hp",
+    "maxhp",
+    "level",
+    "gender",
+    "moves",
+    "ability",
+    "baseAbility",
+    "item",
+    "itemEffect",
+    "prevItem",
+    "prevItemEffect",
+    "teraType",
+    "terastallized",
+    "boosts",
+    "status",
+    "statusStage",
+    "lastMove",
+    "moveTrack",
+    "statusData",
+    "timesAttacked",
+    "reviving",
+    "commanding",
+];
+
+function exportPokemon(pokemon) {
+    var exported = {};
+    for (var i = 0; i < EXPORT_POKEMON_FIELDS.length; i++) {
+        var field = EXPORT_POKEMON_FIELDS[i];
+        if (pokemon[field] !== undefined) {
+            exported[field] = pokemon[field];
+        }
+    }
+    // volatiles can hold references to other pokemon (e.g. transform),
+    // only their names are ever read
+    exported.volatiles = {};
+    for (var id in pokemon.volatiles) {
+        exported.volatiles[id] = [pokemon.volatiles[id][0]];
+    }
+    return exported;
+}
+
 var engine = {
+    // independent client instances sharing this context's dex data
+    clients: {},
+
     start: function () {
-        this.client = BattleRoom;
+        this.clients = {};
+        this.create("0");
+        return 0;
+    },
+
+    create: function (slot) {
+        this.clients[slot] = Object.create(BattleRoom);
+        this.use(slot);
         this.reset();
         return 0;
     },
 
+    destroy: function (slot) {
+        delete this.clients[slot];
+        return 0;
+    },
+
+    use: function (slot) {
+        this.client = this.clients[slot];
+        return 0;
+    },
+
     receive: function (data) {
         this.client.receive(data);
         return 0;
     },
 
+    step: function (data, ingest) {
+        // one round trip per message, see `BattleRoom.step`
+        if (ingest) {
+            this.client.receive(data);
+        }
+        var actionRequired = null;
+        if (data.includes("|turn") || data.includes("|teampreview")) {
+            actionRequired = true;
+        } else if (!data.includes("|request")) {
+            actionRequired = !!(
+                this.client.request && this.client.request.forceSwitch
+            );
+        }
+        var status = this.status(actionRequired);
+        status.actionRequired = actionRequired;
+        return status;
+    },
+
+    status: function (withBattle) {
+        var client = this.client;
+        var battle = client.battle;
+        var controls = client.controls.controls || "";
+        var status = {
+            ended: !!(battle && battle.ended),
+            waiting:
+                controls.includes("Waiting for opponent") ||
+                controls.includes(" will switch in, replacing"),
+            tier: battle ? battle.tier : "",
+            gameType: battle ? battle.gameType : "",
+            controls: controls,
+            options: client.controls.options,
+            choice: client.choice || null,
+            forceSwitch: (client.request && client.request.forceSwitch) || null,
+            // outgoing messages are handed over exactly once
+            outgoing: client.outgoing_message || null,
+            battle: withBattle ? this.exportState() : null,
+        };
+        delete client.outgoing_message;
+        return status;
+    },
+
     setGen: function (gen) {
         this.client.battle.dex = Dex.forGen(gen);
         return 0;
@@ -64,8 +175,67 @@ var engine = {
         return serialized_battle;
     },
 
+    exportState: function () {
+        // sides refer to pokemon by their index in `pokemon` rather than
+        // by nested (cyclic) objects, see `room.decode_state`
+        var battle = this.client.battle;
+        var pokemon = [];
+        var ids = new Map();
+
+        function ref(poke) {
+            if (!poke) {
+                return null;
+            }
+            if (!ids.has(poke)) {
+                ids.set(poke, pokemon.length);
+                pokemon.push(exportPokemon(poke));
+            }
+            return ids.get(poke);
+        }
+
+        function exportSide(side) {
+            if (!side) {
+                return null;
+            }
+            return {
+                name: side.name,
+                id: side.id,
+                sideid: side.sideid,
+                n: side.n,
+                totalPokemon: side.totalPokemon,
+                faintCounter: side.faintCounter,
+                sideConditions: side.sideConditions,
+                wisher: ref(side.wisher),
+                active: side.active.map(ref),
+                pokemon: side.pokemon.map(ref),
+            };
+        }
+
+        return {
+            dex: { gen: battle.dex.gen },
+            gen: battle.gen,
+            tier: battle.tier,
+            gameType: battle.gameType,
+            turn: battle.turn,
+            ended: battle.ended,
+            weather: battle.weather,
+            weatherTimeLeft: battle.weatherTimeLeft,
+            weatherMinTimeLeft: battle.weatherMinTimeLeft,
+            pseudoWeather: battle.pseudoWeather,
+            pokemonControlled: battle.pokemonControlled,
+            mySide: exportSide(battle.mySide),
+            farSide: exportSide(battle.farSide),
+            myPokemon: battle.myPokemon,
+            pokemon: pokemon,
+        };
+    },
+
     reset: function () {
         this.client.initialize();
+        // `initialize` hands every client the global `Controls` object
+        this.client.controls = Object.create(Controls);
+        this.client.controls.options = [];
+        this.client.controls.pending = [];
         this.client.request = null;
         this.client.side = "";
         this.client.battleEnded = false;
@@ -76,7 +246,8 @@ var engine = {
     // Choices
 
     chooseMoveTarget: function (posString) {
-        return this.client.chooseMoveTarget(posString);
+        this.client.chooseMoveTarget(posString);
+        return this.status(false);
     },
 
     chooseMove: function (
@@ -88,7 +259,7 @@ var engine = {
         isDynamax,
         isTerastal
     ) {
-        return this.client.chooseMove(
+        this.client.chooseMove(
             pos,
             target,
             isMega,
@@ -97,22 +268,27 @@ var engine = {
             isDynamax,
             isTerastal
         );
+        return this.status(false);
     },
 
     chooseShift: function () {
-        return this.client.chooseShift();
+        this.client.chooseShift();
+        return this.status(false);
     },
 
     chooseSwitch: function (pos) {
-        return this.client.chooseSwitch(pos);
+        this.client.chooseSwitch(pos);
+        return this.status(false);
     },
 
     chooseSwitchTarget: function (pos) {
-        return this.client.chooseSwitchTarget(pos);
+        this.client.chooseSwitchTarget(pos);
+        return this.status(false);
     },
 
     chooseTeamPreview: function (pos) {
-        return this.client.chooseTeamPreview(pos);
+        this.client.chooseTeamPreview(pos);
+        return this.status(false);
     },
 
     popOutgoing: function () {
@@ -29,14 +29,23 @@ class Choices(NamedTuple):
 
 class ChoiceBuilder:
     def __init__(
-        self, room: BattleRoom = None, turns_since_last_move: int = 0, path: str = None
+        self,
+        room: BattleRoom = None,
+        turns_since_last_move: int = 0,
+        path: str = None,
+        from_html: bool = False,
     ):
+        self.options = None
         if room is not None:
             choices = self._init_from_room(room)
         elif path is not None:
             choices = self._init_from_error(path)
 
-        self.soup = BeautifulSoup(self.html, "html.parser")
+        # the html is only parsed when the client's options aren't available
+        if from_html:
+            self.options = None
+        if self.options is None:
+            self.soup = BeautifulSoup(self.html, "html.parser")
 
         self.isMega = any("mega" in choice for choice in choices)
         self.isZMove = any("zmove" in choice for choice in choices)
@@ -45,10 +54,17 @@ class ChoiceBuilder:
         self.isTerastal = any("terastal" in choice for choice in choices)
 
         choices = []
-        self.checkboxes = {
-            checkbox.find("input").attrs["name"]
-            for checkbox in self.soup.find_all("label")
-        }
+        if self.options is None:
+            self.checkboxes = {
+                checkbox.find("input").attrs["name"]
+                for checkbox in self.soup.find_all("label")
+            }
+        else:
+            self.checkboxes = {
+                option["value"]
+                for option in self.options
+                if option["name"] == "checkbox"
+            }
         self.turns_since_last_move = turns_since_last_move
 
     def _init_from_error(self, path: str):
@@ -66,6 +82,7 @@ class ChoiceBuilder:
         if self.gametype == "triples":
             self.n = 3
         controls = log["state"]["controls"]["controls"]
+        self.options = log["state"]["controls"].get("options")
         self.choice = log["state"]["choice"]
         choices = self.choice.get("choices", [])
         choices = [c for c in choices if c is not None]
@@ -77,18 +94,22 @@ class ChoiceBuilder:
 
     def _init_from_room(self, room: BattleRoom):
         self.room = room
-        tier = room.get_js_attr("battle.tier")
+        if room.status is None:
+            room.step("", ingest=False)
+        status = room.status
+        tier = status["tier"]
         self.gen = int(re.search(r"([0-9])", tier).group())
-        self.gametype = room.get_js_attr("battle.gameType")
+        self.gametype = status["gameType"]
         if self.gametype == "singles":
             self.n = 1
         if self.gametype == "doubles":
             self.n = 2
         if self.gametype == "triples":
             self.n = 3
-        controls = room.get_js_attr("controls.controls")
+        controls = status["controls"]
+        self.options = status["options"]
 
-        self.choice = self.room.get_js_attr("choice")
+        self.choice = status["choice"]
         choices = self.choice.get("choices", [])
         choices = [c for c in choices if c is not None]
         self.choices: List[str] = choices
@@ -276,37 +297,46 @@ class ChoiceBuilder:
             "choices_done": expand_bt(torch.tensor(done)),
         }
 
-    def get_teampreview(self):
-        teampreview = self.soup.find_all(
-            lambda tag: ("disabled" not in tag.attrs),
-            attrs={"name": "chooseTeamPreview"},
+    def _find(self, name: str, tooltip: str = None) -> List[Tuple[str, str]]:
+        """The (value, target) of every enabled button called `name`"""
+        if self.options is not None:
+            return [
+                (option["value"], option["target"])
+                for option in self.options
+                if option["name"] == name
+                and (tooltip is None or option["tooltip"].startswith(tooltip))
+            ]
+
+        attrs = {"name": name}
+        if tooltip is not None:
+            attrs["data-tooltip"] = re.compile("^" + re.escape(tooltip))
+        buttons = self.soup.find_all(
+            lambda tag: ("disabled" not in tag.attrs), attrs=attrs
         )
+        return [
+            (button.attrs.get("value"), button.attrs.get("data-target"))
+            for button in buttons
+        ]
+
+    def get_teampreview(self):
         choices = {}
-        for choice in teampreview:
-            index = choice.attrs.get("value")
+        for index, _ in self._find("chooseTeamPreview"):
             choices[int(index)] = (
                 None if not hasattr(self, "room") else self.room.choose_team_preview,
-                [choice.attrs.get("value")],
+                [index],
                 {},
             )
         return choices
 
     def get_moves(self):
-        self.reg_moves = self.soup.find_all(
-            lambda tag: ("disabled" not in tag.attrs),
-            attrs={
-                "name": "chooseMove",
-                "data-tooltip": re.compile(r"^move\|"),
-            },
-        )
+        self.reg_moves = self._find("chooseMove", "move|")
         choices = {}
-        for choice in self.reg_moves:
-            index = choice.attrs.get("value")
+        for index, target in self.reg_moves:
             choices[int(index) - 1] = (
                 None if not hasattr(self, "room") else self.room.choose_move,
                 [index],
                 {
-                    "target": choice.attrs.get("data-target"),
+                    "target": target,
                     "isMega": False,
                     "isZMove": False,
                     "isUltraBurst": False,
@@ -319,20 +349,12 @@ class ChoiceBuilder:
     def get_max_moves(self):
         choices = {}
         if not self.isDynamax:  # and "dynamax" in self.checkboxes:
-            max_moves = self.soup.find_all(
-                lambda tag: ("disabled" not in tag.attrs),
-                attrs={
-                    "name": "chooseMove",
-                    "data-tooltip": re.compile(r"^maxmove\|"),
-                },
-            )
-            for choice in list(max_moves):
-                index = choice.attrs.get("value")
+            for index, target in self._find("chooseMove", "maxmove|"):
                 choices[int(index) - 1] = (
                     None if not hasattr(self, "room") else self.room.choose_move,
                     [index],
                     {
-                        "target": choice.attrs.get("data-target"),
+                        "target": target,
                         "isMega": False,
                         "isZMove": False,
                         "isUltraBurst": False,
@@ -345,17 +367,12 @@ class ChoiceBuilder:
     def get_mega(self):
         choices = {}
         if not self.isMega and "megaevo" in self.checkboxes:
-            mega_moves = self.soup.find_all(
-                lambda tag: ("disabled" not in tag.attrs),
-                attrs={"name": "chooseMove"},
-            )
-            for choice in mega_moves:
-                index = choice.attrs.get("value")
+            for index, target in self._find("chooseMove"):
                 choices[int(index) - 1] = (
                     None if not hasattr(self, "room") else self.room.choose_move,
-                    [choice.attrs.get("value")],
+                    [index],
                     {
-                        "target": choice.attrs.get("data-target"),
+                        "target": target,
                         "isMega": True,
                         "isZMove": False,
                         "isUltraBurst": False,
@@ -368,17 +385,12 @@ class ChoiceBuilder:
     def get_zmoves(self):
         choices = {}
         if not self.isZMove and "zmove" in self.checkboxes:
-            z_moves = self.soup.find_all(
-                lambda tag: ("disabled" not in tag.attrs),
-                attrs={"name": "chooseMove", "data-tooltip": re.compile(r"^zmove\|")},
-            )
-            for choice in list(z_moves):
-                index = choice.attrs.get("value")
+            for index, target in self._find("chooseMove", "zmove|"):
                 choices[int(index) - 1] = (
                     None if not hasattr(self, "room") else self.room.choose_move,
                     [index],
                     {
-                        "target": choice.attrs.get("data-target"),
+                        "target": target,
                         "isMega": False,
                         "isZMove": True,
                         "isUltraBurst": False,
@@ -391,13 +403,12 @@ class ChoiceBuilder:
     def get_tera_moves(self):
         choices = {}
         if not self.isTerastal and "terastallize" in self.checkboxes:
-            for choice in self.reg_moves:
-                index = choice.attrs.get("value")
+            for index, target in self.reg_moves:
                 choices[int(index) - 1] = (
                     None if not hasattr(self, "room") else self.room.choose_move,
                     [index],
                     {
-                        "target": choice.attrs.get("data-target"),
+                        "target": target,
                         "isMega": False,
                         "isZMove": False,
                         "isUltraBurst": False,
@@ -408,13 +419,8 @@ class ChoiceBuilder:
         return choices
 
     def get_move_targets(self):
-        move_targets = self.soup.find_all(
-            lambda tag: ("disabled" not in tag.attrs),
-            attrs={"name": "chooseMoveTarget"},
-        )
         choices = {}
-        for choice in move_targets:
-            index = choice.attrs.get("value")
+        for index, _ in self._find("chooseMoveTarget"):
             key = int(index)
             if key > 0:
                 key -= 1
@@ -427,13 +433,8 @@ class ChoiceBuilder:
         return choices
 
     def get_switches(self):
-        switches = self.soup.find_all(
-            lambda tag: ("disabled" not in tag.attrs),
-            attrs={"name": "chooseSwitch"},
-        )
         choices = {}
-        for choice in switches:
-            index = choice.attrs.get("value")
+        for index, _ in self._find("chooseSwitch"):
             choices[int(index)] = (
                 None if not hasattr(self, "room") else self.room.choose_switch,
                 [index],
@@ -442,13 +443,8 @@ class ChoiceBuilder:
         return choices
 
     def get_switch_targets(self):
-        switch_targets = self.soup.find_all(
-            lambda tag: ("disabled" not in tag.attrs),
-            attrs={"name": "chooseSwitchTarget"},
-        )
         choices = {}
-        for choice in switch_targets:
-            index = choice.attrs.get("value")
+        for index, _ in self._find("chooseSwitchTarget"):
             choices[int(index)] = (
                 None if not hasattr(self, "room") else self.room.choose_switch_target,
                 [index],
@@ -457,17 +453,13 @@ class ChoiceBuilder:
         return choices
 
     def get_shifts(self):
-        shift = self.soup.find_all(
-            lambda tag: ("disabled" not in tag.attrs),
-            attrs={"name": "chooseShift"},
-        )
         return {
-            int(choice.attrs.get("value")): (
+            int(index): (
                 None if not hasattr(self, "room") else self.room.choose_shift,
                 [],
                 {},
             )
-            for choice in shift
+            for index, _ in self._find("chooseShift")
         }
 
 
@@ -479,10 +471,18 @@ class Player:
     request: Dict[str, Union[str, Dict[str, Any]]]
 
     @classmethod
-    async def create(cls, username, password, address) -> "Player":
+    async def create(
+        cls, username, password, address, room: BattleRoom = None
+    ) -> "Player":
+        client = await Client.create(username, password, address)
+        return cls.from_client(client, room)
+
+    @classmethod
+    def from_client(cls, client: Client, room: BattleRoom = None) -> "Player":
+        """A player on an existing connection, e.g. one of many battles of a login"""
         cls = Player()
-        cls.client = await Client.create(username, password, address)
-        cls.room = BattleRoom()
+        cls.client = client
+        cls.room = room if room is not None else BattleRoom()
         cls.started = False
         return cls
 
@@ -499,19 +499,11 @@ class Player:
             data = data[nlIndex + 1 :]
         if not data:
             return
-        if self.started:
-            self.room.recieve(data)
-        else:
-            if data.startswith("|init|"):
-                self.started = True
-                self.room.recieve(data)
-
-        if any(prefix in data for prefix in {"|turn", "|teampreview"}):
-            return True
+        if not self.started and data.startswith("|init|"):
+            self.started = True
 
-        forceSwitch = self.room.get_js_attr("request?.forceSwitch")
-        if "|request" not in data:
-            return forceSwitch
+        status = self.room.step(data, ingest=self.started)
+        return status["actionRequired"]
 
     def reset(self):
         self.room.reset()
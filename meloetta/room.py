@@ -1,6 +1,7 @@
 import os
 import re
 import json
+import threading
 
 from typing import Union, Dict, Any, List
 from py_mini_racer import MiniRacer
@@ -33,76 +34,203 @@ SRC = [
 ]
 
 
+def _strip_exports(file_src: str) -> str:
+    modules = re.findall(r"(module\.exports \= .*)", file_src)
+    for module in modules:
+        file_src = file_src.replace(module, "")
+    return file_src
+
+
+_sources = None
+
+
+def load_sources() -> List[str]:
+    """`SRC` with `module.exports` stripped, read once per process"""
+    global _sources
+    if _sources is None:
+        _sources = []
+        for file in SRC:
+            with open(file, "r", encoding="utf-8") as f:
+                _sources.append(_strip_exports(f.read()))
+    return _sources
+
+
+def create_context() -> MiniRacer:
+    ctx = MiniRacer()
+    for file, src in zip(SRC, load_sources()):
+        try:
+            ctx.eval(src)
+        except Exception as e:
+            print(e)
+            print(file)
+            exit()
+    ctx.eval("engine.start()")
+    return ctx
+
+
+class ContextPool:
+    """A pool of `MiniRacer` contexts with the client source already loaded.
+
+    Evaluating the client source dominates `BattleRoom` construction, so contexts can
+    be created ahead of time with `warm` (optionally on a background thread)
+    and are handed back with `release` once a room is closed.
+    """
+
+    def __init__(self):
+        self._contexts: List[MiniRacer] = []
+        self._cond = threading.Condition()
+        self._pending = 0
+
+    def __len__(self):
+        return len(self._contexts)
+
+    def warm(self, n: int, background: bool = False):
+        with self._cond:
+            self._pending += n
+
+        def _warm():
+            for _ in range(n):
+                ctx = None
+                try:
+                    ctx = create_context()
+                finally:
+                    with self._cond:
+                        if ctx is not None:
+                            self._contexts.append(ctx)
+                        self._pending -= 1
+                        self._cond.notify_all()
+
+        if background:
+            thread = threading.Thread(target=_warm, daemon=True)
+            thread.start()
+            return thread
+        _warm()
+
+    def acquire(self) -> MiniRacer:
+        with self._cond:
+            # prefer waiting on a context that is already being warmed
+            self._cond.wait_for(lambda: self._contexts or not self._pending)
+            if self._contexts:
+                return self._contexts.pop()
+        return create_context()
+
+    def release(self, ctx: MiniRacer, reset: bool = True):
+        if reset:
+            # drops every client slot and recreates the default one
+            ctx.eval("engine.start()")
+        with self._cond:
+            self._contexts.append(ctx)
+            self._cond.notify()
+
+
+CONTEXT_POOL = ContextPool()
+
+DEFAULT_SLOT = "0"
+
+
+_REF_PATH = re.compile(r'\[(?:"((?:[^"\\]|\\.)*)"|(\d+))\]')
+
+
+def _resolve_ref(state: Any, path: str):
+    """Follows a `JSON.decycle` path like `$["mySide"]["pokemon"][0]`"""
+    value = state
+    for key, index in _REF_PATH.findall(path[1:]):
+        if index:
+            value = value[int(index)]
+        else:
+            value = value[json.loads(f'"{key}"')]
+    return value
+
+
 def deserialize(state: Dict[str, Union[str, List[str], Dict[str, Any]]]):
     def rez(value):
         nonlocal state
         if isinstance(value, list):
-            for i, element in enumerate(value):
-                if (
-                    isinstance(element, dict) or isinstance(element, list)
-                ) and element is not None:
-                    try:
-                        path = element.get("$ref")
-                    except:
-                        path = None
-                    if isinstance(path, str):
-                        path = path.replace("$", "state")
-                        value[i] = eval(path)
-                    else:
-                        rez(element)
+            items = enumerate(value)
         elif isinstance(value, dict):
-            for name in value.keys():
-                item = value[name]
-                if (
-                    isinstance(item, dict) or isinstance(item, list)
-                ) and item is not None:
-                    try:
-                        path = item.get("$ref")
-                    except:
-                        path = None
-                    if isinstance(path, str):
-                        path = path.replace("$", "state")
-                        value[name] = eval(path)
-                    else:
-                        rez(item)
+            items = value.items()
+        else:
+            return
+        for key, item in list(items):
+            if isinstance(item, (dict, list)):
+                path = item.get("$ref") if isinstance(item, dict) else None
+                if isinstance(path, str):
+                    value[key] = _resolve_ref(state, path)
+                else:
+                    rez(item)
 
     rez(state)
     return state
 
 
+def decode_state(state: Dict[str, Any]):
+    """Resolves the pokemon ids of `engine.exportState` in place.
+
+    Ids are indices into `state["pokemon"]`, so a pokemon that is both
+    active and in its side's `pokemon` list decodes to the same dict.
+    """
+    pokemon = state.pop("pokemon")
+
+    def get(index):
+        return None if index is None else pokemon[index]
+
+    for side_id in ("mySide", "farSide"):
+        side = state[side_id]
+        if side is None:
+            continue
+        side["wisher"] = get(side["wisher"])
+        side["active"] = [get(index) for index in side["active"]]
+        side["pokemon"] = [get(index) for index in side["pokemon"]]
+    return state
+
+
 class BattleRoom:
     title: str
 
-    def __init__(self):
-        self._ctx = MiniRacer()
+    def __init__(
+        self,
+        ctx: MiniRacer = None,
+        slot: str = DEFAULT_SLOT,
+        pool: "BattleRoomPool" = None,
+    ):
+        if pool is not None:
+            self._ctx = pool._ctx
+            self._lock = pool._lock
+        else:
+            self._ctx = ctx if ctx is not None else CONTEXT_POOL.acquire()
+            self._lock = threading.RLock()
+        self._slot = slot
+        self._pool = pool
         self._battle_tag = None
+        self._outgoing = None
+        self.status: Dict[str, Any] = None
+        self.protocol: List[str] = []
         self.myPokemon = None
         self.request = None
         self.ended = False
-        self._load_js()
 
-    def _load_js(self):
-        for file in SRC:
-            with open(file, "r", encoding="utf-8") as f:
-                file_src = f.read()
-            try:
-                modules = re.findall(r"(module\.exports \= .*)", file_src)
-                for module in modules:
-                    file_src = file_src.replace(module, "")
-                self._ctx.eval(file_src)
-            except Exception as e:
-                print(e)
-                print(file)
-                exit()
-        self._ctx.eval("engine.start()")
+    def close(self):
+        """Frees this room's client slot, returning an owned context to `CONTEXT_POOL`"""
+        if self._ctx is None:
+            return
+        if self._pool is not None:
+            self._pool.release(self)
+        else:
+            CONTEXT_POOL.release(self._ctx)
+        self._ctx = None
 
     def _call(self, cmd, *args):
         js = cmd + "({})".format(json.dumps(args)[1:-1])
         return self._execute(js)
 
     def _execute(self, expr, timeout=None, max_memory=None):
-        wrapped_expr = "JSON.stringify((function(){return (%s)})())" % expr
-        ret = self._ctx.eval(wrapped_expr, timeout=timeout, max_memory=max_memory)
+        # select this room's client in the same eval, the context may be shared
+        wrapped_expr = "JSON.stringify((function(){engine.use(%s); return (%s)})())" % (
+            json.dumps(self._slot),
+            expr,
+        )
+        with self._lock:
+            ret = self._ctx.eval(wrapped_expr, timeout=timeout, max_memory=max_memory)
         if not is_unicode(ret):
             return None
         return self._ctx.json_impl.loads(ret)
@@ -110,10 +238,40 @@ class BattleRoom:
     def recieve(self, data: str = ""):
         return self._execute("engine.receive({})".format(json.dumps(data)))
 
+    def step(self, data: str, ingest: bool = True) -> Dict[str, Any]:
+        """Ingests a message and returns everything needed to act on it.
+
+        The status holds `actionRequired`, `ended`, `waiting`, `tier`,
+        `gameType`, `controls`, `choice`, `forceSwitch`, `outgoing` and, when
+        an action is required, the exported `battle`. Ingested lines are
+        appended to `protocol`.
+        """
+        if ingest:
+            self.protocol += data.split("\n")
+        status = self._execute(
+            "engine.step({}, {})".format(json.dumps(data), json.dumps(ingest))
+        )
+        return self._update_status(status)
+
+    def _update_status(self, status: Dict[str, Any]):
+        if status["outgoing"]:
+            self._outgoing = status["outgoing"]
+        if status["battle"] is not None:
+            status["battle"] = decode_state(status["battle"])
+        self.status = status
+        return status
+
     def get_js_attr(self, attr: str):
         return self._execute(f"engine.client.{attr}")
 
     def get_battle(self, raw: bool = False):
+        battle = self._execute("engine.exportState()")
+        if not raw:
+            battle = decode_state(battle)
+        return battle
+
+    def get_full_battle(self, raw: bool = False):
+        """The whole decycled battle object, not just what the actors read"""
         battle = self._execute("engine.serializeBattle()")
         if not raw:
             battle = deserialize(battle)
@@ -141,14 +299,17 @@ class BattleRoom:
         return self._execute("engine.getReward()")
 
     def reset(self):
-        self._ctx.eval("engine.reset()")
+        self._execute("engine.reset()")
         self._battle_tag = None
+        self._outgoing = None
+        self.status = None
+        self.protocol = []
 
     # choice start
 
     def choose_move_target(self, posString):
-        return self._execute(
-            "engine.chooseMoveTarget({})".format(json.dumps(posString))
+        return self._update_status(
+            self._execute("engine.chooseMoveTarget({})".format(json.dumps(posString)))
         )
 
     def choose_move(
@@ -164,22 +325,30 @@ class BattleRoom:
         args = [pos, target, isMega, isZMove, isUltraBurst, isDynamax, isTerastal]
         args = json.dumps(args)[1:-1]
         cmd = "engine.chooseMove({})".format(args)
-        return self._execute(cmd)
+        return self._update_status(self._execute(cmd))
 
     def choose_shift(self):
-        return self._execute("engine.chooseShift()")
+        return self._update_status(self._execute("engine.chooseShift()"))
 
     def choose_switch(self, pos: str):
-        return self._execute("engine.chooseSwitch({})".format(json.dumps(pos)))
+        return self._update_status(
+            self._execute("engine.chooseSwitch({})".format(json.dumps(pos)))
+        )
 
     def choose_switch_target(self, pos: str):
-        return self._execute("engine.chooseSwitchTarget({})".format(json.dumps(pos)))
+        return self._update_status(
+            self._execute("engine.chooseSwitchTarget({})".format(json.dumps(pos)))
+        )
 
     def choose_team_preview(self, pos: str):
-        return self._execute("engine.chooseTeamPreview({})".format(json.dumps(pos)))
+        return self._update_status(
+            self._execute("engine.chooseTeamPreview({})".format(json.dumps(pos)))
+        )
 
-    def pop_outgoing(self):
-        return self._execute("engine.popOutgoing()")
+    def pop_outgoing(self) -> str:
+        """Returns the message to send picked up by the last `step` or choice"""
+        outgoing, self._outgoing = self._outgoing, None
+        return outgoing
 
     # choice end
 
@@ -198,6 +367,53 @@ class BattleRoom:
         return self._battle_tag
 
 
+class BattleRoomPool:
+    """Hosts many `BattleRoom`s in a single js context.
+
+    Every room gets its own client instance (keyed by `slot`) inside the
+    context, so the dex data is only loaded once no matter how many
+    battles are running. Calls into the context are serialized with a lock,
+    so rooms can be driven from different threads.
+    """
+
+    def __init__(self, ctx: MiniRacer = None):
+        self._ctx = ctx if ctx is not None else CONTEXT_POOL.acquire()
+        self._lock = threading.RLock()
+        self._rooms: Dict[str, BattleRoom] = {}
+        self._count = 0
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def room(self, slot: str = None) -> BattleRoom:
+        with self._lock:
+            if slot is None:
+                self._count += 1
+                slot = f"room{self._count}"
+            if slot in self._rooms:
+                raise ValueError(f"slot {slot} is already in use")
+            self._ctx.eval("engine.create({})".format(json.dumps(slot)))
+            room = BattleRoom(slot=slot, pool=self)
+            self._rooms[slot] = room
+        return room
+
+    def release(self, room: BattleRoom):
+        with self._lock:
+            if self._rooms.pop(room._slot, None) is not None:
+                self._ctx.eval("engine.destroy({})".format(json.dumps(room._slot)))
+
+    def close(self):
+        """Returns the shared context to `CONTEXT_POOL`"""
+        if self._ctx is None:
+            return
+        with self._lock:
+            for room in list(self._rooms.values()):
+                room._ctx = None
+            self._rooms.clear()
+            CONTEXT_POOL.release(self._ctx)
+            self._ctx = None
+
+
 def main():
     room = BattleRoom()
 
@@ -0,0 +1,179 @@
+import os
+import json
+import uuid
+import asyncio
+
+from typing import Dict, List, Sequence
+
+SHOWDOWN_PATH = os.environ.get("SHOWDOWN_PATH", "pokemon-showdown")
+
+SIDES = ("p1", "p2")
+
+
+def simulator_command(showdown_path: str = SHOWDOWN_PATH) -> List[str]:
+    """Runs one battle of the `simulate-battle` stream protocol over stdin/stdout"""
+    return ["node", os.path.join(showdown_path, "pokemon-showdown"), "simulate-battle"]
+
+
+def split_for(side: str, lines: Sequence[str]) -> List[str]:
+    """The lines `side` sees, keeping the secret half of its own `|split|`
+    pairs and the shared half of everyone else's"""
+    seen = []
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        if line.startswith("|split|"):
+            secret, shared = lines[index + 1], lines[index + 2]
+            line = secret if line[len("|split|") :] == side else shared
+            index += 3
+        else:
+            index += 1
+        if line:
+            seen.append(line)
+    return seen
+
+
+def to_sim_command(side: str, message: str) -> str:
+    """Translates what a client would send the server into a sim command,
+    or returns None if the sim has no use for it"""
+    if message.startswith("/choose "):
+        command = message[len("/choose ") :]
+    elif message.startswith("/team ") or message.startswith("/undo"):
+        command = message[1:]
+    else:
+        return None
+    # the rqid only matters to the server
+    command = command.split("|")[0]
+    return f">{side} {command}"
+
+
+class LocalBattleStream:
+    """One battle against a local simulator, with no server in between.
+
+    Drives `pokemon-showdown simulate-battle` over stdin/stdout and hands
+    each side the messages it would have been sent over the websocket,
+    `>battle-tag` prefix included, so both players' `BattleRoom`s can be
+    fed directly. Choices go back through `send` as the client wrote them.
+    """
+
+    def __init__(self, battle_format: str, command: Sequence[str] = None):
+        self.battle_format = battle_format
+        self.command = simulator_command() if command is None else list(command)
+        self.battle_tag = f"battle-{battle_format}-{uuid.uuid4().hex[:12]}"
+        self.queues: Dict[str, asyncio.Queue] = {
+            side: asyncio.Queue() for side in SIDES
+        }
+        self.ended = False
+
+        self._process = None
+        self._reader = None
+        self._started = set()
+        self._ties = set()
+        self._title = ""
+
+    async def spawn(self) -> "LocalBattleStream":
+        """Starts the simulator process, which can load before the battle starts"""
+        if self._process is None:
+            self._process = await asyncio.create_subprocess_exec(
+                *self.command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+            )
+        return self
+
+    async def start(self, usernames: Sequence[str], team: str = None, seed=None):
+        await self.spawn()
+        self._title = " vs. ".join(usernames)
+        self._reader = asyncio.ensure_future(self._run())
+
+        spec = {"formatid": self.battle_format}
+        if seed is not None:
+            spec["seed"] = seed
+        await self._write(f">start {json.dumps(spec)}")
+        for side, username in zip(SIDES, usernames):
+            options = {"name": username}
+            # random formats are sent "null", leaving the sim to make the team
+            if team is not None and team != "null":
+                options["team"] = team
+            await self._write(f">player {side} {json.dumps(options)}")
+
+    async def receive(self, side: str) -> str:
+        message = await self.queues[side].get()
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    async def send(self, side: str, message: str):
+        if message.startswith("/offertie"):
+            # the sim ties at once, so wait until both sides have offered
+            self._ties.add(side)
+            if len(self._ties) == len(SIDES):
+                await self._write(">forcetie")
+            return
+        command = to_sim_command(side, message)
+        if command is not None:
+            await self._write(command)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+
+    async def wait_closed(self):
+        if self._process is not None:
+            await self._process.wait()
+
+    async def _write(self, line: str):
+        try:
+            self._process.stdin.write((line + "\n").encode())
+            await self._process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # the reader tells both sides if the sim exited before the end
+            pass
+
+    async def _run(self):
+        try:
+            chunk = []
+            while True:
+                line = await self._process.stdout.readline()
+                if not line:
+                    break
+                line = line.decode().rstrip("\n")
+                if line:
+                    chunk.append(line)
+                elif len(chunk) >= 2 and chunk[-2].startswith("|split|"):
+                    # a split with nothing to show everyone else
+                    chunk.append(line)
+                elif chunk:
+                    self.dispatch(chunk[0], chunk[1:])
+                    chunk = []
+            if chunk:
+                self.dispatch(chunk[0], chunk[1:])
+            if not self.ended:
+                raise ConnectionError(f"{self.battle_tag}: simulator exited")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            for queue in self.queues.values():
+                queue.put_nowait(e)
+
+    def dispatch(self, chunk_type: str, lines: List[str]):
+        if chunk_type == "update":
+            for side in SIDES:
+                self._deliver(side, split_for(side, lines))
+        elif chunk_type == "sideupdate":
+            self._deliver(lines[0], lines[1:])
+        elif chunk_type == "end":
+            self.ended = True
+
+    def _deliver(self, side: str, lines: List[str]):
+        if not lines:
+            return
+        if side not in self._started:
+            # what the server sends when the player joins the room, on its
+            # own since the client only reads a request at the start of one
+            self._started.add(side)
+            self._deliver(side, ["|init|battle", f"|title|{self._title}"])
+        self.queues[side].put_nowait(f">{self.battle_tag}\n" + "\n".join(lines))
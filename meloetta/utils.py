@@ -1,6 +1,6 @@
 import torch
 
-from typing import Dict, List
+from typing import Dict
 
 from meloetta.data import CHOICE_FLAGS
 
@@ -249,13 +249,14 @@ def create_buffers(num_buffers: int, trajectory_length: int, gen: int, gametype:
         trajectory_length, gen, gametype, private_reserve_size
     )
 
-    buffers: Dict[str, List[torch.Tensor]] = {key: [] for key in buffer_specs}
-    for _ in range(num_buffers):
-        for key in buffer_specs:
-            if key.endswith("_mask"):
-                buffers[key].append(torch.ones(**buffer_specs[key]).share_memory_())
-            else:
-                buffers[key].append(torch.zeros(**buffer_specs[key]).share_memory_())
+    # one shared slab per key, `[num_buffers, trajectory_length, ...]`
+    buffers: Dict[str, torch.Tensor] = {}
+    for key, spec in buffer_specs.items():
+        size = (num_buffers, *spec["size"])
+        if key.endswith("_mask"):
+            buffers[key] = torch.ones(size, dtype=spec["dtype"]).share_memory_()
+        else:
+            buffers[key] = torch.zeros(size, dtype=spec["dtype"]).share_memory_()
     return buffers
 
 
@@ -1,5 +1,8 @@
+import re
 import json
+import operator
 import warnings
+import functools
 
 try:
     import torch
@@ -14,7 +17,7 @@ except ModuleNotFoundError:
 from meloetta.room import BattleRoom
 from meloetta.utils import expand_bt
 
-from typing import Union, NamedTuple, Tuple, List, Dict, Any
+from typing import Union, NamedTuple, Callable, Tuple, List, Dict, Set, FrozenSet, Any
 
 from meloetta.data import (
     BOOSTS,
@@ -34,8 +37,6 @@ from meloetta.data import (
 
 
 _DEFAULT_BACKEND = "torch"
-_ACTIVE_SIZE = 158
-_RESERVE_SIZE = 37
 
 
 class NamedVector(NamedTuple):
@@ -43,6 +44,103 @@ class NamedVector(NamedTuple):
     schema: Dict[str, Tuple[int, int]]
 
 
+class FieldLayout(NamedTuple):
+    schema: Dict[str, Tuple[int, int]]
+    size: int
+    dtype: Any
+    scalars: Callable[[Any], Tuple[Any, ...]]
+    scalar_index: np.ndarray
+    lists: List[Tuple[str, int, int]]
+
+
+@functools.lru_cache(maxsize=None)
+def compile_layout(cls, gen: int) -> FieldLayout:
+    """Fixed offsets of every field of `cls` in `gen`.
+
+    Fields listed in `cls._gens` take no columns outside of those gens and
+    fields in `cls._widths` take that many columns, the rest take one.
+    """
+    schema = {}
+    scalars = []
+    scalar_index = []
+    lists = []
+    offset = 0
+    for field in cls._fields:
+        start = offset
+        if gen in cls._gens.get(field, (gen,)):
+            if field in cls._widths:
+                offset += cls._widths[field]
+                lists.append((field, start, offset))
+            else:
+                offset += 1
+                scalars.append(field)
+                scalar_index.append(start)
+        schema[field] = (start, offset)
+
+    return FieldLayout(
+        schema=schema,
+        size=offset,
+        dtype=cls._dtype,
+        scalars=operator.attrgetter(*scalars),
+        scalar_index=np.array(scalar_index),
+        lists=lists,
+    )
+
+
+def write_fields(value: NamedTuple, out: np.ndarray, layout: FieldLayout):
+    out[layout.scalar_index] = layout.scalars(value)
+    for field, start, finish in layout.lists:
+        out[start:finish] = getattr(value, field)
+
+
+@functools.lru_cache(maxsize=None)
+def _gen_with_fields(cls, present: FrozenSet[str]) -> int:
+    for gen in range(1, 10):
+        if present == {field for field, gens in cls._gens.items() if gen in gens}:
+            return gen
+    raise ValueError(f"No gen has exactly these {cls.__name__} fields: {present}")
+
+
+def infer_gen(value: NamedTuple) -> int:
+    """A gen whose layout matches the gen specific fields `value` has set.
+    Gens with the same fields share a layout, so any of them will do."""
+    present = frozenset(
+        field for field in type(value)._gens if getattr(value, field) is not None
+    )
+    return _gen_with_fields(type(value), present)
+
+
+def vector_fields(
+    value: NamedTuple,
+    gen: int = None,
+    backend: str = _DEFAULT_BACKEND,
+    with_schema: bool = False,
+    *args,
+    **kwargs,
+):
+    if gen is None:
+        gen = infer_gen(value)
+    layout = compile_layout(type(value), gen)
+    arr = np.empty(layout.size, dtype=layout.dtype)
+    write_fields(value, arr, layout)
+
+    if backend == "numpy":
+        arr = np.array(arr, *args, **kwargs) if args or kwargs else arr
+    elif backend == "torch":
+        arr = (
+            torch.tensor(arr, *args, **kwargs)
+            if args or kwargs
+            else torch.from_numpy(arr)
+        )
+    else:
+        raise ValueError("Invalid Backend, must be one of `numpy` or `torch`")
+
+    if with_schema:
+        return NamedVector(arr, layout.schema)
+    else:
+        return arr
+
+
 class PublicSide(NamedTuple):
     n: torch.Tensor
     total_pokemon: torch.Tensor
@@ -85,39 +183,34 @@ class PrivatePokemon(NamedTuple):
     terastallized: Union[torch.Tensor, None]
     moves: Union[torch.Tensor, None]
 
+    # [field: gens the field exists in], the rest exist in every gen
+    _gens = {
+        "canGmax": {8},
+        "commanding": {9},
+        "reviving": {9},
+        "teraType": {9},
+        "terastallized": {9},
+    }
+    _widths = {"moves": 8}
+    _dtype = np.int64
+
+    @classmethod
+    def layout(cls, gen: int) -> FieldLayout:
+        return compile_layout(cls, gen)
+
+    def write(self, out: np.ndarray, gen: int):
+        """Writes this pokemon into `out`, a row of `layout(gen).size`"""
+        write_fields(self, out, compile_layout(type(self), gen))
+
     def vector(
         self,
         backend: str = _DEFAULT_BACKEND,
         with_schema: bool = False,
         *args,
-        **kwargs
+        gen: int = None,
+        **kwargs,
     ):
-        arr = []
-        schema = {}
-
-        for field in self._fields:
-            value = getattr(self, field)
-
-            start = len(arr)
-            if isinstance(value, int) or isinstance(value, float):
-                arr.append(value)
-            elif isinstance(value, list):
-                arr += value
-
-            finish = len(arr)
-            schema[field] = (start, finish)
-
-        if backend == "numpy":
-            arr = np.array(arr, *args, **kwargs)
-        elif backend == "torch":
-            arr = torch.tensor(arr, *args, **kwargs)
-        else:
-            raise ValueError("Invalid Backend, must be one of `numpy` or `torch`")
-
-        if with_schema:
-            return NamedVector(arr, schema)
-        else:
-            return arr
+        return vector_fields(self, gen, backend, with_schema, *args, **kwargs)
 
 
 class ReservePublicPokemon(NamedTuple):
@@ -144,38 +237,28 @@ class ReservePublicPokemon(NamedTuple):
     sideid: torch.Tensor
     moves: torch.Tensor
 
+    _gens = {}
+    _widths = {"moves": 16}
+    # hp is a ratio
+    _dtype = np.float32
+
+    @classmethod
+    def layout(cls, gen: int) -> FieldLayout:
+        return compile_layout(cls, gen)
+
+    def write(self, out: np.ndarray, gen: int):
+        """Writes this pokemon into `out`, a row of `layout(gen).size`"""
+        write_fields(self, out, compile_layout(type(self), gen))
+
     def vector(
         self,
         backend: str = _DEFAULT_BACKEND,
         with_schema: bool = False,
         *args,
-        **kwargs
+        gen: int = None,
+        **kwargs,
     ):
-        arr = []
-        schema = {}
-
-        for field in self._fields:
-            value = getattr(self, field)
-
-            start = len(arr)
-            if isinstance(value, int) or isinstance(value, float):
-                arr.append(value)
-            elif isinstance(value, list):
-                arr += value
-            finish = len(arr)
-            schema[field] = (start, finish)
-
-        if backend == "numpy":
-            arr = np.array(arr, *args, **kwargs)
-        elif backend == "torch":
-            arr = torch.tensor(arr, *args, **kwargs)
-        else:
-            raise ValueError("Invalid Backend, must be one of `numpy` or `torch`")
-
-        if with_schema:
-            return NamedVector(arr, schema)
-        else:
-            return arr
+        return vector_fields(self, gen, backend, with_schema, *args, **kwargs)
 
 
 class ActivePublicPokemon(NamedTuple):
@@ -204,38 +287,27 @@ class ActivePublicPokemon(NamedTuple):
     side: torch.Tensor
     moves: torch.Tensor
 
+    _gens = {}
+    _widths = {"boosts": len(BOOSTS), "volatiles": len(VOLATILES), "moves": 16}
+    _dtype = np.float32
+
+    @classmethod
+    def layout(cls, gen: int) -> FieldLayout:
+        return compile_layout(cls, gen)
+
+    def write(self, out: np.ndarray, gen: int):
+        """Writes this pokemon into `out`, a row of `layout(gen).size`"""
+        write_fields(self, out, compile_layout(type(self), gen))
+
     def vector(
         self,
         backend: str = _DEFAULT_BACKEND,
         with_schema: bool = False,
         *args,
-        **kwargs
+        gen: int = None,
+        **kwargs,
     ):
-        arr = []
-        schema = {}
-
-        for field in self._fields:
-            value = getattr(self, field)
-
-            start = len(arr)
-            if isinstance(value, int) or isinstance(value, float):
-                arr.append(value)
-            elif isinstance(value, list):
-                arr += value
-            finish = len(arr)
-            schema[field] = (start, finish)
-
-        if backend == "numpy":
-            arr = np.array(arr, *args, **kwargs)
-        elif backend == "torch":
-            arr = torch.tensor(arr, *args, **kwargs)
-        else:
-            raise ValueError("Invalid Backend, must be one of `numpy` or `torch`")
-
-        if with_schema:
-            return NamedVector(arr, schema)
-        else:
-            return arr
+        return vector_fields(self, gen, backend, with_schema, *args, **kwargs)
 
 
 class State(NamedTuple):
@@ -301,16 +373,7 @@ class VectorizedState:
         player_id = torch.tensor(player_id)
         player_id = expand_bt(player_id)
 
-        pseudoweathers = {
-            (pseudoweather[0]).replace(" ", "").lower(): pseudoweather[1:]
-            for pseudoweather in self.battle["pseudoWeather"]
-        }
-        pseudoweathers = torch.stack(
-            [
-                torch.tensor(pseudoweathers.get(pseudoweather, [-1, -1]))
-                for pseudoweather in PSEUDOWEATHERS
-            ]
-        )
+        pseudoweathers = self._vectorize_pseudoweathers()
         pseudoweathers = expand_bt(pseudoweathers)
 
         weather = torch.tensor(get_weather_token(self.battle["weather"]))
@@ -337,6 +400,18 @@ class VectorizedState:
             log=self.battle.get("stepQueue", []),
         )
 
+    def _vectorize_pseudoweathers(self) -> torch.Tensor:
+        pseudoweathers = {
+            (pseudoweather[0]).replace(" ", "").lower(): pseudoweather[1:]
+            for pseudoweather in self.battle["pseudoWeather"]
+        }
+        return torch.stack(
+            [
+                torch.tensor(pseudoweathers.get(pseudoweather, [-1, -1]))
+                for pseudoweather in PSEUDOWEATHERS
+            ]
+        )
+
     def _vectorize_public_sides(self) -> PublicSide:
         p1 = self._vectorize_public_side("mySide")
         p2 = self._vectorize_public_side("farSide")
@@ -346,17 +421,16 @@ class VectorizedState:
         return PublicSide(**combined_fields)
 
     def _vectorize_private_side(self) -> PrivateSide:
-        reserve = [
-            self._vectorize_private_pokemon(pokemon)
-            for pokemon in (self.battle["myPokemon"])
-        ]
-        reserve += [-torch.ones_like(reserve[0]) for _ in range(6 - len(reserve))]
+        layout = PrivatePokemon.layout(self.gen)
+        reserve = np.full((6, layout.size), -1, dtype=layout.dtype)
+        for pokemon, row in zip(self.battle["myPokemon"], reserve):
+            self._vectorize_private_pokemon(pokemon, row)
 
-        reserve = torch.stack(reserve)
+        reserve = torch.from_numpy(reserve)
         reserve = expand_bt(reserve)
         return PrivateSide(reserve=reserve)
 
-    def _vectorize_private_pokemon(self, pokemon: Dict[str, Any]):
+    def _vectorize_private_pokemon(self, pokemon: Dict[str, Any], out: np.ndarray):
         if self.gen == 9:
             if pokemon.get("commanding"):
                 commanding = 1
@@ -429,7 +503,7 @@ class VectorizedState:
             terastallized=terastallized,
             moves=moves,
         )
-        return private_pokemon.vector()
+        private_pokemon.write(out, self.gen)
 
     def _vectorize_public_side(self, side_id: str):
         side = self.battle[side_id]
@@ -463,46 +537,39 @@ class VectorizedState:
         active_idents = [p["ident"] for p in active_pokemon]
         reserve_pokemon = [p for p in pokemon if p["ident"] not in active_idents]
 
-        active = [
-            self._vectorize_public_active_pokemon(side_id, p) for p in active_pokemon
-        ]
-        active += [-torch.ones(_ACTIVE_SIZE) for _ in range(controlling - len(active))]
-        active = torch.stack(active)
+        layout = ActivePublicPokemon.layout(self.gen)
+        active = np.full(
+            (max(controlling, len(active_pokemon)), layout.size),
+            -1,
+            dtype=layout.dtype,
+        )
+        for p, row in zip(active_pokemon, active):
+            self._vectorize_public_active_pokemon(side_id, p, row)
+        active = torch.from_numpy(active)
         active = expand_bt(active)
 
-        reserve = [
-            self._vectorize_public_reserve_pokemon(side_id, p) for p in reserve_pokemon
-        ]
-        num_reserve_padding = 6 - len(reserve)
-        reserve += [-torch.ones(_RESERVE_SIZE) for _ in range(num_reserve_padding)]
+        layout = ReservePublicPokemon.layout(self.gen)
+        reserve = np.full(
+            (max(6, len(reserve_pokemon)), layout.size), -1, dtype=layout.dtype
+        )
+        for p, row in zip(reserve_pokemon, reserve):
+            self._vectorize_public_reserve_pokemon(side_id, p, row)
 
-        reserve = torch.stack(reserve)
+        reserve = torch.from_numpy(reserve)
         reserve = expand_bt(reserve)
 
-        side_conditions = torch.stack(
-            [
-                torch.tensor(
-                    side["sideConditions"].get(side_condition, [None, 0, -1, -1])[1:]
-                )
-                for side_condition in SIDE_CONDITIONS
-                if side_condition
-                not in {"stealthrock", "spikes", "toxicspikes", "stickyweb"}
-            ]
-        )
+        (
+            side_conditions,
+            stealthrock,
+            spikes,
+            toxicspikes,
+            stickyweb,
+        ) = self._vectorize_side_conditions(side_id)
         # [effectName, levels, minDuration, maxDuration]
         side_conditions = expand_bt(side_conditions)
-
-        stealthrock = torch.tensor(
-            side["sideConditions"].get("stealthrock", [None, 0])[1]
-        )
         stealthrock = expand_bt(stealthrock)
-        spikes = torch.tensor(side["sideConditions"].get("spikes", [None, 0])[1])
         spikes = expand_bt(spikes)
-        toxicspikes = torch.tensor(
-            side["sideConditions"].get("toxicspikes", [None, 0])[1]
-        )
         toxicspikes = expand_bt(toxicspikes)
-        stickyweb = torch.tensor(side["sideConditions"].get("stickyweb", [None, 0])[1])
         stickyweb = expand_bt(stickyweb)
 
         n = torch.tensor(side["n"])
@@ -532,10 +599,31 @@ class VectorizedState:
             wisher=wisher_slot,
         )
 
-    def _vectorize_public_active_pokemon(self, side_id: str, pokemon: Dict[str, Any]):
-        if pokemon is None:
-            return None
+    def _vectorize_side_conditions(self, side_id: str) -> Tuple[torch.Tensor, ...]:
+        side = self.battle[side_id]
+        side_conditions = torch.stack(
+            [
+                torch.tensor(
+                    side["sideConditions"].get(side_condition, [None, 0, -1, -1])[1:]
+                )
+                for side_condition in SIDE_CONDITIONS
+                if side_condition
+                not in {"stealthrock", "spikes", "toxicspikes", "stickyweb"}
+            ]
+        )
+        stealthrock = torch.tensor(
+            side["sideConditions"].get("stealthrock", [None, 0])[1]
+        )
+        spikes = torch.tensor(side["sideConditions"].get("spikes", [None, 0])[1])
+        toxicspikes = torch.tensor(
+            side["sideConditions"].get("toxicspikes", [None, 0])[1]
+        )
+        stickyweb = torch.tensor(side["sideConditions"].get("stickyweb", [None, 0])[1])
+        return side_conditions, stealthrock, spikes, toxicspikes, stickyweb
 
+    def _vectorize_public_active_pokemon(
+        self, side_id: str, pokemon: Dict[str, Any], out: np.ndarray
+    ):
         moves = []
         if side_id not in self.moves:
             self.moves[side_id] = {}
@@ -581,9 +669,11 @@ class VectorizedState:
             side=0 if side_id == "mySide" else 1,
             moves=moves,
         )
-        return active.vector()
+        active.write(out, self.gen)
 
-    def _vectorize_public_reserve_pokemon(self, side_id: str, pokemon: Dict[str, Any]):
+    def _vectorize_public_reserve_pokemon(
+        self, side_id: str, pokemon: Dict[str, Any], out: np.ndarray
+    ):
         moves = []
         for move, pp in pokemon["moveTrack"]:
             moves += [get_move_token(self.gen, "name", move), pp]
@@ -618,4 +708,162 @@ class VectorizedState:
             sideid=0 if side_id == "mySide" else 1,
             moves=moves,  #
         )
-        return reserve.vector()
+        reserve.write(out, self.gen)
+
+
+_IDENT = re.compile(r"\b(p[1-4])[a-d]?: ([^|\n]+)")
+
+# lines that can change any pokemon of the side they name
+_SIDE_LINES = {"-cureteam", "replace", "poke", "detailschange"}
+# lines that start over the teams
+_RESET_LINES = {"init", "start", "clearpoke", "teampreview"}
+# lines after which the client may have updated side conditions or pseudo weather
+_SIDE_CONDITION_LINES = {
+    "turn",
+    "upkeep",
+    "-sidestart",
+    "-sideend",
+    "-swapsideconditions",
+    "-activate",
+}
+_PSEUDO_WEATHER_LINES = {
+    "turn",
+    "upkeep",
+    "-fieldstart",
+    "-fieldend",
+    "-activate",
+    "-fieldactivate",
+}
+
+
+class ProtocolDelta(NamedTuple):
+    reset: bool
+    idents: Set[str]
+    sides: Set[str]
+    side_conditions: bool
+    pseudo_weather: bool
+
+    def touched(self, ident: str) -> bool:
+        return ident in self.idents or ident[:2] in self.sides
+
+
+class ProtocolTracker:
+    """Follows `room.protocol` and reports what the lines since the last update touched"""
+
+    def __init__(self):
+        self._protocol = None
+        self._position = 0
+
+    def update(self, room: BattleRoom) -> ProtocolDelta:
+        # `BattleRoom.reset` starts a new list, `step` extends it in place
+        reset = room.protocol is not self._protocol
+        if reset:
+            self._protocol = room.protocol
+            self._position = 0
+
+        lines = room.protocol[self._position :]
+        self._position = len(room.protocol)
+
+        idents = set()
+        sides = set()
+        side_conditions = False
+        pseudo_weather = False
+        for line in lines:
+            if not line.startswith("|"):
+                continue
+            cmd = line.split("|", 2)[1]
+            if cmd == "request":
+                continue
+            reset |= cmd in _RESET_LINES
+            side_conditions |= cmd in _SIDE_CONDITION_LINES
+            pseudo_weather |= cmd in _PSEUDO_WEATHER_LINES
+            for side, name in _IDENT.findall(line):
+                idents.add(f"{side}: {name}")
+                if cmd in _SIDE_LINES:
+                    sides.add(side)
+
+        return ProtocolDelta(
+            reset=reset,
+            idents=idents,
+            sides=sides,
+            side_conditions=side_conditions,
+            pseudo_weather=pseudo_weather,
+        )
+
+
+class IncrementalVectorizedState(VectorizedState):
+    """Vectorizes successive states of one battle.
+
+    Rows of reserve pokemon, side conditions and pseudo weather are reused
+    until a protocol line since the last call could have changed them.
+    Active pokemon are always re-encoded and private pokemon are reused
+    only when their request data is unchanged. The returned state is the
+    same as `VectorizedState.from_battle` would give.
+    """
+
+    def __init__(self, room: BattleRoom):
+        self.room = room
+        self.tracker = ProtocolTracker()
+        self._clear()
+
+    def _clear(self):
+        self._reserve_rows: Dict[Tuple[str, str], np.ndarray] = {}
+        self._private_rows: Dict[
+            str, Tuple[Dict[str, Any], Dict[str, int], np.ndarray]
+        ] = {}
+        self._side_conditions: Dict[str, Tuple[torch.Tensor, ...]] = {}
+        self._pseudoweathers: torch.Tensor = None
+        self._prev_active: Set[str] = set()
+
+    def vectorize_battle(self, battle: Battle) -> State:
+        self.battle = battle
+        self.gen = self.battle["dex"]["gen"]
+        self.moves = {}
+
+        self._delta = self.tracker.update(self.room)
+        if self._delta.reset:
+            self._clear()
+        if self._delta.side_conditions:
+            self._side_conditions = {}
+        if self._delta.pseudo_weather:
+            self._pseudoweathers = None
+
+        state = self.vectorize()
+        self._prev_active = {
+            pokemon["ident"]
+            for side_id in ("mySide", "farSide")
+            for pokemon in self.battle[side_id]["active"]
+            if pokemon is not None
+        }
+        return state
+
+    def _vectorize_pseudoweathers(self) -> torch.Tensor:
+        if self._pseudoweathers is None:
+            self._pseudoweathers = super()._vectorize_pseudoweathers()
+        return self._pseudoweathers.clone()
+
+    def _vectorize_side_conditions(self, side_id: str) -> Tuple[torch.Tensor, ...]:
+        if side_id not in self._side_conditions:
+            self._side_conditions[side_id] = super()._vectorize_side_conditions(side_id)
+        return self._side_conditions[side_id]
+
+    def _vectorize_private_pokemon(self, pokemon: Dict[str, Any], out: np.ndarray):
+        move_track = (self.moves.get("mySide") or {}).get(pokemon["ident"]) or {}
+        cached = self._private_rows.get(pokemon["ident"])
+        if cached is not None and cached[0] == pokemon and cached[1] == move_track:
+            out[:] = cached[2]
+            return
+        super()._vectorize_private_pokemon(pokemon, out)
+        self._private_rows[pokemon["ident"]] = (pokemon, dict(move_track), out.copy())
+
+    def _vectorize_public_reserve_pokemon(
+        self, side_id: str, pokemon: Dict[str, Any], out: np.ndarray
+    ):
+        ident = pokemon["ident"]
+        key = (side_id, ident)
+        row = self._reserve_rows.get(key)
+        if row is None or ident in self._prev_active or self._delta.touched(ident):
+            super()._vectorize_public_reserve_pokemon(side_id, pokemon, out)
+            self._reserve_rows[key] = out.copy()
+        else:
+            out[:] = row
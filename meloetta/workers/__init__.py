@@ -1,2 +1,3 @@
 from meloetta.workers.selfplay import SelfPlayWorker
 from meloetta.workers.eval import EvalWorker
+from meloetta.workers.supervisor import WorkerSupervisor
@@ -4,8 +4,8 @@ import asyncio
 from typing import Any, Sequence, Mapping, Type
 
 from meloetta.player import Player
-from meloetta.room import BattleRoom
-from meloetta.actors.base import Actor
+from meloetta.room import BattleRoom, CONTEXT_POOL
+from meloetta.actors.base import Actor, resolve
 from meloetta.workers.barrier import Barrier
 
 from meloetta.room import BattleRoom
@@ -13,10 +13,7 @@ from meloetta.utils import expand_bt
 
 
 def waiting_for_opp(room: BattleRoom):
-    controls = room.get_js_attr("controls.controls")
-    return (
-        "Waiting for opponent" in controls or " will switch in, replacing" in controls
-    )
+    return room.status["waiting"]
 
 
 DRAW_BY_TURNS = 300
@@ -65,6 +62,9 @@ class EvalWorker:
         Start selfplay between two asynchronous actors-
         """
 
+        # load the js contexts while the players connect and login
+        CONTEXT_POOL.warm(2, background=True)
+
         async def selfplay():
             barrier = Barrier(2)
             return await asyncio.gather(
@@ -126,14 +126,16 @@ class EvalWorker:
 
                 if action_required:
                     # inputs to neural net
-                    battle = player.room.get_battle()
+                    battle = await resolve(actor.get_battle(player.room))
                     battle["turn"] = DRAW_BY_TURNS * (
                         1 - (1 - (battle["turn"] / DRAW_BY_TURNS)) ** 2
                     )
                     turn = battle["turn"]
-                    vstate = actor.get_vectorized_state(player.room, battle)
+                    vstate = await resolve(
+                        actor.get_vectorized_state(player.room, battle)
+                    )
 
-                ended = player.room.get_js_attr("battle?.ended")
+                ended = player.room.status["ended"]
                 while (
                     action_required and not waiting_for_opp(player.room) and not ended
                 ):
@@ -145,12 +147,13 @@ class EvalWorker:
                         "targeting": choices.targeting,
                     }
 
-                    func, args, kwargs = actor(state, player.room, choices.choices)
+                    func, args, kwargs = await resolve(
+                        actor(state, player.room, choices.choices)
+                    )
                     func(*args, **kwargs)
 
-                outgoing_message = player.room.get_js_attr("outgoing_message")
+                outgoing_message = player.room.pop_outgoing()
                 if outgoing_message:
-                    player.room.pop_outgoing()
                     if "move" in outgoing_message:
                         turns_since_last_move = turns_since_last_move * 0
                     else:
@@ -175,7 +178,7 @@ class EvalWorker:
                             await player.client.websocket.send(
                                 player.room.battle_tag + "|" + "/offertie"
                             )
-                        ended = player.room.get_js_attr("battle?.ended")
+                        ended = player.room.status["ended"]
                         if ended:
                             break
                     break
@@ -1,11 +1,14 @@
 import torch
 import asyncio
+import functools
 
-from typing import Any, Sequence, Mapping, Type
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Mapping, Type
 
+from meloetta.client import Client
 from meloetta.player import Player
-from meloetta.room import BattleRoom
-from meloetta.actors.base import Actor
+from meloetta.room import BattleRoom, BattleRoomPool, CONTEXT_POOL
+from meloetta.actors.base import Actor, resolve
+from meloetta.simulator import SIDES, LocalBattleStream
 from meloetta.workers.barrier import Barrier
 
 from meloetta.room import BattleRoom
@@ -15,10 +18,7 @@ DRAW_BY_TURNS = 300
 
 
 def waiting_for_opp(room: BattleRoom):
-    controls = room.get_js_attr("controls.controls")
-    return (
-        "Waiting for opponent" in controls or " will switch in, replacing" in controls
-    )
+    return room.status["waiting"]
 
 
 class SelfPlayWorker:
@@ -31,12 +31,25 @@ class SelfPlayWorker:
         actor_fn: Type[Actor],
         actor_args: Sequence[Any] = None,
         actor_kwargs: Mapping[str, Any] = None,
+        share_context: bool = True,
+        battles_per_player: int = 1,
+        local_simulator: bool = False,
+        simulator_command: Sequence[str] = None,
     ):
         self.battle_format = battle_format
         self.team = team
 
         self.worker_index = worker_index
         self.num_players = num_players
+        self.share_context = share_context
+        self.battles_per_player = battles_per_player
+        self.local_simulator = local_simulator
+        self.simulator_command = simulator_command
+        self.room_pool = None
+        self.stop = None
+        # set once a challenger's battle loops have all returned, so its
+        # opponent stops waiting for challenges
+        self.challengers_done: Dict[int, asyncio.Event] = {}
 
         self.actor_fn = actor_fn
         self.actor_args = () if actor_args is None else actor_args
@@ -45,12 +58,37 @@ class SelfPlayWorker:
     def __repr__(self) -> str:
         return f"Worker{self.worker_index}"
 
-    def run(self) -> Any:
+    def run(self, stop: Any = None) -> Any:
         """
         Start selfplay between two asynchronous actors-
+
+        With a `stop` event, every battle loop returns once it is set and its
+        current battle is over.
         """
+        self.stop = stop
+
+        # load the js contexts while the players connect and login
+        if self.share_context:
+            CONTEXT_POOL.warm(1, background=True)
+        else:
+            CONTEXT_POOL.warm(
+                self.num_players * self.battles_per_player, background=True
+            )
 
         async def selfplay():
+            if self.local_simulator:
+                # no server, logins or challenges: each pair of players shares
+                # a simulator process per battle
+                return await asyncio.gather(
+                    *[
+                        self.local_battle_loop(
+                            self.worker_index * self.num_players + i, slot
+                        )
+                        for i in range(0, self.num_players, 2)
+                        for slot in range(self.battles_per_player)
+                    ]
+                )
+
             barrier = Barrier(self.num_players)
             return await asyncio.gather(
                 *[
@@ -59,7 +97,12 @@ class SelfPlayWorker:
                 ]
             )
 
-        results = asyncio.run(selfplay())
+        try:
+            results = asyncio.run(selfplay())
+        finally:
+            if self.room_pool is not None:
+                self.room_pool.close()
+                self.room_pool = None
         return results
 
     async def start_battle(self, player: Player, player_index: int):
@@ -73,97 +116,238 @@ class SelfPlayWorker:
     async def actor(self, player_index: int, barrier: Barrier) -> Any:
         username = f"player{player_index}"
 
-        player = await Player.create(username, None, "localhost:8000")
-        await player.client.login()
+        client = await Client.create(username, None, "localhost:8000")
+        await client.login()
+        # every battle of this login reads its own messages off the connection
+        client.start_router()
         await barrier.wait()
 
-        while True:
-            await self.start_battle(player, player_index)
-
-            turn = 0
-            turns_since_last_move = expand_bt(torch.tensor(0, dtype=torch.long))
-            actor = self.actor_fn(
-                *self.actor_args,
-                **self.actor_kwargs,
-                pid=(0 if player_index % 2 == 0 else 1),
+        # one challenge is in flight at a time, so the next new battle
+        # belongs to whichever battle loop holds the lock
+        start_lock = asyncio.Lock()
+        try:
+            return await asyncio.gather(
+                *[
+                    self.battle_loop(client, player_index, slot, start_lock)
+                    for slot in range(self.battles_per_player)
+                ]
             )
+        finally:
+            if player_index % 2 == 0:
+                self._challengers_done(player_index).set()
+            client.router.stop()
+
+    def stopped(self) -> bool:
+        return self.stop is not None and self.stop.is_set()
+
+    def _challengers_done(self, player_index: int) -> asyncio.Event:
+        challenger = player_index - player_index % 2
+        if challenger not in self.challengers_done:
+            self.challengers_done[challenger] = asyncio.Event()
+        return self.challengers_done[challenger]
+
+    async def next_battle(
+        self, player: Player, player_index: int, start_lock: asyncio.Lock
+    ) -> Optional[str]:
+        """Starts the player's next battle, None once the worker is stopping.
+
+        Challengers decide: one that is stopping sends no more challenges, and
+        its opponent stops waiting for them once all of its battle loops have
+        returned. A challenge that was sent is always accepted, so neither
+        side is left waiting on the other.
+        """
+        async with start_lock:
+            if player_index % 2 == 0:
+                if self.stopped():
+                    return None
+                await self.start_battle(player, player_index)
+                return await player.client.router.next_battle()
+
+            async def accept() -> str:
+                await self.start_battle(player, player_index)
+                return await player.client.router.next_battle()
+
+            accepting = asyncio.ensure_future(accept())
+            done = asyncio.ensure_future(self._challengers_done(player_index).wait())
+            await asyncio.wait({accepting, done}, return_when=asyncio.FIRST_COMPLETED)
+            done.cancel()
+            if accepting.done():
+                return accepting.result()
+            accepting.cancel()
+            return None
+
+    async def battle_loop(
+        self,
+        client: Client,
+        player_index: int,
+        slot: int,
+        start_lock: asyncio.Lock,
+    ) -> Any:
+        username = f"player{player_index}"
+        player = Player.from_client(client, self.get_room(username, slot))
 
-            while True:
-                message = await player.client.receive_message()
-                action_required = player._recieve(message)
-
-                if "is offering a tie." in message:
-                    await player.client.websocket.send(
-                        player.room.battle_tag + "|" + "/offertie"
-                    )
-
-                if "|error" in message:
-                    # edge case for handling when the pokemon is trapped
-                    if "Can't switch: The active Pokémon is trapped" in message:
-                        message = await player.client.receive_message()
-                        action_required = player._recieve(message)
-                        action_required = True
-
-                    # for some reason, disabled max moves are being selected
-                    elif "Can't move" in message:
-                        print(message)
-
-                    else:
-                        print(message)
-
-                if action_required:
-                    # inputs to neural net
-                    battle = player.room.get_battle()
-                    turn = battle["turn"]
-                    vstate = actor.get_vectorized_state(player.room, battle)
-
-                ended = player.room.get_js_attr("battle?.ended")
-                while (
-                    action_required and not waiting_for_opp(player.room) and not ended
-                ):
-                    choices = player.get_choices(turns_since_last_move)
-                    state = {
-                        **vstate,
-                        **choices.action_masks,
-                        **choices.prev_choices,
-                        "targeting": choices.targeting,
-                    }
-
-                    func, args, kwargs = actor(state, player.room, choices.choices)
-                    func(*args, **kwargs)
-
-                outgoing_message = player.room.get_js_attr("outgoing_message")
-                if outgoing_message:
-                    player.room.pop_outgoing()
-                    if "move" in outgoing_message:
-                        turns_since_last_move = turns_since_last_move * 0
-                    else:
-                        turns_since_last_move = turns_since_last_move + 1
-                    await player.client.websocket.send(
-                        player.room.battle_tag + "|" + outgoing_message
-                    )
+        while True:
+            battle_tag = await self.next_battle(player, player_index, start_lock)
+            if battle_tag is None:
+                return
 
-                if ended:
-                    break
+            actor = self.make_actor(player_index)
 
-                if turn > DRAW_BY_TURNS:
-                    print(f"{username}: draw by turn > {DRAW_BY_TURNS}!")
+            async def send(message: str):
+                await client.websocket.send(player.room.battle_tag + "|" + message)
 
-                    await player.client.websocket.send(
-                        player.room.battle_tag + "|" + "/offertie"
-                    )
-                    while True:
-                        message = await player.client.receive_message()
-                        action_required = await player.recieve(message)
-                        if "is offering a tie." in message:
-                            await player.client.websocket.send(
-                                player.room.battle_tag + "|" + "/offertie"
-                            )
-                        ended = player.room.get_js_attr("battle?.ended")
-                        if ended:
-                            break
-                    break
+            await self.play_battle(
+                player,
+                actor,
+                username,
+                functools.partial(client.receive_message, battle_tag),
+                send,
+            )
 
             await player.client.leave_battle(player.room.battle_tag)
             actor.post_match(player.room)
             player.reset()
+
+    async def local_battle_loop(self, player_index: int, slot: int) -> Any:
+        """Battles between `player_index` and the next player, against a local
+        simulator instead of the server"""
+        usernames = [f"player{player_index}", f"player{player_index + 1}"]
+        players = [
+            Player.from_client(None, self.get_room(username, slot))
+            for username in usernames
+        ]
+
+        # the next battle's simulator loads while this one is played
+        spare = await LocalBattleStream(
+            self.battle_format, self.simulator_command
+        ).spawn()
+        try:
+            while not self.stopped():
+                stream = spare
+                spare = await LocalBattleStream(
+                    self.battle_format, self.simulator_command
+                ).spawn()
+
+                actors = [self.make_actor(player_index + i) for i in range(2)]
+                try:
+                    await stream.start(usernames, self.team)
+                    await asyncio.gather(
+                        *[
+                            self.play_battle(
+                                player,
+                                actor,
+                                username,
+                                functools.partial(stream.receive, side),
+                                functools.partial(stream.send, side),
+                            )
+                            for player, actor, username, side in zip(
+                                players, actors, usernames, SIDES
+                            )
+                        ]
+                    )
+                finally:
+                    stream.close()
+                    await stream.wait_closed()
+
+                for player, actor in zip(players, actors):
+                    actor.post_match(player.room)
+                    player.reset()
+        finally:
+            # a crashed battle must not orphan the preloaded simulator
+            spare.close()
+            await spare.wait_closed()
+
+    def get_room(self, username: str, slot: int) -> BattleRoom:
+        if not self.share_context:
+            return None
+        # all players in this worker run their battles in one js context
+        if self.room_pool is None:
+            self.room_pool = BattleRoomPool()
+        return self.room_pool.room(f"{username}-{slot}")
+
+    def make_actor(self, player_index: int) -> Actor:
+        return self.actor_fn(
+            *self.actor_args,
+            **self.actor_kwargs,
+            pid=(0 if player_index % 2 == 0 else 1),
+        )
+
+    async def play_battle(
+        self,
+        player: Player,
+        actor: Actor,
+        username: str,
+        receive: Callable[[], Awaitable[str]],
+        send: Callable[[str], Awaitable[None]],
+    ):
+        """Plays out one battle, reading its messages with `receive` and
+        sending the player's with `send`"""
+        turn = 0
+        turns_since_last_move = expand_bt(torch.tensor(0, dtype=torch.long))
+
+        while True:
+            message = await receive()
+            action_required = player._recieve(message)
+
+            if "is offering a tie." in message:
+                await send("/offertie")
+
+            if "|error" in message:
+                # edge case for handling when the pokemon is trapped
+                if "Can't switch: The active Pokémon is trapped" in message:
+                    message = await receive()
+                    action_required = player._recieve(message)
+                    action_required = True
+
+                # for some reason, disabled max moves are being selected
+                elif "Can't move" in message:
+                    print(message)
+
+                else:
+                    print(message)
+
+            if action_required:
+                # inputs to neural net
+                battle = await resolve(actor.get_battle(player.room))
+                turn = battle["turn"]
+                vstate = await resolve(actor.get_vectorized_state(player.room, battle))
+
+            ended = player.room.status["ended"]
+            while action_required and not waiting_for_opp(player.room) and not ended:
+                choices = player.get_choices(turns_since_last_move)
+                state = {
+                    **vstate,
+                    **choices.action_masks,
+                    **choices.prev_choices,
+                    "targeting": choices.targeting,
+                }
+
+                func, args, kwargs = await resolve(
+                    actor(state, player.room, choices.choices)
+                )
+                func(*args, **kwargs)
+
+            outgoing_message = player.room.pop_outgoing()
+            if outgoing_message:
+                if "move" in outgoing_message:
+                    turns_since_last_move = turns_since_last_move * 0
+                else:
+                    turns_since_last_move = turns_since_last_move + 1
+                await send(outgoing_message)
+
+            if ended:
+                break
+
+            if turn > DRAW_BY_TURNS:
+                print(f"{username}: draw by turn > {DRAW_BY_TURNS}!")
+
+                await send("/offertie")
+                while True:
+                    message = await receive()
+                    action_required = await player.recieve(message)
+                    if "is offering a tie." in message:
+                        await send("/offertie")
+                    ended = player.room.status["ended"]
+                    if ended:
+                        break
+                break
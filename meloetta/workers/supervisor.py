@@ -0,0 +1,159 @@
+import time
+import threading
+import multiprocessing as mp
+
+from typing import Any, Callable, Dict, List
+
+
+class WorkerSupervisor:
+    """Keeps worker processes alive and enough of them to feed the learner.
+
+    `worker_fn(worker_index)` builds a worker with a `run` method. A worker
+    that exits is replaced by one with the next unused index, so it logs in
+    under usernames the server has not seen, and the buffer slots of battles
+    it left unfinished are handed back with `replay_buffer.reclaim`.
+
+    Every `scale_interval` seconds the pool grows by one if the learner has
+    fewer than `batch_size` trajectories waiting while slots are free, and
+    shrinks by one if more than `high_water` batches are waiting.
+
+    Workers are retired cooperatively: `run` is passed a stop event, which
+    the worker checks between battles before returning. Terminating a worker
+    could kill it while it holds a lock of the replay buffer's queues, which
+    would hang every other worker and the learner, so only `stop` does that,
+    to workers still running `stop_timeout` seconds after being asked to stop.
+    """
+
+    def __init__(
+        self,
+        worker_fn: Callable[[int], Any],
+        num_workers: int,
+        min_workers: int = None,
+        max_workers: int = None,
+        replay_buffer: Any = None,
+        batch_size: int = None,
+        high_water: int = 4,
+        interval: float = 1.0,
+        scale_interval: float = 60.0,
+        stop_timeout: float = 600.0,
+        ctx: Any = mp,
+    ):
+        self.worker_fn = worker_fn
+        self.num_workers = num_workers
+        self.min_workers = num_workers if min_workers is None else min_workers
+        self.max_workers = num_workers if max_workers is None else max_workers
+        self.replay_buffer = replay_buffer
+        self.batch_size = batch_size
+        self.high_water = high_water
+        self.interval = interval
+        self.scale_interval = scale_interval
+        self.stop_timeout = stop_timeout
+        self.ctx = ctx
+
+        self.processes: Dict[int, mp.Process] = {}
+        self.stop_events: Dict[int, Any] = {}
+        # retired workers finishing their battles
+        self.retiring: Dict[int, mp.Process] = {}
+        self.restarts = 0
+        self.next_index = 0
+        self._last_scaled = time.monotonic()
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self.processes)
+
+    def spawn(self) -> int:
+        worker_index = self.next_index
+        self.next_index += 1
+        worker = self.worker_fn(worker_index)
+        stop = self.ctx.Event()
+        process = self.ctx.Process(
+            target=worker.run, args=(stop,), name=repr(worker) + str(worker_index)
+        )
+        process.start()
+        self.processes[worker_index] = process
+        self.stop_events[worker_index] = stop
+        return worker_index
+
+    def retire(self, worker_index: int):
+        """Asks a worker to return once its current battles are over, `poll`
+        reaps it after it has"""
+        process = self.processes.pop(worker_index)
+        self.stop_events.pop(worker_index).set()
+        self.retiring[worker_index] = process
+
+    def reap(self, timeout: float = 0) -> List[int]:
+        """Joins retired workers that returned within `timeout` seconds"""
+        deadline = time.monotonic() + timeout
+        reaped = []
+        for worker_index, process in list(self.retiring.items()):
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                continue
+            del self.retiring[worker_index]
+            self._reclaim(process)
+            reaped.append(worker_index)
+        return reaped
+
+    def start(self):
+        for _ in range(self.num_workers):
+            self.spawn()
+
+    def run(self):
+        """Supervises until `stop`, meant for a thread of the learner process"""
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def stop(self):
+        self._stop.set()
+        for worker_index in list(self.processes):
+            self.retire(worker_index)
+        self.reap(self.stop_timeout)
+        for process in self.retiring.values():
+            print(f"{process.name} did not stop, terminating it")
+            process.terminate()
+            process.join()
+            self._reclaim(process)
+        self.retiring.clear()
+
+    def poll(self) -> List[int]:
+        """Replaces dead workers and rescales, returning the indices that died"""
+        dead = [
+            worker_index
+            for worker_index, process in self.processes.items()
+            if not process.is_alive()
+        ]
+        for worker_index in dead:
+            process = self.processes.pop(worker_index)
+            self.stop_events.pop(worker_index)
+            process.join()
+            self._reclaim(process)
+            print(
+                f"{process.name} exited with {process.exitcode}, "
+                f"restarting it as worker {self.next_index}"
+            )
+            self.restarts += 1
+            self.spawn()
+        self.reap()
+
+        now = time.monotonic()
+        if now - self._last_scaled >= self.scale_interval:
+            self._last_scaled = now
+            self.rescale()
+        return dead
+
+    def rescale(self):
+        if self.replay_buffer is None or self.batch_size is None:
+            return
+        waiting = self.replay_buffer.waiting()
+        free = self.replay_buffer.free_queue.qsize()
+        if waiting < self.batch_size and free > 0:
+            if len(self) < self.max_workers:
+                self.spawn()
+        elif waiting > self.high_water * self.batch_size:
+            if len(self) > self.min_workers:
+                self.retire(max(self.processes))
+
+    def _reclaim(self, process: mp.Process):
+        if self.replay_buffer is not None:
+            self.replay_buffer.reclaim(process.pid)